@@ -0,0 +1,39 @@
+"""add position ledgers
+
+Revision ID: 004
+Revises: c2400e4781c9
+Create Date: 2026-10-17 10:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision = '004'
+down_revision = 'c2400e4781c9'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Estado incremental de posiciones. Se rellena solo: la primera
+    # transacción de cada (portfolio, asset) hace un recálculo completo.
+    op.create_table(
+        'position_ledgers',
+        sa.Column('portfolio_id', postgresql.UUID(as_uuid=True), nullable=False),
+        sa.Column('asset_id', postgresql.UUID(as_uuid=True), nullable=False),
+        sa.Column('quantity', sa.Numeric(38, 18), nullable=False),
+        sa.Column('total_cost', sa.Numeric(38, 18), nullable=False),
+        sa.Column('last_transaction_date', sa.DateTime(timezone=True), nullable=True),
+        sa.Column('last_transaction_id', postgresql.UUID(as_uuid=True), nullable=True),
+        sa.Column('transaction_count', sa.Integer(), nullable=False),
+        sa.Column('updated_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+        sa.ForeignKeyConstraint(['portfolio_id'], ['portfolios.id'], ondelete='CASCADE'),
+        sa.ForeignKeyConstraint(['asset_id'], ['assets.id']),
+        sa.PrimaryKeyConstraint('portfolio_id', 'asset_id')
+    )
+
+
+def downgrade():
+    op.drop_table('position_ledgers')
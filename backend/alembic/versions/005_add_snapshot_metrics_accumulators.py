@@ -0,0 +1,32 @@
+"""add snapshot metrics accumulators
+
+Revision ID: 005
+Revises: 004
+Create Date: 2026-10-17 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision = '005'
+down_revision = '004'
+branch_labels = None
+depends_on = None
+
+
+def _has_snapshot_metrics():
+    # c2400e4781c9 elimina snapshot_metrics en algunas bases de datos
+    return sa.inspect(op.get_bind()).has_table('snapshot_metrics')
+
+
+def upgrade():
+    # Estado acumulado para materializar snapshot_metrics día a día
+    if _has_snapshot_metrics():
+        op.add_column('snapshot_metrics', sa.Column('accumulators', postgresql.JSONB(), nullable=True))
+
+
+def downgrade():
+    if _has_snapshot_metrics():
+        op.drop_column('snapshot_metrics', 'accumulators')
@@ -0,0 +1,38 @@
+"""add fiscal year closes
+
+Revision ID: 006
+Revises: 005
+Create Date: 2026-10-17 14:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision = '006'
+down_revision = '005'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Cierres fiscales FIFO por año. Se rellenan bajo demanda al consultar
+    # resultados fiscales; se invalidan solos si cambian las transacciones.
+    op.create_table(
+        'fiscal_year_closes',
+        sa.Column('portfolio_id', postgresql.UUID(as_uuid=True), nullable=False),
+        sa.Column('fiscal_year', sa.Integer(), nullable=False),
+        sa.Column('total_result', sa.Numeric(38, 18), nullable=False),
+        sa.Column('items', postgresql.JSONB(), nullable=False),
+        sa.Column('open_lots', postgresql.JSONB(), nullable=False),
+        sa.Column('transaction_count', sa.Integer(), nullable=False),
+        sa.Column('last_change_at', sa.DateTime(timezone=True), nullable=True),
+        sa.Column('computed_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+        sa.ForeignKeyConstraint(['portfolio_id'], ['portfolios.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('portfolio_id', 'fiscal_year')
+    )
+
+
+def downgrade():
+    op.drop_table('fiscal_year_closes')
@@ -6,12 +6,17 @@ from typing import Optional
 from uuid import UUID
 
 from fastapi import APIRouter, Depends, HTTPException, status, Query, BackgroundTasks
+from sqlalchemy import and_, desc, func, select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
 from app.routes.auth import get_current_user, get_current_admin_user
 from app.db.models import User
-from app.db.session import get_db
-from app.services.snapshot_service import snapshot_service
+from app.db.session import get_db, get_async_db
+from app.services.snapshot_service import snapshot_service, POSITION_FIELDS, POSITION_ROW_LIMIT
+from app.services.performance_analytics import performance_analytics, METRIC_KEYS
+from app.services.metrics_materializer import metrics_materializer, VOLATILITY_WINDOW
+from app.db.models_snapshots import PortfolioSnapshot
 # from app.services.snapshot_scheduler import snapshot_scheduler
 
 router = APIRouter()
@@ -25,7 +30,7 @@ router = APIRouter()
 async def create_snapshot(
     portfolio_id: UUID,
     target_date: date = Query(None, description="Date for snapshot (default: yesterday)"),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: User = Depends(get_current_user),
 ):
     """
@@ -44,8 +49,8 @@ async def create_snapshot(
         target_date = (datetime.now() - timedelta(days=1)).date()
     
     try:
-        snapshot = snapshot_service.create_snapshot(
-            db,
+        snapshot = await db.run_sync(
+            snapshot_service.create_snapshot,
             portfolio_id,
             target_date
         )
@@ -74,7 +79,7 @@ async def create_snapshot(
 
 
 @router.post("/backfill/{portfolio_id}")
-async def backfill_snapshots(
+def backfill_snapshots(
     portfolio_id: UUID,
     from_date: date = Query(..., description="Start date"),
     to_date: date = Query(None, description="End date (default: yesterday)"),
@@ -86,7 +91,8 @@ async def backfill_snapshots(
     Backfill historical snapshots for a portfolio
     
     Creates snapshots for all days in the date range.
-    This can take some time for large ranges.
+    This can take some time for large ranges, so the handler is sync and
+    runs in the threadpool with its own session instead of on the event loop.
     
     Args:
         portfolio_id: Portfolio ID
@@ -147,7 +153,7 @@ async def backfill_snapshots(
 @router.get("/dates/{portfolio_id}")
 async def get_available_dates(
     portfolio_id: UUID,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: User = Depends(get_current_user),
 ):
     """
@@ -160,7 +166,7 @@ async def get_available_dates(
         from sqlalchemy import select, distinct
         from app.db.models_snapshots import PortfolioSnapshot
         
-        result = db.execute(
+        result = await db.execute(
             select(distinct(PortfolioSnapshot.snapshot_date))
             .where(PortfolioSnapshot.portfolio_id == portfolio_id)
             .order_by(PortfolioSnapshot.snapshot_date.desc())
@@ -186,19 +192,37 @@ async def get_snapshot_history(
     from_date: date = Query(..., description="Start date"),
     to_date: date = Query(None, description="End date (default: today)"),
     include_positions: bool = Query(False, description="Include position details"),
-    db: Session = Depends(get_db),
+    resolution: str = Query(
+        "daily",
+        pattern="^(daily|weekly|monthly|quarterly|yearly|auto)$",
+        description="Point resolution: daily, weekly, monthly, quarterly, yearly or auto"
+    ),
+    max_points: int = Query(500, ge=10, le=5000, description="Point budget for resolution=auto"),
+    position_fields: Optional[str] = Query(
+        None, description="Comma-separated position fields to return (default: all)"
+    ),
+    max_position_rows: int = Query(
+        POSITION_ROW_LIMIT, ge=1, le=POSITION_ROW_LIMIT, description="Maximum position rows returned"
+    ),
+    db: AsyncSession = Depends(get_async_db),
     current_user: User = Depends(get_current_user),
 ):
     """
     Get snapshot history for a portfolio
     
-    Returns daily snapshots for the specified date range.
+    Returns one point per snapshot (daily) or per week/month/quarter/year,
+    aggregated in the database with open/high/low/close of the portfolio
+    value. "auto" picks the finest resolution that fits max_points.
     
     Args:
         portfolio_id: Portfolio ID
         from_date: Start date
         to_date: End date (default: today)
         include_positions: Include detailed position information
+        resolution: Point resolution
+        max_points: Point budget for resolution=auto
+        position_fields: Position fields to return (e.g. "symbol,current_value")
+        max_position_rows: Position row cap for daily resolution
         
     Returns:
         List of snapshots
@@ -206,20 +230,48 @@ async def get_snapshot_history(
     if not to_date:
         to_date = datetime.now().date()
     
+    fields = None
+    if position_fields:
+        fields = [field.strip() for field in position_fields.split(",") if field.strip()]
+        unknown = [field for field in fields if field not in POSITION_FIELDS]
+        if unknown:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Unknown position fields: {', '.join(unknown)}"
+            )
+    
     try:
-        history = snapshot_service.get_snapshot_history(
-            db,
-            portfolio_id,
-            from_date,
-            to_date,
-            include_positions
+        resolution = snapshot_service.resolve_resolution(
+            resolution, from_date, to_date, max_points
         )
         
+        if resolution == "daily":
+            history = await db.run_sync(
+                snapshot_service.get_snapshot_history,
+                portfolio_id,
+                from_date,
+                to_date,
+                include_positions,
+                position_fields=fields,
+                max_position_rows=max_position_rows
+            )
+        else:
+            history = await db.run_sync(
+                snapshot_service.get_downsampled_history,
+                portfolio_id,
+                from_date,
+                to_date,
+                resolution,
+                include_positions,
+                position_fields=fields
+            )
+        
         return {
             "success": True,
             "portfolio_id": str(portfolio_id),
             "from_date": from_date.isoformat(),
             "to_date": to_date.isoformat(),
+            "resolution": resolution,
             "snapshots": history,
             "count": len(history)
         }
@@ -235,7 +287,7 @@ async def get_snapshot_history(
 async def get_latest_snapshot(
     portfolio_id: UUID,
     include_positions: bool = Query(False),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: User = Depends(get_current_user),
 ):
     """
@@ -251,8 +303,8 @@ async def get_latest_snapshot(
     try:
         # Get last 1 day of history
         today = datetime.now().date()
-        history = snapshot_service.get_snapshot_history(
-            db,
+        history = await db.run_sync(
+            snapshot_service.get_snapshot_history,
             portfolio_id,
             today - timedelta(days=30),  # Look back 30 days to find most recent
             today,
@@ -280,23 +332,161 @@ async def get_latest_snapshot(
         )
 
 
+# Periods served from SnapshotMetrics -> length in days (None = year to date)
+MATERIALIZED_PERIODS = {
+    "7d": 7,
+    "30d": 30,
+    "1y": 365,
+    "ytd": None,
+}
+
+
+def _materialized_performance(db: Session, portfolio_id: UUID, period: str) -> Optional[dict]:
+    """
+    Performance response built from the latest SnapshotMetrics row
+    
+    `metrics` has the same keys as in the computed path: period_return and
+    number_of_days keep their meaning (simple value change over the
+    snapshots in the period, from two indexed lookups) and the metrics that
+    need the whole series are None. The materialized figures go under
+    `materialized`: trailing returns as of metric_date, best/worst day and
+    max drawdown since inception, and the rolling volatility/Sharpe over
+    the last VOLATILITY_WINDOW observations.
+    
+    Returns None when there is no row for the latest snapshot (not yet
+    materialized) or no snapshot in the period, so the caller falls back
+    to computing the metrics.
+    """
+    latest_snapshot = db.execute(
+        select(PortfolioSnapshot)
+        .where(PortfolioSnapshot.portfolio_id == portfolio_id)
+        .order_by(desc(PortfolioSnapshot.snapshot_date))
+        .limit(1)
+    ).scalar_one_or_none()
+    metrics = metrics_materializer.get_latest(db, portfolio_id)
+    if (
+        latest_snapshot is None
+        or metrics is None
+        or metrics.metric_date != latest_snapshot.snapshot_date
+    ):
+        return None
+    
+    days = MATERIALIZED_PERIODS[period]
+    today = datetime.now().date()
+    if latest_snapshot.snapshot_date > today:
+        return None
+    from_date = today - timedelta(days=days) if days else date(today.year, 1, 1)
+    in_period = and_(
+        PortfolioSnapshot.portfolio_id == portfolio_id,
+        PortfolioSnapshot.snapshot_date >= from_date,
+        PortfolioSnapshot.snapshot_date <= today
+    )
+    number_of_days = db.execute(
+        select(func.count()).select_from(PortfolioSnapshot).where(in_period)
+    ).scalar_one()
+    if not number_of_days:
+        return None
+    first_value = float(db.execute(
+        select(PortfolioSnapshot.total_value)
+        .where(in_period)
+        .order_by(PortfolioSnapshot.snapshot_date)
+        .limit(1)
+    ).scalar_one())
+    current_value = float(latest_snapshot.total_value)
+    period_return = (current_value - first_value) / first_value * 100 if first_value > 0 else 0.0
+    
+    def as_float(value):
+        return float(value) if value is not None else None
+    
+    def as_day(value, day):
+        if value is None:
+            return None
+        return {"date": day.isoformat(), "return_percent": round(float(value), 2)}
+    
+    return {
+        "success": True,
+        "portfolio_id": str(portfolio_id),
+        "period": period,
+        "from_date": from_date.isoformat(),
+        "to_date": today.isoformat(),
+        "source": "materialized",
+        "metrics": {
+            **dict.fromkeys(METRIC_KEYS),
+            "period_return": round(period_return, 2),
+            "number_of_days": number_of_days,
+            "current_value": current_value,
+            "total_pnl": float(latest_snapshot.total_pnl),
+            "total_pnl_percent": round(float(latest_snapshot.total_pnl_percent), 2),
+        },
+        "materialized": {
+            "as_of": metrics.metric_date.isoformat(),
+            "trailing_returns": {
+                "weekly_return": as_float(metrics.weekly_return),
+                "monthly_return": as_float(metrics.monthly_return),
+                "yearly_return": as_float(metrics.yearly_return),
+                "ytd_return": as_float(metrics.ytd_return),
+            },
+            "since_inception": {
+                "best_day": as_day(metrics.best_day_return, metrics.best_day_date),
+                "worst_day": as_day(metrics.worst_day_return, metrics.worst_day_date),
+                "drawdown": {
+                    "max_drawdown": as_float(metrics.max_drawdown),
+                    "trough_date": metrics.max_drawdown_date.isoformat() if metrics.max_drawdown_date else None,
+                },
+            },
+            f"rolling_{VOLATILITY_WINDOW}d": {
+                "volatility": as_float(metrics.daily_volatility),
+                "weekly_volatility": as_float(metrics.weekly_volatility),
+                "sharpe_ratio": as_float(metrics.sharpe_ratio),
+            },
+            "asset_allocation": metrics.asset_allocation,
+            "type_allocation": metrics.sector_allocation,
+        }
+    }
+
+
 @router.get("/performance/{portfolio_id}")
 async def get_performance_metrics(
     portfolio_id: UUID,
     period: str = Query("30d", description="Period: 7d, 30d, 90d, 1y, ytd, all"),
-    db: Session = Depends(get_db),
+    benchmark: Optional[str] = Query(None, description="Benchmark asset symbol for beta (e.g. SPY)"),
+    risk_free_rate: float = Query(0.0, description="Annual risk-free rate for Sharpe/Sortino (0.03 = 3%)"),
+    rolling_window: int = Query(30, ge=2, le=365, description="Rolling volatility window (days)"),
+    materialized: bool = Query(False, description="Answer from the materialized SnapshotMetrics (O(1))"),
+    db: AsyncSession = Depends(get_async_db),
     current_user: User = Depends(get_current_user),
 ):
     """
     Get performance metrics for a portfolio
     
+    By default the metrics are computed from the snapshot series
+    (source="computed"). With materialized=true and 7d/30d/1y/ytd (no
+    benchmark, risk-free rate or custom window) the response is read from
+    the SnapshotMetrics row of the last snapshot (source="materialized"):
+    `metrics` keeps the same keys, with None for what needs the full
+    series, and the precomputed figures are under `materialized`. If that
+    row is not up to date the metrics are computed.
+    
     Args:
         portfolio_id: Portfolio ID
         period: Time period for metrics
+        benchmark: Optional benchmark symbol (must have quotes)
+        risk_free_rate: Annual risk-free rate
+        rolling_window: Rolling volatility window
+        materialized: Prefer the materialized metrics
         
     Returns:
         Performance metrics and statistics
     """
+    if (
+        materialized
+        and period in MATERIALIZED_PERIODS
+        and not (benchmark or risk_free_rate or rolling_window != 30)
+    ):
+        materialized_response = await db.run_sync(_materialized_performance, portfolio_id, period)
+        if materialized_response:
+            return materialized_response
+    
     # Calculate date range based on period
     today = datetime.now().date()
     
@@ -311,66 +501,54 @@ async def get_performance_metrics(
     elif period == "ytd":
         from_date = date(today.year, 1, 1)
     else:  # all
-        from_date = today - timedelta(days=365 * 3)  # 3 years max
+        from_date = None
     
     try:
-        history = snapshot_service.get_snapshot_history(
-            db,
-            portfolio_id,
-            from_date,
-            today,
-            include_positions=False
-        )
+        series = await db.run_sync(performance_analytics.load_series, portfolio_id, from_date, today)
         
-        if not history:
+        if not len(series):
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail="No snapshots found for this portfolio"
             )
         
-        # Calculate metrics
-        first = history[0]
-        last = history[-1]
-        
-        period_return = (
-            (last["total_value"] - first["total_value"]) / first["total_value"] * 100
-        ) if first["total_value"] > 0 else 0
+        benchmark_quotes = None
+        if benchmark:
+            benchmark_quotes = await db.run_sync(
+                performance_analytics.load_benchmark, benchmark, series.dates[0].item(), today
+            )
+            if benchmark_quotes is None:
+                raise HTTPException(
+                    status_code=status.HTTP_404_NOT_FOUND,
+                    detail=f"Benchmark asset {benchmark} not found"
+                )
         
-        # Find best and worst days
-        best_day = max(history, key=lambda x: x["daily_pnl_percent"])
-        worst_day = min(history, key=lambda x: x["daily_pnl_percent"])
+        metrics = performance_analytics.compute_metrics(
+            series,
+            risk_free_rate=risk_free_rate,
+            rolling_window=rolling_window,
+            benchmark=benchmark_quotes
+        )
         
-        # Calculate volatility (standard deviation of daily returns)
-        daily_returns = [s["daily_pnl_percent"] for s in history if s["daily_pnl_percent"] != 0]
-        if daily_returns:
-            mean_return = sum(daily_returns) / len(daily_returns)
-            variance = sum((r - mean_return) ** 2 for r in daily_returns) / len(daily_returns)
-            volatility = variance ** 0.5
-        else:
-            volatility = 0
+        current_value = float(series.total_value[-1])
+        total_invested = float(series.total_invested[-1])
+        total_pnl = current_value - total_invested
+        metrics.update({
+            "current_value": current_value,
+            "total_pnl": total_pnl,
+            "total_pnl_percent": round(total_pnl / total_invested * 100, 2) if total_invested > 0 else 0.0,
+        })
+        if benchmark:
+            metrics["benchmark_symbol"] = benchmark.upper()
         
         return {
             "success": True,
             "portfolio_id": str(portfolio_id),
             "period": period,
-            "from_date": from_date.isoformat(),
+            "from_date": (from_date or series.dates[0].item()).isoformat(),
             "to_date": today.isoformat(),
-            "metrics": {
-                "period_return": round(period_return, 2),
-                "current_value": last["total_value"],
-                "total_pnl": last["total_pnl"],
-                "total_pnl_percent": round(last["total_pnl_percent"], 2),
-                "best_day": {
-                    "date": best_day["date"],
-                    "return_percent": round(best_day["daily_pnl_percent"], 2)
-                },
-                "worst_day": {
-                    "date": worst_day["date"],
-                    "return_percent": round(worst_day["daily_pnl_percent"], 2)
-                },
-                "volatility": round(volatility, 2),
-                "number_of_days": len(history)
-            }
+            "source": "computed",
+            "metrics": metrics
         }
         
     except HTTPException:
@@ -394,12 +572,17 @@ async def get_scheduler_status(
     Get snapshot scheduler status (Admin only)
     
     Returns:
-        Scheduler status and configuration
+        Scheduler status, configuration, progress of the run in flight and
+        summary of the last run
     """
+    from app.services.snapshot_scheduler import snapshot_scheduler
+    
     return {
-        "is_running": False,  # snapshot_scheduler.is_running,
-        "run_time": "20:00",  # snapshot_scheduler.run_time.strftime("%H:%M"),
-        "next_run": "Disabled"  # "Running daily" if snapshot_scheduler.is_running else "Stopped"
+        "is_running": snapshot_scheduler.is_running,
+        "run_time": snapshot_scheduler.run_time.strftime("%H:%M"),
+        "concurrency": snapshot_scheduler.concurrency,
+        "current_run": snapshot_scheduler.current_run,
+        "last_run": snapshot_scheduler.last_run
     }
 
 
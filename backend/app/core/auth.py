@@ -1,26 +1,15 @@
 from typing import Optional
 from fastapi import HTTPException, status
 from .session import session_manager
-import bcrypt
+from .security import hash_password, verify_password as _verify_password
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
-    """Verificar si la contraseña coincide con el hash"""
-    if isinstance(plain_password, str):
-        plain_password = plain_password.encode('utf-8')
-    if isinstance(hashed_password, str):
-        hashed_password = hashed_password.encode('utf-8')
-    
-    return bcrypt.checkpw(plain_password, hashed_password)
+    """Verificar si la contraseña coincide con el hash (Argon2 o bcrypt legado)"""
+    return _verify_password(plain_password, hashed_password)
 
 def get_password_hash(password: str) -> str:
-    """Obtener el hash de una contraseña"""
-    if isinstance(password, str):
-        password = password.encode('utf-8')
-    
-    salt = bcrypt.gensalt()
-    hashed = bcrypt.hashpw(password, salt)
-    
-    return hashed.decode('utf-8')
+    """Obtener el hash (Argon2) de una contraseña"""
+    return hash_password(password)
 
 async def create_user_session(user_id: str, user_data: dict) -> str:
     """Crear una sesión de usuario"""
@@ -57,13 +57,57 @@ class Settings(BaseSettings):
     ENVIRONMENT: str = "development"  # development, production
     COOKIE_DOMAIN: str = ""  # Configurable vía variable de entorno
     
+    # ============================================
+    # Database Connection Pools (per process)
+    # ============================================
+    # Sync engine: services, Celery tasks and threadpool handlers
+    DB_POOL_SIZE: int = 10
+    DB_MAX_OVERFLOW: int = 20
+    
+    # Async engine (asyncpg): request handlers. Requests beyond the pool
+    # wait for a connection without blocking the event loop
+    ASYNC_DB_POOL_SIZE: int = 20
+    ASYNC_DB_MAX_OVERFLOW: int = 10
+    
+    # Seconds to wait for a free connection / to recycle idle connections
+    DB_POOL_TIMEOUT_SECONDS: int = 30
+    DB_POOL_RECYCLE_SECONDS: int = 1800
+    
+    # ============================================
+    # Password Hashing (Argon2id)
+    # ============================================
+    # Changing these rehashes each password on its owner's next login
+    ARGON2_TIME_COST: int = 3
+    ARGON2_MEMORY_COST: int = 65536  # KiB
+    ARGON2_PARALLELISM: int = 4
+    
+    # Threads hashing/verifying passwords (off the event loop)
+    PASSWORD_HASH_WORKERS: int = 2
+    
+    # ============================================
+    # Session Cache
+    # ============================================
+    # Sessions kept in process memory; logout invalidates them in every
+    # process via Redis pub/sub, the TTL bounds staleness if a message is missed
+    SESSION_LOCAL_CACHE_SIZE: int = 10000
+    SESSION_LOCAL_CACHE_TTL_SECONDS: int = 30
+    
+    # Sliding session TTL is renewed at most once per interval per session
+    SESSION_REFRESH_INTERVAL_MINUTES: int = 5
+    
     # ============================================
     # Finnhub API Configuration
     # ============================================
-    FINNHUB_RATE_LIMIT: int = 60  # requests per minute (free plan)
+    FINNHUB_RATE_LIMIT: int = 60  # requests per minute (free plan), shared by all processes
     FINNHUB_RETRY_ATTEMPTS: int = 3
     FINNHUB_BACKOFF_FACTOR: int = 2
     
+    # In-process price cache (first tier in front of Redis price_cache:*)
+    # Entries are also invalidated via Redis pub/sub when a price is
+    # refreshed; the TTL only bounds staleness if a message is missed.
+    PRICE_LOCAL_CACHE_SIZE: int = 2048
+    PRICE_LOCAL_CACHE_TTL_SECONDS: int = 60
+    
     # ============================================
     # Quote Updates Configuration
     # ============================================
@@ -72,12 +116,48 @@ class Settings(BaseSettings):
     # Paid plan: Can be lower (e.g., 15, 30 minutes)
     QUOTE_UPDATE_INTERVAL_MINUTES: int = 60
     
+    # Concurrent Finnhub requests during a full refresh (throughput is
+    # bounded by FINNHUB_RATE_LIMIT, this only bounds in-flight requests)
+    QUOTE_REFRESH_CONCURRENCY: int = 8
+    
+    # Quotes persisted per database write during a full refresh
+    QUOTE_REFRESH_BATCH_SIZE: int = 50
+    
+    # Assets per Celery task when the periodic price update fans out
+    PRICE_UPDATE_CHUNK_SIZE: int = 100
+    
     # Enable/disable automatic updates
     QUOTE_AUTO_UPDATE_ENABLED: bool = True
     
     # Maximum historical import range in days
     QUOTE_MAX_IMPORT_DAYS: int = 730  # 2 years
     
+    # ============================================
+    # Snapshot Recalculation Queue
+    # ============================================
+    # Quiet period after the last transaction change before recalculating;
+    # bursts of edits to the same portfolio merge into one job
+    SNAPSHOT_RECALC_DEBOUNCE_SECONDS: int = 10
+    
+    # Upper bound on the delay since the first pending change
+    SNAPSHOT_RECALC_MAX_DELAY_SECONDS: int = 60
+    
+    # Failed recalculations retry after BASE * 2^(attempt - 1) seconds, up to
+    # MAX_ATTEMPTS in a row; then the date stays pending until the next change
+    SNAPSHOT_RECALC_RETRY_BASE_SECONDS: int = 30
+    SNAPSHOT_RECALC_MAX_ATTEMPTS: int = 5
+    
+    # ============================================
+    # Nightly Snapshot Job
+    # ============================================
+    # Portfolios processed in parallel (one DB connection each)
+    SNAPSHOT_JOB_CONCURRENCY: int = 8
+    
+    # Per-portfolio time budget of the daily job and of backfills (each
+    # statement gets the remaining budget as statement_timeout)
+    SNAPSHOT_JOB_PORTFOLIO_TIMEOUT_SECONDS: int = 120
+    SNAPSHOT_BACKFILL_PORTFOLIO_TIMEOUT_SECONDS: int = 1800
+    
     @property
     def cors_origins_list(self) -> List[str]:
         return [o.strip() for o in self.CORS_ORIGINS.split(",")]
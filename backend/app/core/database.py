@@ -1,19 +1,39 @@
 from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from .config import settings
 
-# Crear el engine de la base de datos
+# Crear el engine de la base de datos (síncrono: servicios, Celery, scripts)
 engine = create_engine(
     settings.DATABASE_URL,
     pool_pre_ping=True,
-    pool_size=10,
-    max_overflow=20
+    pool_size=settings.DB_POOL_SIZE,
+    max_overflow=settings.DB_MAX_OVERFLOW,
+    pool_timeout=settings.DB_POOL_TIMEOUT_SECONDS,
+    pool_recycle=settings.DB_POOL_RECYCLE_SECONDS
 )
 
 # Crear la sesión
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Engine asíncrono (asyncpg) para los handlers de las rutas: las consultas
+# no bloquean el event loop y las peticiones que esperan conexión tampoco
+async_engine = create_async_engine(
+    settings.ASYNC_DATABASE_URL,
+    pool_pre_ping=True,
+    pool_size=settings.ASYNC_DB_POOL_SIZE,
+    max_overflow=settings.ASYNC_DB_MAX_OVERFLOW,
+    pool_timeout=settings.DB_POOL_TIMEOUT_SECONDS,
+    pool_recycle=settings.DB_POOL_RECYCLE_SECONDS
+)
+
+# expire_on_commit=False: los objetos devueltos tras commit se serializan
+# sin volver a la base de datos (en async no hay carga perezosa implícita)
+AsyncSessionLocal = async_sessionmaker(
+    async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False
+)
+
 # Base para los modelos
 Base = declarative_base()
 
@@ -24,3 +44,8 @@ def get_db():
         yield db
     finally:
         db.close()
+
+# Dependency para obtener la sesión asíncrona
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
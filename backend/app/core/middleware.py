@@ -25,14 +25,16 @@ async def get_current_user_from_session(request: Request) -> Optional[dict]:
     if not session_id:
         return None
     
-    # Obtener datos de la sesión desde Redis
+    # Obtener datos de la sesión (memoria del proceso o Redis)
     session_data = await session_manager.get_session(session_id)
     
     if not session_data:
         return None
     
-    # Renovar el TTL de la sesión en cada request válido
-    await session_manager.refresh_session(session_id)
+    # Renovar el TTL de la sesión, como mucho una vez cada
+    # SESSION_REFRESH_INTERVAL_MINUTES (False si ya no existe en Redis)
+    if not await session_manager.refresh_session_if_due(session_id, session_data["user_id"]):
+        return None
     
     return session_data
 
@@ -0,0 +1,131 @@
+"""
+Limitador de peticiones tipo token bucket para corrutinas
+"""
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable, Optional
+
+from redis.exceptions import RedisError
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """
+    Limitador de peticiones tipo token bucket
+
+    Repone rate_per_minute / 60 tokens por segundo hasta `capacity`. Las
+    corrutinas que piden un token esperan en orden de llegada.
+    """
+
+    def __init__(self, rate_per_minute: int, capacity: Optional[int] = None):
+        self.rate = rate_per_minute / 60.0  # tokens por segundo
+        # Ráfaga máxima: un segundo de cuota (evita picos que disparen el 429)
+        self.capacity = capacity or max(1, rate_per_minute // 60)
+        self.tokens = float(self.capacity)
+        self.updated_at = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    async def _acquire(self):
+        async with self._lock:
+            self._refill()
+            while self.tokens < 1:
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+                self._refill()
+            self.tokens -= 1
+
+    async def acquire(self, timeout: Optional[float] = None) -> bool:
+        """
+        Esperar hasta disponer de un token y consumirlo
+
+        Args:
+            timeout: Espera máxima en segundos (None = sin límite)
+
+        Returns:
+            True si se obtuvo el token, False si venció el timeout
+        """
+        if timeout is None:
+            await self._acquire()
+            return True
+        try:
+            await asyncio.wait_for(self._acquire(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+
+class RedisTokenBucket(TokenBucket):
+    """
+    Token bucket compartido entre procesos sobre una clave de Redis
+
+    Misma cuota y ráfaga que TokenBucket, pero el estado (instante teórico
+    de la siguiente petición, GCRA) vive en Redis y lo comparten todos los
+    procesos que usan la misma clave (workers de la API y de Celery). El
+    reloj es el del servidor Redis. Si Redis no responde, se limita con el
+    bucket local del proceso hasta que vuelva.
+    """
+
+    # Devuelve "0" si concede el token o los segundos a esperar (como texto:
+    # Lua convierte los números a enteros al devolverlos)
+    _ACQUIRE_SCRIPT = """
+    local t = redis.call('TIME')
+    local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+    local interval = tonumber(ARGV[1])
+    local burst = tonumber(ARGV[2])
+    local tat = tonumber(redis.call('GET', KEYS[1]) or '0')
+    if tat < now then
+        tat = now
+    end
+    local wait = tat + interval - now - burst * interval
+    if wait > 0 then
+        return tostring(wait)
+    end
+    tat = tat + interval
+    redis.call('SET', KEYS[1], tostring(tat), 'PX', math.ceil((tat - now) * 1000) + 1000)
+    return '0'
+    """
+
+    def __init__(
+        self,
+        get_client: Callable[[], Awaitable],
+        key: str,
+        rate_per_minute: int,
+        capacity: Optional[int] = None
+    ):
+        """
+        Args:
+            get_client: Corrutina que devuelve el cliente redis.asyncio
+                (conexión perezosa)
+            key: Clave de Redis compartida por todos los que comparten cuota
+            rate_per_minute: Peticiones por minuto
+            capacity: Ráfaga máxima
+        """
+        super().__init__(rate_per_minute, capacity)
+        self.get_client = get_client
+        self.key = key
+        self._script = None
+        self._script_client = None
+
+    async def _acquire_shared(self):
+        client = await self.get_client()
+        if self._script is None or self._script_client is not client:
+            self._script = client.register_script(self._ACQUIRE_SCRIPT)
+            self._script_client = client
+        while True:
+            wait = float(await self._script(keys=[self.key], args=[1 / self.rate, self.capacity]))
+            if wait <= 0:
+                return
+            await asyncio.sleep(wait)
+
+    async def _acquire(self):
+        try:
+            await self._acquire_shared()
+        except (RedisError, OSError) as e:
+            logger.warning(f"Shared rate limit unavailable, using local bucket: {e}")
+            await super()._acquire()
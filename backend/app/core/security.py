@@ -1,21 +1,78 @@
+import asyncio
 import secrets
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import Optional, Tuple
 from uuid import UUID
 from argon2 import PasswordHasher
+from argon2.exceptions import InvalidHashError, VerificationError
+import bcrypt
+
+from .config import settings
+
+# Coste de Argon2 configurable; si cambia, los hashes existentes se
+# regeneran con los nuevos parámetros en el siguiente login correcto
+ph = PasswordHasher(
+    time_cost=settings.ARGON2_TIME_COST,
+    memory_cost=settings.ARGON2_MEMORY_COST,
+    parallelism=settings.ARGON2_PARALLELISM,
+)
+
+# Pool acotado para el hashing: argon2-cffi y bcrypt liberan el GIL, así
+# que los hilos no bloquean el event loop y como mucho
+# PASSWORD_HASH_WORKERS hashes compiten por CPU con el resto de la API
+_hash_executor = ThreadPoolExecutor(
+    max_workers=settings.PASSWORD_HASH_WORKERS,
+    thread_name_prefix="password-hash",
+)
+
+BCRYPT_PREFIXES = ("$2a$", "$2b$", "$2y$")
 
-ph = PasswordHasher()
 
 def hash_password(password: str) -> str:
     return ph.hash(password)
 
 def verify_password(password: str, hashed: str) -> bool:
+    """Verificar una contraseña contra un hash Argon2 o bcrypt (legado)"""
+    if hashed.startswith(BCRYPT_PREFIXES):
+        try:
+            return bcrypt.checkpw(password.encode("utf-8"), hashed.encode("utf-8"))
+        except ValueError:
+            return False
     try:
-        ph.verify(hashed, password)
-        return True
-    except:
+        return ph.verify(hashed, password)
+    except (VerificationError, InvalidHashError):
         return False
 
+def needs_rehash(hashed: str) -> bool:
+    """True si el hash es bcrypt o Argon2 con otros parámetros"""
+    if hashed.startswith(BCRYPT_PREFIXES):
+        return True
+    try:
+        return ph.check_needs_rehash(hashed)
+    except InvalidHashError:
+        return True
+
+def _verify_and_update(password: str, hashed: str) -> Tuple[bool, Optional[str]]:
+    if not verify_password(password, hashed):
+        return False, None
+    return True, hash_password(password) if needs_rehash(hashed) else None
+
+async def hash_password_async(password: str) -> str:
+    """hash_password en el pool de hashing"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_hash_executor, hash_password, password)
+
+async def verify_and_update_password(password: str, hashed: str) -> Tuple[bool, Optional[str]]:
+    """
+    Verificar una contraseña en el pool de hashing
+
+    Returns:
+        (válida, nuevo hash o None si el actual sigue vigente)
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_hash_executor, _verify_and_update, password, hashed)
+
 def generate_token() -> str:
     return secrets.token_hex(32)
 
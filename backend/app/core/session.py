@@ -2,20 +2,60 @@
 Sistema de sesiones con Redis
 Reemplaza JWT con sesiones efímeras seguras
 """
+import asyncio
+import logging
 import uuid
 import json
+import time
 from typing import Optional, Dict, Any
 from datetime import timedelta
 import redis.asyncio as redis
 from .config import settings
+from .local_cache import LocalTTLCache
+
+logger = logging.getLogger(__name__)
 
 class SessionManager:
-    """Gestor de sesiones con Redis"""
+    """
+    Gestor de sesiones con Redis
+    
+    Las sesiones leídas se guardan unos segundos en memoria del proceso
+    (sin GET a Redis en cada petición) y se invalidan por pub/sub al hacer
+    logout en cualquier proceso. El TTL deslizante se renueva como mucho
+    una vez cada SESSION_REFRESH_INTERVAL_MINUTES por sesión.
+    
+    Índices (sorted sets con la caducidad como score):
+    - user_sessions:{user_id}: sesiones de cada usuario, para revocarlas
+      sin recorrer el keyspace
+    - sessions:active: todas las sesiones, para contarlas con ZCOUNT
+    Los miembros caducados se podan por score al crear sesiones y en la
+    tarea de limpieza.
+    """
     
     def __init__(self):
         self.redis_client: Optional[redis.Redis] = None
         self.session_ttl = timedelta(hours=24)  # 24 horas por defecto
         self.prefix = "session:"
+        self.local_cache = LocalTTLCache(
+            max_size=settings.SESSION_LOCAL_CACHE_SIZE,
+            ttl_seconds=settings.SESSION_LOCAL_CACHE_TTL_SECONDS
+        )
+        # Sesiones cuyo TTL se renovó hace menos de refresh_interval
+        self.refresh_interval = timedelta(minutes=settings.SESSION_REFRESH_INTERVAL_MINUTES)
+        self.recently_refreshed = LocalTTLCache(
+            max_size=settings.SESSION_LOCAL_CACHE_SIZE,
+            ttl_seconds=self.refresh_interval.total_seconds()
+        )
+        self.invalidation_channel = f"{self.prefix}invalidate"
+        self._invalidation_task: Optional[asyncio.Task] = None
+        self.user_index_prefix = "user_sessions:"
+        self.active_index_key = "sessions:active"
+    
+    def _user_index_key(self, user_id: str) -> str:
+        return f"{self.user_index_prefix}{user_id}"
+    
+    def _expires_at(self) -> float:
+        return time.time() + self.session_ttl.total_seconds()
     
     async def connect(self):
         """Conectar a Redis"""
@@ -25,13 +65,52 @@ class SessionManager:
                 encoding="utf-8",
                 decode_responses=True
             )
+        if self._invalidation_task is None or self._invalidation_task.done():
+            self._invalidation_task = asyncio.create_task(self._listen_invalidations())
     
     async def disconnect(self):
         """Desconectar de Redis"""
+        if self._invalidation_task is not None:
+            self._invalidation_task.cancel()
+            self._invalidation_task = None
         if self.redis_client:
             await self.redis_client.close()
             self.redis_client = None
     
+    async def _listen_invalidations(self):
+        """
+        Escuchar sesiones eliminadas en otros procesos
+        
+        Si la suscripción se pierde, se vacía la cache local (pudieron perderse
+        mensajes) y se reintenta.
+        """
+        while True:
+            try:
+                async with self.redis_client.pubsub() as pubsub:
+                    await pubsub.subscribe(self.invalidation_channel)
+                    async for message in pubsub.listen():
+                        if message["type"] != "message":
+                            continue
+                        self._forget(message["data"])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Session invalidation listener error: {e}")
+                self.local_cache.clear()
+                await asyncio.sleep(1)
+    
+    def _forget(self, session_id: str):
+        """Olvidar una sesión en la memoria del proceso"""
+        self.local_cache.invalidate(session_id)
+        self.recently_refreshed.invalidate(session_id)
+    
+    async def _publish_invalidation(self, session_id: str):
+        """Avisar al resto de procesos de que la sesión ya no existe"""
+        try:
+            await self.redis_client.publish(self.invalidation_channel, session_id)
+        except Exception as e:
+            logger.warning(f"Could not publish session invalidation: {e}")
+    
     async def create_session(self, user_id: str, user_data: Dict[str, Any]) -> str:
         """
         Crear una nueva sesión
@@ -57,13 +136,17 @@ class SessionManager:
             "created_at": user_data.get("created_at"),
         }
         
-        # Guardar en Redis con TTL
+        # Guardar en Redis con TTL y registrar en los índices
         key = f"{self.prefix}{session_id}"
-        await self.redis_client.setex(
-            key,
-            self.session_ttl,
-            json.dumps(session_data)
-        )
+        user_index = self._user_index_key(user_id)
+        expires_at = self._expires_at()
+        async with self.redis_client.pipeline(transaction=True) as pipe:
+            pipe.setex(key, self.session_ttl, json.dumps(session_data))
+            pipe.zadd(user_index, {session_id: expires_at})
+            pipe.zremrangebyscore(user_index, "-inf", time.time())
+            pipe.expire(user_index, self.session_ttl)
+            pipe.zadd(self.active_index_key, {session_id: expires_at})
+            await pipe.execute()
         
         return session_id
     
@@ -77,31 +160,83 @@ class SessionManager:
         Returns:
             session_data o None si no existe
         """
+        session_data = self.local_cache.get(session_id)
+        if session_data is not None:
+            return session_data
+        
         await self.connect()
         
         key = f"{self.prefix}{session_id}"
         data = await self.redis_client.get(key)
         
         if data:
-            return json.loads(data)
+            session_data = json.loads(data)
+            self.local_cache.set(session_id, session_data)
+            return session_data
         return None
     
-    async def refresh_session(self, session_id: str) -> bool:
+    async def refresh_session(self, session_id: str, user_id: Optional[str] = None) -> bool:
         """
-        Renovar el TTL de una sesión existente
+        Renovar el TTL de una sesión existente (y su caducidad en los índices)
         
         Args:
             session_id: ID de la sesión
+            user_id: Usuario de la sesión (se lee de la sesión si no se indica)
         
         Returns:
             True si se renovó, False si no existe
         """
         await self.connect()
         
+        if user_id is None:
+            session_data = await self.get_session(session_id)
+            if not session_data:
+                return False
+            user_id = session_data["user_id"]
+        
         key = f"{self.prefix}{session_id}"
-        # Renovar TTL
-        result = await self.redis_client.expire(key, self.session_ttl)
-        return result == 1
+        user_index = self._user_index_key(user_id)
+        expires_at = self._expires_at()
+        # Renovar TTL; sin xx para indexar también las sesiones creadas
+        # antes de que existieran los índices (si la clave ya no existe se
+        # quitan justo debajo)
+        async with self.redis_client.pipeline(transaction=True) as pipe:
+            pipe.expire(key, self.session_ttl)
+            pipe.zadd(user_index, {session_id: expires_at})
+            pipe.expire(user_index, self.session_ttl)
+            pipe.zadd(self.active_index_key, {session_id: expires_at})
+            result = (await pipe.execute())[0]
+        
+        if result != 1:
+            await self._remove_from_indexes(user_id, session_id)
+            self._forget(session_id)
+            return False
+        self.recently_refreshed.set(session_id, True)
+        return True
+    
+    async def _remove_from_indexes(self, user_id: str, *session_ids: str):
+        """Quitar sesiones de los índices por usuario y global"""
+        async with self.redis_client.pipeline(transaction=True) as pipe:
+            pipe.zrem(self._user_index_key(user_id), *session_ids)
+            pipe.zrem(self.active_index_key, *session_ids)
+            await pipe.execute()
+    
+    async def refresh_session_if_due(self, session_id: str, user_id: Optional[str] = None) -> bool:
+        """
+        Renovar el TTL solo si no se renovó en los últimos refresh_interval
+        
+        La sesión puede caducar en Redis como mucho refresh_interval antes
+        que renovándola en cada petición (sobre un TTL de 24 horas).
+        
+        Args:
+            session_id: ID de la sesión
+        
+        Returns:
+            True si la sesión sigue existiendo, False si no
+        """
+        if self.recently_refreshed.get(session_id) is not None:
+            return True
+        return await self.refresh_session(session_id, user_id)
     
     async def delete_session(self, session_id: str) -> bool:
         """
@@ -115,8 +250,13 @@ class SessionManager:
         """
         await self.connect()
         
+        session_data = await self.get_session(session_id)
         key = f"{self.prefix}{session_id}"
         result = await self.redis_client.delete(key)
+        if session_data:
+            await self._remove_from_indexes(session_data["user_id"], session_id)
+        self._forget(session_id)
+        await self._publish_invalidation(session_id)
         return result > 0
     
     async def delete_user_sessions(self, user_id: str) -> int:
@@ -131,19 +271,43 @@ class SessionManager:
         """
         await self.connect()
         
-        # Buscar todas las sesiones del usuario
-        pattern = f"{self.prefix}*"
-        deleted_count = 0
+        # Sesiones del usuario desde su índice (sin recorrer el keyspace)
+        user_index = self._user_index_key(user_id)
+        session_ids = await self.redis_client.zrange(user_index, 0, -1)
+        if not session_ids:
+            return 0
+        
+        async with self.redis_client.pipeline(transaction=True) as pipe:
+            pipe.delete(*[f"{self.prefix}{session_id}" for session_id in session_ids])
+            pipe.zrem(self.active_index_key, *session_ids)
+            pipe.delete(user_index)
+            deleted_count = (await pipe.execute())[0]
         
-        async for key in self.redis_client.scan_iter(match=pattern):
-            data = await self.redis_client.get(key)
-            if data:
-                session_data = json.loads(data)
-                if session_data.get("user_id") == user_id:
-                    await self.redis_client.delete(key)
-                    deleted_count += 1
+        for session_id in session_ids:
+            self._forget(session_id)
+            await self._publish_invalidation(session_id)
         
         return deleted_count
+    
+    async def count_active_sessions(self) -> int:
+        """
+        Número de sesiones vigentes
+        
+        Returns:
+            Sesiones del índice global cuya caducidad no ha pasado
+        """
+        await self.connect()
+        return await self.redis_client.zcount(self.active_index_key, time.time(), "+inf")
+    
+    async def prune_expired_sessions(self) -> int:
+        """
+        Podar del índice global las sesiones ya caducadas
+        
+        Returns:
+            Número de entradas eliminadas
+        """
+        await self.connect()
+        return await self.redis_client.zremrangebyscore(self.active_index_key, "-inf", time.time())
 
 
 # Instancia global del gestor de sesiones
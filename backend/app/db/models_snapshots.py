@@ -147,6 +147,10 @@ class SnapshotMetrics(Base):
     asset_allocation = Column(JSONB, nullable=True)
     sector_allocation = Column(JSONB, nullable=True)
     
+    # Running state (wealth index, rolling-window sums) from which the next
+    # day's row is derived incrementally
+    accumulators = Column(JSONB, nullable=True)
+    
     # Metadata
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
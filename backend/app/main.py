@@ -99,11 +99,18 @@ async def shutdown_event():
     quote_scheduler.stop()
     logger.info("✓ Quote scheduler detenido")
     
+    from app.services.finnhub_service import finnhub_service
+    await finnhub_service.close()
+    
     # await snapshot_scheduler.stop()
     # print("✓ Snapshot scheduler detenido")
     
     await session_manager.disconnect()
     logger.info("✓ Session manager desconectado")
+    
+    from app.core.database import async_engine
+    await async_engine.dispose()
+    logger.info("✓ Pool asíncrono de base de datos cerrado")
 
 # CORS: Permitir frontend local y red local
 app.add_middleware(
@@ -2,10 +2,11 @@
 from .usuario import Usuario
 from .portfolio import Portfolio, AssetType
 from .asset import Asset
-from .position import Position
+from .position import Position, PositionLedger
 from .transaction import Transaction, TransactionType
 from .quote import Quote
 from .result import Result
+from .fiscal import FiscalYearClose
 from ..db.models_snapshots import PortfolioSnapshot, PositionSnapshot, SnapshotMetrics
 
 __all__ = [
@@ -13,9 +14,11 @@ __all__ = [
     "Portfolio",
     "Asset",
     "Position",
+    "PositionLedger",
     "Transaction",
     "Quote",
     "Result",
+    "FiscalYearClose",
     "AssetType",
     "TransactionType",
     "PortfolioSnapshot",
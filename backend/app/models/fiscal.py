@@ -0,0 +1,28 @@
+from sqlalchemy import Column, ForeignKey, DateTime, Integer, Numeric
+from sqlalchemy.dialects.postgresql import UUID, JSONB
+from sqlalchemy.sql import func
+from ..core.database import Base
+
+
+class FiscalYearClose(Base):
+    """
+    Cierre fiscal (FIFO) de un portfolio para un año ya terminado
+
+    Guarda las ganancias realizadas del año y los lotes abiertos al cierre
+    del 31 de diciembre, de modo que el cálculo de años posteriores parte de
+    ese estado sin reprocesar el histórico. La huella (número de
+    transacciones y última modificación del año) permite detectar cambios
+    retroactivos e invalidar el cierre.
+    """
+    __tablename__ = "fiscal_year_closes"
+
+    portfolio_id = Column(UUID(as_uuid=True), ForeignKey("portfolios.id", ondelete="CASCADE"), primary_key=True)
+    fiscal_year = Column(Integer, primary_key=True)
+    total_result = Column(Numeric(38, 18), nullable=False, default=0)
+    # Ventas casadas del año: [{symbol, date_sell, date_buy, quantity, price_sell, price_buy, result}]
+    items = Column(JSONB, nullable=False, default=list)
+    # Lotes abiertos al cierre: {asset_id: {"symbol": ..., "lots": [[date, quantity, price], ...]}}
+    open_lots = Column(JSONB, nullable=False, default=dict)
+    transaction_count = Column(Integer, nullable=False, default=0)
+    last_change_at = Column(DateTime(timezone=True), nullable=True)
+    computed_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Float, ForeignKey, DateTime, UniqueConstraint
+from sqlalchemy import Column, Float, ForeignKey, DateTime, Integer, Numeric, UniqueConstraint
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
@@ -24,3 +24,25 @@ class Position(Base):
     # Relaciones
     portfolio = relationship("Portfolio", back_populates="positions")
     asset = relationship("Asset", back_populates="positions")
+
+
+class PositionLedger(Base):
+    """
+    Estado acumulado de una posición para mantenimiento incremental
+
+    Guarda la cantidad y el coste total (en Decimal) tras aplicar las
+    transacciones hasta (last_transaction_date, last_transaction_id), en el
+    mismo orden en que las recorre el recálculo completo. Se conserva aunque
+    la posición quede a cero, para que la siguiente transacción no obligue a
+    reprocesar el histórico.
+    """
+    __tablename__ = "position_ledgers"
+
+    portfolio_id = Column(UUID(as_uuid=True), ForeignKey("portfolios.id", ondelete="CASCADE"), primary_key=True)
+    asset_id = Column(UUID(as_uuid=True), ForeignKey("assets.id"), primary_key=True)
+    quantity = Column(Numeric(38, 18), nullable=False, default=0)
+    total_cost = Column(Numeric(38, 18), nullable=False, default=0)
+    last_transaction_date = Column(DateTime(timezone=True), nullable=True)
+    last_transaction_id = Column(UUID(as_uuid=True), nullable=True)
+    transaction_count = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
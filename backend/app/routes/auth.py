@@ -1,14 +1,14 @@
 from fastapi import APIRouter, Depends, HTTPException, status, Response, Request
 from fastapi.security import OAuth2PasswordRequestForm
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
 from datetime import datetime
 from typing import Optional
 from uuid import UUID
 from slowapi import Limiter
 from slowapi.util import get_remote_address
-from ..db.session import get_db
-from ..core.auth import verify_password, get_password_hash
+from ..db.session import get_async_db
+from ..core.security import verify_and_update_password, hash_password_async
 from ..core.session import session_manager
 from ..core.middleware import require_auth, optional_auth
 from ..models.usuario import Usuario
@@ -55,7 +55,7 @@ async def login(
     request: Request,
     response: Response,
     form_data: OAuth2PasswordRequestForm = Depends(),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Login con sesión en cookie HttpOnly
@@ -72,12 +72,17 @@ async def login(
     # Normalizar username (trim y lowercase) para hacer el login insensible a mayúsculas/espacios
     username = form_data.username.strip().lower() if form_data.username else ""
     
-    result = db.execute(
+    result = await db.execute(
         select(Usuario).where(Usuario.username == username)
     )
     user = result.scalar_one_or_none()
     
-    if not user or not verify_password(form_data.password, user.hashed_password):
+    # Verificación en el pool de hashing (no bloquea el event loop)
+    valid, new_hash = (
+        await verify_and_update_password(form_data.password, user.hashed_password)
+        if user else (False, None)
+    )
+    if not valid:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Usuario o contraseña incorrectos",
@@ -89,9 +94,11 @@ async def login(
             detail="Usuario inactivo"
         )
     
-    # Actualizar último login
+    # Actualizar último login (y el hash si era bcrypt o cambió el coste)
     user.last_login_at = datetime.utcnow()
-    db.commit()
+    if new_hash:
+        user.hashed_password = new_hash
+    await db.commit()
     
     # Crear sesión en Redis
     session_id = await session_manager.create_session(
@@ -161,7 +168,7 @@ async def logout(
 @router.get("/me", response_model=UserResponse)
 async def get_current_user(
     user: dict = Depends(require_auth),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Obtener usuario actual desde sesión
@@ -174,7 +181,7 @@ async def get_current_user(
         UserResponse con datos actualizados
     """
     # Obtener usuario actualizado de la BD
-    result = db.execute(
+    result = await db.execute(
         select(Usuario).where(Usuario.id == UUID(user["user_id"]))
     )
     db_user = result.scalar_one_or_none()
@@ -192,7 +199,7 @@ async def get_current_user(
 async def register(
     request: Request,
     user_data: UserCreate,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Registrar nuevo usuario
@@ -205,7 +212,7 @@ async def register(
         UserResponse con datos del usuario creado
     """
     # Verificar si el usuario ya existe
-    result = db.execute(
+    result = await db.execute(
         select(Usuario).where(
             (Usuario.username == user_data.username) | (Usuario.email == user_data.email)
         )
@@ -222,13 +229,13 @@ async def register(
     new_user = Usuario(
         username=user_data.username,
         email=user_data.email,
-        hashed_password=get_password_hash(user_data.password),
+        hashed_password=await hash_password_async(user_data.password),
         is_active=True
     )
     
     db.add(new_user)
-    db.commit()
-    db.refresh(new_user)
+    await db.commit()
+    await db.refresh(new_user)
     
     return new_user
 
@@ -9,8 +9,9 @@ from datetime import date as DateType
 from uuid import UUID
 import io
 
-from app.core.database import get_db
+from app.core.database import get_db, SessionLocal
 from app.core.middleware import require_auth
+from app.utils.portfolio_utils import schedule_snapshot_recalculation
 from app.services.import_export_service import ImportExportService
 from app.schemas.import_export import ImportStats, ExportQuotesRequest
 
@@ -19,12 +20,28 @@ router = APIRouter(prefix="/api/import-export", tags=["import-export"])
 
 # ==================== EXPORTACIÓN ====================
 
+XLSX_MEDIA_TYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+
+def _stream_export(export, *args):
+    """
+    Ejecutar una exportación en streaming con su propia sesión de BD
+
+    La sesión vive mientras se emite la respuesta (y no solo mientras dura
+    el endpoint), ya que las filas se leen del cursor a medida que se envían.
+    """
+    db = SessionLocal()
+    try:
+        yield from export(ImportExportService(db), *args)
+    finally:
+        db.close()
+
+
 @router.get("/transactions/{portfolio_id}/export")
 async def export_transactions(
     portfolio_id: UUID,
     format: str = Query("csv", pattern="^(csv|xlsx)$", description="Formato: csv o xlsx"),
-    user: dict = Depends(require_auth),
-    db: Session = Depends(get_db)
+    user: dict = Depends(require_auth)
 ):
     """
     Exportar transacciones de un portfolio
@@ -34,34 +51,22 @@ async def export_transactions(
         format: Formato de exportación (csv o xlsx)
     
     Returns:
-        Archivo CSV o XLSX con las transacciones
+        Archivo CSV o XLSX con las transacciones (en streaming)
     """
-    service = ImportExportService(db)
-    
-    try:
-        if format == "csv":
-            content = service.export_transactions_csv(portfolio_id)
-            return Response(
-                content=content,
-                media_type="text/csv",
-                headers={
-                    "Content-Disposition": f"attachment; filename=transactions_{portfolio_id}.csv"
-                }
-            )
-        else:  # xlsx
-            content = service.export_transactions_xlsx(portfolio_id)
-            return Response(
-                content=content,
-                media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                headers={
-                    "Content-Disposition": f"attachment; filename=transactions_{portfolio_id}.xlsx"
-                }
-            )
-    except Exception as e:
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"Error al exportar transacciones: {str(e)}"
-        )
+    if format == "csv":
+        export = ImportExportService.export_transactions_csv
+        media_type = "text/csv"
+    else:  # xlsx
+        export = ImportExportService.export_transactions_xlsx
+        media_type = XLSX_MEDIA_TYPE
+
+    return StreamingResponse(
+        _stream_export(export, portfolio_id),
+        media_type=media_type,
+        headers={
+            "Content-Disposition": f"attachment; filename=transactions_{portfolio_id}.{format}"
+        }
+    )
 
 
 @router.get("/quotes/export")
@@ -70,8 +75,7 @@ async def export_quotes(
     start_date: Optional[DateType] = Query(None, description="Fecha de inicio"),
     end_date: Optional[DateType] = Query(None, description="Fecha de fin"),
     format: str = Query("csv", pattern="^(csv|xlsx)$", description="Formato: csv o xlsx"),
-    user: dict = Depends(require_auth),
-    db: Session = Depends(get_db)
+    user: dict = Depends(require_auth)
 ):
     """
     Exportar cotizaciones históricas
@@ -83,36 +87,23 @@ async def export_quotes(
         format: Formato de exportación (csv o xlsx)
     
     Returns:
-        Archivo CSV o XLSX con las cotizaciones
+        Archivo CSV o XLSX con las cotizaciones (en streaming)
     """
-    service = ImportExportService(db)
-    
-    try:
-        if format == "csv":
-            content = service.export_quotes_csv(symbol, start_date, end_date)
-            filename = f"quotes_{symbol if symbol else 'all'}.csv"
-            return Response(
-                content=content,
-                media_type="text/csv",
-                headers={
-                    "Content-Disposition": f"attachment; filename={filename}"
-                }
-            )
-        else:  # xlsx
-            content = service.export_quotes_xlsx(symbol, start_date, end_date)
-            filename = f"quotes_{symbol if symbol else 'all'}.xlsx"
-            return Response(
-                content=content,
-                media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                headers={
-                    "Content-Disposition": f"attachment; filename={filename}"
-                }
-            )
-    except Exception as e:
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"Error al exportar cotizaciones: {str(e)}"
-        )
+    if format == "csv":
+        export = ImportExportService.export_quotes_csv
+        media_type = "text/csv"
+    else:  # xlsx
+        export = ImportExportService.export_quotes_xlsx
+        media_type = XLSX_MEDIA_TYPE
+
+    filename = f"quotes_{symbol if symbol else 'all'}.{format}"
+    return StreamingResponse(
+        _stream_export(export, symbol, start_date, end_date),
+        media_type=media_type,
+        headers={
+            "Content-Disposition": f"attachment; filename={filename}"
+        }
+    )
 
 
 # ==================== IMPORTACIÓN ====================
@@ -150,36 +141,18 @@ async def import_transactions(
         )
     
     try:
-        # Leer contenido
-        content = await file.read()
+        # Procesar el fichero subido por bloques, sin cargarlo entero en memoria
         service = ImportExportService(db)
         
         if filename.endswith('.csv'):
-            csv_content = content.decode('utf-8')
-            stats = service.import_transactions_csv(portfolio_id, csv_content, skip_duplicates)
+            stats = service.import_transactions_csv(portfolio_id, file.file, skip_duplicates)
         else:
             # Excel
-            stats = service.import_transactions_xlsx(portfolio_id, content, skip_duplicates)
+            stats = service.import_transactions_xlsx(portfolio_id, file.file, skip_duplicates)
         
-        # Trigger snapshot recalculation if transactions were created
+        # Encolar el recálculo de snapshots si se crearon transacciones
         if stats.get('created', 0) > 0 and stats.get('min_date'):
-            from datetime import datetime
-            from app.services.snapshot_service import snapshot_service
-            
-            today = datetime.now().date()
-            min_date = stats['min_date']
-            
-            def run_recalculation(pid, start_date, end_date):
-                from app.core.database import SessionLocal
-                db_bg = SessionLocal()
-                try:
-                    snapshot_service.create_daily_snapshots_for_portfolio(
-                        db_bg, pid, start_date, end_date, overwrite=True
-                    )
-                finally:
-                    db_bg.close()
-            
-            background_tasks.add_task(run_recalculation, portfolio_id, min_date, today)
+            await schedule_snapshot_recalculation(background_tasks, portfolio_id, stats['min_date'])
         
         return stats
         
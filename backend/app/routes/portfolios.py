@@ -1,15 +1,15 @@
 from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
 from sqlalchemy.orm import selectinload
 from typing import List
 from uuid import UUID
-from ..db.session import get_db
+from ..db.session import get_async_db
 from ..core.middleware import require_auth
 from ..models.usuario import Usuario
 from ..models.portfolio import Portfolio
 from sqlalchemy.orm import joinedload
-from app.utils.portfolio_utils import get_user_portfolio_or_404
+from app.utils.portfolio_utils import get_user_portfolio_or_404_async
 from ..models.position import Position
 from ..models.asset import Asset
 from ..schemas.portfolio import PortfolioCreate, PortfolioUpdate, PortfolioResponse, PortfolioDetail, PositionResponse
@@ -19,10 +19,10 @@ router = APIRouter(prefix="/api/portfolios", tags=["portfolios"])
 @router.get("", response_model=List[PortfolioResponse])
 async def list_portfolios(
     user: dict = Depends(require_auth),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Listar todos los portfolios del usuario actual"""
-    result = db.execute(
+    result = await db.execute(
         select(Portfolio).where(Portfolio.user_id == UUID(user["user_id"]))
     )
     portfolios = result.scalars().all()
@@ -32,7 +32,7 @@ async def list_portfolios(
 async def create_portfolio(
     portfolio: PortfolioCreate,
     user: dict = Depends(require_auth),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Crear un nuevo portfolio"""
     db_portfolio = Portfolio(
@@ -40,21 +40,21 @@ async def create_portfolio(
         user_id=UUID(user["user_id"])
     )
     db.add(db_portfolio)
-    db.commit()
-    db.refresh(db_portfolio)
+    await db.commit()
+    await db.refresh(db_portfolio)
     return db_portfolio
 
 @router.get("/{portfolio_id}", response_model=PortfolioDetail)
 async def get_portfolio(
     portfolio_id: UUID,
     user: dict = Depends(require_auth),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Obtener una cartera específica con sus posiciones"""
-    # Cargar posiciones y activos asociados en una sola consulta
-    result = db.execute(
+    # Cargar posiciones y activos asociados de antemano (sin carga perezosa)
+    result = await db.execute(
         select(Portfolio).options(
-            selectinload(Portfolio.positions)
+            selectinload(Portfolio.positions).selectinload(Position.asset)
         ).where(
             Portfolio.id == portfolio_id,
             Portfolio.user_id == UUID(user["user_id"]) 
@@ -75,10 +75,10 @@ async def update_portfolio(
     portfolio_id: UUID,
     portfolio_update: PortfolioUpdate,
     user: dict = Depends(require_auth),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Actualizar una cartera"""
-    result = db.execute(
+    result = await db.execute(
         select(Portfolio).where(
             Portfolio.id == portfolio_id,
             Portfolio.user_id == UUID(user["user_id"])
@@ -96,18 +96,18 @@ async def update_portfolio(
     for field, value in update_data.items():
         setattr(db_portfolio, field, value)
     
-    db.commit()
-    db.refresh(db_portfolio)
+    await db.commit()
+    await db.refresh(db_portfolio)
     return db_portfolio
 
 @router.delete("/{portfolio_id}", status_code=status.HTTP_204_NO_CONTENT)
 async def delete_portfolio(
     portfolio_id: UUID,
     user: dict = Depends(require_auth),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Eliminar una cartera"""
-    result = db.execute(
+    result = await db.execute(
         select(Portfolio).where(
             Portfolio.id == portfolio_id,
             Portfolio.user_id == UUID(user["user_id"])
@@ -121,61 +121,67 @@ async def delete_portfolio(
             detail="Cartera no encontrada"
         )
     
-    db.delete(db_portfolio)
-    db.commit()
+    await db.delete(db_portfolio)
+    await db.commit()
     return None
 
 @router.post("/{portfolio_id}/calculate")
 async def calculate_portfolio(
     portfolio_id: UUID,
     user: dict = Depends(require_auth),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Recalcular métricas del portfolio"""
     # Verificar propiedad
-    get_user_portfolio_or_404(db, portfolio_id, UUID(user["user_id"]))
+    await get_user_portfolio_or_404_async(db, portfolio_id, UUID(user["user_id"]))
     
     from app.services.result_service import ResultService
-    service = ResultService(db)
-    result = service.calculate_portfolio_result(portfolio_id)
-    return result
+    return await db.run_sync(
+        lambda session: ResultService(session).calculate_portfolio_result(portfolio_id)
+    )
 
 @router.post("/{portfolio_id}/recalculate_positions")
 async def recalculate_portfolio_positions(
     portfolio_id: UUID,
     user: dict = Depends(require_auth),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Forzar recálculo de todas las posiciones del portfolio"""
     # Verificar propiedad
-    get_user_portfolio_or_404(db, portfolio_id, UUID(user["user_id"]))
+    await get_user_portfolio_or_404_async(db, portfolio_id, UUID(user["user_id"]))
     
     from app.services.position_service import PositionService
-    from app.models.transaction import Transaction
-    
-    # Obtener todos los assets que tienen transacciones en este portfolio
-    asset_ids = db.scalars(
-        select(Transaction.asset_id)
-        .where(Transaction.portfolio_id == portfolio_id)
-        .distinct()
-    ).all()
     
-    position_service = PositionService(db)
-    recalculated_count = 0
+    # Recálculo en bloque: una consulta de transacciones y una sentencia por fase
+    stats = await db.run_sync(
+        lambda session: PositionService(session).rebuild_positions(portfolio_id)
+    )
+    await db.commit()
     
-    for asset_id in asset_ids:
-        position_service.recalculate_position(portfolio_id, asset_id)
-        recalculated_count += 1
-        
-    db.commit()
+    return {
+        "message": f"Se han recalculado {stats['assets']} posiciones correctamente",
+        **stats
+    }
+
+@router.get("/{portfolio_id}/positions/consistency")
+async def check_portfolio_positions_consistency(
+    portfolio_id: UUID,
+    user: dict = Depends(require_auth),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Comparar posiciones y ledger incremental con un recálculo completo (solo lectura)"""
+    await get_user_portfolio_or_404_async(db, portfolio_id, UUID(user["user_id"]))
     
-    return {"message": f"Se han recalculado {recalculated_count} posiciones correctamente"}
+    from app.services.position_service import PositionService
+    return await db.run_sync(
+        lambda session: PositionService(session).check_consistency(portfolio_id)
+    )
 
 @router.get("/{portfolio_id}/positions", response_model=List[PositionResponse])
 async def get_portfolio_positions(
     portfolio_id: UUID,
     user: dict = Depends(require_auth),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Obtener todas las posiciones del portfolio"""
     # Usar get_portfolio para reutilizar la lógica de carga de relaciones
@@ -187,11 +193,12 @@ async def get_portfolio_positions(
 async def get_portfolio_results(
     portfolio_id: UUID,
     user: dict = Depends(require_auth),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Obtener historial de resultados"""
-    get_user_portfolio_or_404(db, portfolio_id, UUID(user["user_id"]))
+    await get_user_portfolio_or_404_async(db, portfolio_id, UUID(user["user_id"]))
     
     from app.services.result_service import ResultService
-    service = ResultService(db)
-    return service.get_portfolio_history(portfolio_id)
+    return await db.run_sync(
+        lambda session: ResultService(session).get_portfolio_history(portfolio_id)
+    )
@@ -2,21 +2,27 @@
 Rutas para obtener precios de activos en tiempo real
 """
 from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
-from typing import List, Dict
+from typing import List, Dict, Optional
+from datetime import datetime, timezone
 from uuid import UUID
-from ..db.session import get_db
+from ..db.session import get_async_db
 from ..models.asset import Asset
 from ..services.finnhub_service import finnhub_service
 
 router = APIRouter(prefix="/api/prices", tags=["prices"])
 
+@router.get("/cache/stats")
+async def get_price_cache_stats():
+    """Contadores de aciertos/fallos de la cache de precios (memoria y Redis)"""
+    return finnhub_service.get_cache_stats()
+
 @router.get("/{symbol}")
-async def get_asset_price(symbol: str, db: Session = Depends(get_db)):
+async def get_asset_price(symbol: str, db: AsyncSession = Depends(get_async_db)):
     """Obtener precio actual de un activo por su símbolo"""
     # Buscar el asset en la base de datos
-    result = db.execute(
+    result = await db.execute(
         select(Asset).where(Asset.symbol == symbol.upper())
     )
     asset = result.scalar_one_or_none()
@@ -38,7 +44,7 @@ async def get_asset_price(symbol: str, db: Session = Depends(get_db)):
     }
 
 @router.get("")
-async def get_multiple_prices(symbols: str, db: Session = Depends(get_db)):
+async def get_multiple_prices(symbols: str, db: AsyncSession = Depends(get_async_db)):
     """
     Obtener precios de múltiples activos
     Parámetro symbols: lista de símbolos separados por coma (ej: AAPL,GOOGL,BTC)
@@ -46,7 +52,7 @@ async def get_multiple_prices(symbols: str, db: Session = Depends(get_db)):
     symbol_list = [s.strip().upper() for s in symbols.split(",")]
     
     # Buscar assets en la base de datos
-    result = db.execute(
+    result = await db.execute(
         select(Asset).where(Asset.symbol.in_(symbol_list))
     )
     assets = result.scalars().all()
@@ -54,9 +60,14 @@ async def get_multiple_prices(symbols: str, db: Session = Depends(get_db)):
     if not assets:
         raise HTTPException(status_code=404, detail="No se encontraron assets")
     
+    # Una sola lectura de cache para todos los símbolos; solo los fallos van a Finnhub
+    prices = await finnhub_service.get_asset_prices(
+        {asset.symbol: asset.asset_type for asset in assets}
+    )
+    
     results = []
     for asset in assets:
-        price_data = await finnhub_service.get_asset_price(asset.symbol, asset.asset_type)
+        price_data = prices.get(asset.symbol)
         if price_data:
             results.append({
                 "id": asset.id,
@@ -70,12 +81,12 @@ async def get_multiple_prices(symbols: str, db: Session = Depends(get_db)):
     return results
 
 @router.get("/portfolio/{portfolio_id}")
-async def get_portfolio_prices(portfolio_id: UUID, db: Session = Depends(get_db)):
+async def get_portfolio_prices(portfolio_id: UUID, db: AsyncSession = Depends(get_async_db)):
     """Obtener precios actuales de todos los activos en un portfolio"""
     from ..models.position import Position
     from sqlalchemy.orm import selectinload
     
-    result = db.execute(
+    result = await db.execute(
         select(Position).options(
             selectinload(Position.asset)
         ).where(
@@ -88,82 +99,67 @@ async def get_portfolio_prices(portfolio_id: UUID, db: Session = Depends(get_db)
     if not positions:
         return []
 
-    import asyncio
-
-    # Semáforo para limitar concurrencia y respetar rate limits de Finnhub
-    # Free tier: 60 req/min. Con 5 concurrentes evitamos picos agresivos.
-    semaphore = asyncio.Semaphore(10)
-
-    async def fetch_price_safely(position):
-        async with semaphore:
-            try:
-                asset = position.asset
-                price = await finnhub_service.get_asset_price(asset.symbol, asset.asset_type)
-                return position, price
-            except Exception:
-                return position, None
-
-    
     # Pre-fetch latest quotes from DB for all assets in portfolio to optimize fallback
-    from ..models.quote import Quote
-    from sqlalchemy import func
-    
-    asset_ids = [p.asset_id for p in positions]
+    from ..services.price_resolver import price_resolver
     
-    # Subquery to find max timestamp per asset
-    subquery = (
-        db.query(Quote.asset_id, func.max(Quote.timestamp).label("max_ts"))
-        .filter(Quote.asset_id.in_(asset_ids))
-        .group_by(Quote.asset_id)
-        .subquery()
+    latest_quotes_map = await db.run_sync(
+        price_resolver.get_quotes_as_of, [p.asset_id for p in positions]
     )
     
-    # Query to get the full quote rows
-    latest_quotes_query = (
-        db.query(Quote)
-        .join(subquery, (Quote.asset_id == subquery.c.asset_id) & (Quote.timestamp == subquery.c.max_ts))
+    # Stale-while-revalidate: se responde ya con el precio más reciente
+    # conocido y los obsoletos o ausentes se actualizan en segundo plano,
+    # de modo que la latencia no depende de la disponibilidad de Finnhub
+    prices = await finnhub_service.get_asset_prices(
+        {p.asset.symbol: p.asset.asset_type for p in positions},
+        stale_while_revalidate=True
     )
     
-    latest_quotes_map = {q.asset_id: q for q in latest_quotes_query.all()}
-    
-    tasks = [fetch_price_safely(p) for p in positions]
-    results_pairs = await asyncio.gather(*tasks)
+    def to_epoch(value: Optional[datetime]) -> float:
+        if value is None:
+            return 0.0
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        return value.timestamp()
     
     results = []
-    for position, price_data in results_pairs:
+    for position in positions:
         asset = position.asset
-        print(f"DEBUG: Processing {asset.symbol}, Price Data: {price_data is not None}")
+        price_data = prices.get(asset.symbol)
         
-        if price_data:
+        if price_data and not price_data["stale"]:
             current_price = price_data["current_price"]
             change_percent = price_data["change_percent"]
+            price_source = "live"
+            stale = False
             
             # Actualizar precio en BD para persistencia
             asset.last_price = current_price
-            from datetime import datetime
             asset.last_price_updated_at = datetime.utcnow()
             
         else:
-            # Fallback 1: Usar último precio conocido en columna Asset
+            # Candidatos obsoletos (cache, Asset.last_price, última cotización):
+            # se usa el más reciente
+            candidates = []
+            if price_data:
+                candidates.append((price_data.get("fetched_at") or 0.0, "cache", price_data["current_price"], price_data["change_percent"]))
             if asset.last_price is not None:
-                current_price = asset.last_price
-                change_percent = 0.0 
-                print(f"DEBUG: Using Asset.last_price for {asset.symbol}: {current_price}")
-            
-            # Fallback 2: Usar última cotización en tabla Quotes (Histórico)
-            elif asset.id in latest_quotes_map:
+                candidates.append((to_epoch(asset.last_price_updated_at), "last_price", asset.last_price, 0.0))
+            if asset.id in latest_quotes_map:
                 quote = latest_quotes_map[asset.id]
-                current_price = float(quote.close)
+                quote_close = float(quote.close)
                 # Intentar calcular cambio con el open del mismo día si es posible, o 0
-                day_open = float(quote.open) if quote.open else current_price
-                change_percent = ((current_price - day_open) / day_open * 100) if day_open else 0.0
-                print(f"DEBUG: Using Quote history for {asset.symbol}: {current_price}")
-                
-            # Fallback 3: Usar precio promedio de compra
+                day_open = float(quote.open) if quote.open else quote_close
+                quote_change = ((quote_close - day_open) / day_open * 100) if day_open else 0.0
+                candidates.append((to_epoch(quote.timestamp), "quote", quote_close, quote_change))
+            
+            if candidates:
+                _, price_source, current_price, change_percent = max(candidates, key=lambda c: c[0])
             else:
+                # Último recurso: precio promedio de compra
+                price_source = "average_price"
                 current_price = position.average_price
                 change_percent = 0.0
-                print(f"DEBUG: Using avg_price fallback for {asset.symbol}: {current_price}")
+            stale = True
 
         current_value = position.quantity * current_price
         cost_basis = position.quantity * position.average_price
@@ -183,14 +179,15 @@ async def get_portfolio_prices(portfolio_id: UUID, db: Session = Depends(get_db)
             "cost_basis": cost_basis,
             "profit_loss": profit_loss,
             "profit_loss_percent": profit_loss_percent,
-            "change_percent": change_percent
+            "change_percent": change_percent,
+            "price_source": price_source,
+            "stale": stale
         })
     
     try:
-        db.commit()
+        await db.commit()
     except Exception as e:
         print(f"ERROR: Failed to commit price updates: {e}")
-        db.rollback()
+        await db.rollback()
         
-    print(f"DEBUG: Returning {len(results)} results")
     return results
@@ -3,11 +3,12 @@ Rutas para gestión de cotizaciones históricas
 """
 from fastapi import APIRouter, Depends, HTTPException, status, Query
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import Optional, List
 from datetime import date, datetime
 from uuid import UUID
 
-from app.core.database import get_db
+from app.core.database import get_db, get_async_db
 from app.core.middleware import require_auth
 from app.services.quote_service import QuoteService
 from app.schemas.quote import (
@@ -27,7 +28,7 @@ async def get_quotes(
     start_date: Optional[date] = Query(None, description="Fecha de inicio"),
     end_date: Optional[date] = Query(None, description="Fecha de fin"),
     limit: int = Query(10000, ge=1, le=10000, description="Límite de resultados"),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     user: dict = Depends(require_auth)
 ):
     """
@@ -35,12 +36,13 @@ async def get_quotes(
     
     Requiere autenticación.
     """
-    service = QuoteService(db)
-    quotes = service.get_quotes(
-        symbol=symbol,
-        start_date=start_date,
-        end_date=end_date,
-        limit=limit
+    quotes = await db.run_sync(
+        lambda session: QuoteService(session).get_quotes(
+            symbol=symbol,
+            start_date=start_date,
+            end_date=end_date,
+            limit=limit
+        )
     )
     return quotes
 
@@ -48,7 +50,7 @@ async def get_quotes(
 @router.get("/latest/{symbol}", response_model=QuoteResponse)
 async def get_latest_quote(
     symbol: str,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     user: dict = Depends(require_auth)
 ):
     """
@@ -56,8 +58,9 @@ async def get_latest_quote(
     
     Requiere autenticación.
     """
-    service = QuoteService(db)
-    quote = service.get_latest_quote(symbol)
+    quote = await db.run_sync(
+        lambda session: QuoteService(session).get_latest_quote(symbol)
+    )
     
     if not quote:
         raise HTTPException(
@@ -72,7 +75,7 @@ async def get_latest_quote(
 async def get_quote_by_date(
     symbol: str,
     quote_date: date,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     user: dict = Depends(require_auth)
 ):
     """
@@ -80,8 +83,9 @@ async def get_quote_by_date(
     
     Requiere autenticación.
     """
-    service = QuoteService(db)
-    quote = service.get_quote_by_symbol_date(symbol, quote_date)
+    quote = await db.run_sync(
+        lambda session: QuoteService(session).get_quote_by_symbol_date(symbol, quote_date)
+    )
     
     if not quote:
         raise HTTPException(
@@ -95,7 +99,7 @@ async def get_quote_by_date(
 @router.post("", response_model=QuoteResponse, status_code=status.HTTP_201_CREATED)
 async def create_quote(
     quote_data: QuoteCreate,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     user: dict = Depends(require_auth)
 ):
     """
@@ -104,10 +108,10 @@ async def create_quote(
     Requiere autenticación.
     Lanza error 409 si ya existe una cotización para ese símbolo y fecha.
     """
-    service = QuoteService(db)
-    
     # Verificar si ya existe
-    existing = service.get_quote_by_symbol_date(quote_data.symbol, quote_data.date)
+    existing = await db.run_sync(
+        lambda session: QuoteService(session).get_quote_by_symbol_date(quote_data.symbol, quote_data.date)
+    )
     if existing:
         raise HTTPException(
             status_code=status.HTTP_409_CONFLICT,
@@ -115,7 +119,9 @@ async def create_quote(
         )
     
     try:
-        quote = service.create_quote(quote_data)
+        quote = await db.run_sync(
+            lambda session: QuoteService(session).create_quote(quote_data)
+        )
         return quote
     except Exception as e:
         raise HTTPException(
@@ -127,7 +133,7 @@ async def create_quote(
 @router.post("/bulk", response_model=QuoteBulkResponse)
 async def bulk_import_quotes(
     bulk_data: QuoteBulkCreate,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     user: dict = Depends(require_auth)
 ):
     """
@@ -136,13 +142,14 @@ async def bulk_import_quotes(
     Requiere autenticación.
     Permite manejar duplicados (actualizar o omitir según skip_duplicates).
     """
-    service = QuoteService(db)
-    result = service.bulk_import_quotes(bulk_data)
+    result = await db.run_sync(
+        lambda session: QuoteService(session).bulk_import_quotes(bulk_data)
+    )
     return result
 
 
 @router.post("/import-historical", response_model=QuoteBulkResponse)
-async def import_historical(
+def import_historical(
     request: QuoteHistoricalRequest,
     db: Session = Depends(get_db),
     user: dict = Depends(require_auth)
@@ -152,6 +159,7 @@ async def import_historical(
     
     Requiere autenticación.
     Obtiene datos OHLCV desde Finnhub para el rango de fechas especificado.
+    Handler síncrono (threadpool): el cliente de Finnhub es bloqueante.
     """
     service = QuoteService(db)
     
@@ -181,7 +189,7 @@ async def import_historical(
 @router.delete("/{quote_id}")
 async def delete_quote(
     quote_id: UUID,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     user: dict = Depends(require_auth)
 ):
     """
@@ -191,7 +199,7 @@ async def delete_quote(
     """
     from app.models.quote import Quote
     
-    quote = db.query(Quote).filter(Quote.id == quote_id).first()
+    quote = await db.get(Quote, quote_id)
     
     if not quote:
         raise HTTPException(
@@ -199,8 +207,8 @@ async def delete_quote(
             detail="Cotización no encontrada"
         )
     
-    db.delete(quote)
-    db.commit()
+    await db.delete(quote)
+    await db.commit()
     
     return {"message": "Cotización eliminada exitosamente"}
 
@@ -210,7 +218,7 @@ async def delete_quote(
 # ============================================
 
 @router.post("/import-historical-smart", response_model=QuoteBulkResponse)
-async def import_historical_smart(
+def import_historical_smart(
     symbol: str = Query(..., description="Símbolo del activo"),
     start_date: date = Query(..., description="Fecha de inicio"),
     end_date: date = Query(..., description="Fecha de fin"),
@@ -224,7 +232,8 @@ async def import_historical_smart(
     Solo importa rangos de fechas faltantes (gaps).
     Con force_refresh=True, re-importa todos los datos.
     
-    Máximo permitido: 2 años por solicitud.
+    Máximo permitido: 2 años por solicitud. Handler síncrono (threadpool):
+    la descarga de históricos hace peticiones HTTP bloqueantes.
     """
     # Validar rango máximo
     date_diff = (end_date - start_date).days
@@ -263,7 +272,7 @@ async def get_quote_coverage(
     symbol: str,
     start_date: date = Query(..., description="Fecha de inicio"),
     end_date: date = Query(..., description="Fecha de fin"),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     user: dict = Depends(require_auth)
 ):
     """
@@ -271,10 +280,10 @@ async def get_quote_coverage(
     
     Retorna información sobre qué fechas tienen datos y cuáles faltan.
     """
-    service = QuoteService(db)
-    
     total_days = (end_date - start_date).days + 1
-    missing_ranges = service.get_missing_date_ranges(symbol, start_date, end_date)
+    missing_ranges = await db.run_sync(
+        lambda session: QuoteService(session).get_missing_date_ranges(symbol, start_date, end_date)
+    )
     
     missing_days = sum((r[1] - r[0]).days + 1 for r in missing_ranges)
     coverage_percent = ((total_days - missing_days) / total_days) * 100 if total_days > 0 else 0
@@ -296,7 +305,7 @@ async def get_quote_coverage(
 
 
 @router.post("/update-latest/{symbol}")
-async def update_latest_quote(
+def update_latest_quote(
     symbol: str,
     db: Session = Depends(get_db),
     user: dict = Depends(require_auth)
@@ -304,7 +313,8 @@ async def update_latest_quote(
     """
     Actualizar con la última cotización en tiempo real
     
-    Obtiene el precio actual desde Finnhub y lo guarda/actualiza.
+    Obtiene el precio actual desde Finnhub y lo guarda/actualiza. Handler
+    síncrono (threadpool): el cliente de Finnhub es bloqueante.
     """
     service = QuoteService(db)
     result = service.update_latest_quote_realtime(symbol)
@@ -320,24 +330,21 @@ async def update_latest_quote(
 
 @router.post("/update-all-latest")
 async def update_all_latest_quotes(
-    db: Session = Depends(get_db),
     user: dict = Depends(require_auth)
 ):
     """
     Actualizar cotizaciones de todos los activos
     
-    Obtiene precios actuales de todos los activos desde Finnhub.
-    Respeta rate limits con delays automáticos.
+    Obtiene precios actuales de todos los activos desde Finnhub, con
+    peticiones concurrentes limitadas a FINNHUB_RATE_LIMIT por minuto.
     
     ADVERTENCIA: Puede tardar varios minutos con muchos activos.
     """
-    from app.models.asset import Asset
-    import asyncio
+    from app.services.quote_refresher import quote_refresher
     
-    # Obtener todos los activos
-    assets = db.query(Asset).all()
+    stats = await quote_refresher.refresh_all()
     
-    if not assets:
+    if not stats["total_assets"]:
         return {
             "success": True,
             "message": "No hay activos para actualizar",
@@ -345,33 +352,13 @@ async def update_all_latest_quotes(
             "failed": 0
         }
     
-    service = QuoteService(db)
-    updated = 0
-    failed = 0
-    errors = []
-    
-    for asset in assets:
-        result = service.update_latest_quote_realtime(asset.symbol)
-        
-        if result and result.get("success"):
-            updated += 1
-        else:
-            failed += 1
-            errors.append({
-                "symbol": asset.symbol,
-                "error": result.get("error", "Unknown error") if result else "No response"
-            })
-        
-        # Delay para respetar rate limits
-        await asyncio.sleep(1.1)
-    
     return {
         "success": True,
-        "total_assets": len(assets),
-        "updated": updated,
-        "failed": failed,
-        "errors": errors[:10],  # Solo primeros 10 errores
-        "timestamp": datetime.utcnow().isoformat()
+        "total_assets": stats["total_assets"],
+        "updated": stats["updated"],
+        "failed": stats["failed"],
+        "errors": stats["errors"][:10],  # Solo primeros 10 errores
+        "timestamp": stats["timestamp"]
     }
 
 
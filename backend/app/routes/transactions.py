@@ -1,11 +1,13 @@
 from fastapi import APIRouter, Depends, HTTPException, status, BackgroundTasks
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
 from typing import List
 from uuid import UUID
-from ..core.database import get_db
+from ..core.database import get_async_db
 from ..core.middleware import require_auth
 from ..models.portfolio import Portfolio
-from app.utils.portfolio_utils import get_user_portfolio_or_404
+from app.utils.portfolio_utils import get_user_portfolio_or_404_async, schedule_snapshot_recalculation
 from ..models.transaction import Transaction
 from ..models.position import Position
 from ..models.asset import Asset
@@ -16,26 +18,27 @@ router = APIRouter(
 )
 
 
-def get_user_portfolio(portfolio_id: UUID, user_id: UUID, db: Session) -> Portfolio:
+async def get_user_portfolio(portfolio_id: UUID, user_id: UUID, db: AsyncSession) -> Portfolio:
     """Mantener compatibilidad interna delegando al util compartido"""
-    return get_user_portfolio_or_404(db, portfolio_id, user_id)
+    return await get_user_portfolio_or_404_async(db, portfolio_id, user_id)
 
 
 @router.get("", response_model=List[TransactionResponse])
 async def list_transactions(
     portfolio_id: UUID,
     user: dict = Depends(require_auth),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
 ):
     """Listar todas las transacciones de una cartera"""
-    get_user_portfolio(portfolio_id, UUID(user["user_id"]), db)
+    await get_user_portfolio(portfolio_id, UUID(user["user_id"]), db)
 
-    transactions = (
-        db.query(Transaction)
-        .filter(Transaction.portfolio_id == portfolio_id)
+    result = await db.execute(
+        select(Transaction)
+        .options(selectinload(Transaction.asset))
+        .where(Transaction.portfolio_id == portfolio_id)
         .order_by(Transaction.transaction_date.desc())
-        .all()
     )
+    transactions = result.scalars().all()
 
     return transactions
 
@@ -46,13 +49,13 @@ async def create_transaction(
     transaction: TransactionCreate,
     background_tasks: BackgroundTasks,
     user: dict = Depends(require_auth),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
 ):
     """Crear una nueva transacción y actualizar posiciones"""
-    _ = get_user_portfolio(portfolio_id, UUID(user["user_id"]), db)
+    _ = await get_user_portfolio(portfolio_id, UUID(user["user_id"]), db)
 
     # Verificar que el activo existe
-    asset = db.query(Asset).filter(Asset.id == transaction.asset_id).first()
+    asset = await db.get(Asset, transaction.asset_id)
     if not asset:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="Activo no encontrado"
@@ -67,40 +70,28 @@ async def create_transaction(
     
     # IMPORTANTE: Hacer flush para que la nueva transacción sea visible 
     # en las consultas que hace PositionService
-    db.flush()
+    await db.flush()
     
-    position_service = PositionService(db)
-    position_service.recalculate_position(portfolio_id, transaction.asset_id)
+    # Incremental si la transacción es la más reciente; si es retroactiva,
+    # PositionService recalcula la posición completa
+    await db.run_sync(
+        lambda session: PositionService(session).apply_transaction(db_transaction)
+    )
 
-    db.commit()
-    db.refresh(db_transaction)
+    await db.commit()
+    await db.refresh(db_transaction)
+    # El activo ya está en la sesión: la respuesta lo incluye sin otra consulta
+    db_transaction.asset = asset
     
-    # Trigger snapshot recalculation in background
+    # Encolar el recálculo de snapshots desde la fecha de la transacción
     from datetime import datetime
-    from app.services.snapshot_service import snapshot_service
     
-    today = datetime.now().date()
-    # Handle naive datetime if necessary, though Pydantic usually handles it
     if transaction.transaction_date:
-        if transaction.transaction_date.tzinfo:
-            transaction_date = transaction.transaction_date.date()
-        else:
-            transaction_date = transaction.transaction_date.date()
+        transaction_date = transaction.transaction_date.date()
     else:
-        transaction_date = today
+        transaction_date = datetime.now().date()
         
-    # Define the task function to run with a fresh session
-    def run_recalculation(pid, start_date, end_date):
-        from app.core.database import SessionLocal
-        db_bg = SessionLocal()
-        try:
-            snapshot_service.create_daily_snapshots_for_portfolio(
-                db_bg, pid, start_date, end_date, overwrite=True
-            )
-        finally:
-            db_bg.close()
-            
-    background_tasks.add_task(run_recalculation, portfolio_id, transaction_date, today)
+    await schedule_snapshot_recalculation(background_tasks, portfolio_id, transaction_date)
 
     return db_transaction
 
@@ -111,18 +102,17 @@ async def delete_transaction(
     transaction_id: UUID,
     background_tasks: BackgroundTasks,
     user: dict = Depends(require_auth),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
 ):
     """Eliminar una transacción (no revierte posiciones)"""
-    get_user_portfolio(portfolio_id, UUID(user["user_id"]), db)
+    await get_user_portfolio(portfolio_id, UUID(user["user_id"]), db)
 
-    transaction = (
-        db.query(Transaction)
-        .filter(
+    result = await db.execute(
+        select(Transaction).where(
             Transaction.id == transaction_id, Transaction.portfolio_id == portfolio_id
         )
-        .first()
     )
+    transaction = result.scalar_one_or_none()
 
     if not transaction:
         raise HTTPException(
@@ -132,41 +122,25 @@ async def delete_transaction(
     # Guardar asset_id antes de borrar para recalcular
     asset_id = transaction.asset_id
     
-    db.delete(transaction)
-    db.commit()
+    await db.delete(transaction)
+    await db.commit()
     
     # Recalcular posición
     from app.services.position_service import PositionService
-    position_service = PositionService(db)
-    position_service.recalculate_position(portfolio_id, asset_id)
-    db.commit()
+    await db.run_sync(
+        lambda session: PositionService(session).recalculate_position(portfolio_id, asset_id)
+    )
+    await db.commit()
     
-    # Trigger snapshot recalculation in background
+    # Encolar el recálculo de snapshots desde la fecha de la transacción
     from datetime import datetime
-    from app.services.snapshot_service import snapshot_service
     
-    today = datetime.now().date()
-    # Handle naive datetime
     if transaction.transaction_date:
-        if transaction.transaction_date.tzinfo:
-            transaction_date = transaction.transaction_date.date()
-        else:
-            transaction_date = transaction.transaction_date.date()
+        transaction_date = transaction.transaction_date.date()
     else:
-        transaction_date = today
+        transaction_date = datetime.now().date()
         
-    # Define the task function to run with a fresh session
-    def run_recalculation(pid, start_date, end_date):
-        from app.core.database import SessionLocal
-        db_bg = SessionLocal()
-        try:
-            snapshot_service.create_daily_snapshots_for_portfolio(
-                db_bg, pid, start_date, end_date, overwrite=True
-            )
-        finally:
-            db_bg.close()
-            
-    background_tasks.add_task(run_recalculation, portfolio_id, transaction_date, today)
+    await schedule_snapshot_recalculation(background_tasks, portfolio_id, transaction_date)
     
     return None
 
@@ -176,23 +150,34 @@ async def update_transactions_batch(
     batch_update: TransactionBatchUpdate,
     background_tasks: BackgroundTasks,
     user: dict = Depends(require_auth),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
 ):
     """Actualizar múltiples transacciones en lote"""
-    get_user_portfolio(portfolio_id, UUID(user["user_id"]), db)
+    await get_user_portfolio(portfolio_id, UUID(user["user_id"]), db)
     
     affected_assets = set()
     min_date = None
     
-    for tx_update in batch_update.transactions:
-        transaction = db.query(Transaction).filter(
-            Transaction.id == tx_update.id,
+    # Cargar todas las transacciones del lote en una consulta
+    result = await db.execute(
+        select(Transaction).where(
+            Transaction.id.in_([tx_update.id for tx_update in batch_update.transactions]),
             Transaction.portfolio_id == portfolio_id
-        ).first()
+        )
+    )
+    transactions_by_id = {transaction.id: transaction for transaction in result.scalars()}
+    
+    for tx_update in batch_update.transactions:
+        transaction = transactions_by_id.get(tx_update.id)
         
         if not transaction:
             continue
             
+        # La fecha original también queda afectada si la transacción se mueve
+        original_date = transaction.transaction_date.date()
+        if min_date is None or original_date < min_date:
+            min_date = original_date
+            
         # Update fields
         if tx_update.asset_id:
             affected_assets.add(transaction.asset_id) # Old asset
@@ -227,32 +212,21 @@ async def update_transactions_batch(
         if min_date is None or tx_date < min_date:
             min_date = tx_date
             
-    db.commit()
+    await db.commit()
     
     # Recalculate positions
     from app.services.position_service import PositionService
-    position_service = PositionService(db)
-    for asset_id in affected_assets:
-        position_service.recalculate_position(portfolio_id, asset_id)
-        
-    db.commit()
     
-    # Trigger snapshot recalculation
+    def recalculate_positions(session):
+        position_service = PositionService(session)
+        for asset_id in affected_assets:
+            position_service.recalculate_position(portfolio_id, asset_id)
+    
+    await db.run_sync(recalculate_positions)
+    await db.commit()
+    
+    # Encolar el recálculo de snapshots desde la fecha más antigua editada
     if min_date:
-        from datetime import datetime
-        from app.services.snapshot_service import snapshot_service
-        today = datetime.now().date()
-        
-        def run_recalculation(pid, start_date, end_date):
-            from app.core.database import SessionLocal
-            db_bg = SessionLocal()
-            try:
-                snapshot_service.create_daily_snapshots_for_portfolio(
-                    db_bg, pid, start_date, end_date, overwrite=True
-                )
-            finally:
-                db_bg.close()
-                
-        background_tasks.add_task(run_recalculation, portfolio_id, min_date, today)
+        await schedule_snapshot_recalculation(background_tasks, portfolio_id, min_date)
         
     return {"message": "Transacciones actualizadas correctamente"}
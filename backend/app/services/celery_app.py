@@ -39,11 +39,20 @@ celery_app.conf.beat_schedule = {
         "schedule": crontab(hour=3, minute=0),  # Diariamente a las 3 AM
         "options": {"expires": 3600}
     },
+    "sweep-snapshot-recalculations-every-minute": {
+        "task": "app.services.celery_tasks.sweep_snapshot_recalculations",
+        "schedule": crontab(),  # Cada minuto
+        "options": {"expires": 55}
+    },
 }
 
 # Configuración de rutas (queues)
 celery_app.conf.task_routes = {
     "app.services.celery_tasks.update_all_asset_prices": {"queue": "prices"},
+    "app.services.celery_tasks.update_asset_prices_chunk": {"queue": "prices"},
+    "app.services.celery_tasks.summarize_asset_price_updates": {"queue": "prices"},
     "app.services.celery_tasks.update_single_asset_price": {"queue": "prices"},
     "app.services.celery_tasks.cleanup_expired_sessions": {"queue": "maintenance"},
+    "app.services.celery_tasks.recalculate_portfolio_snapshots": {"queue": "snapshots"},
+    "app.services.celery_tasks.sweep_snapshot_recalculations": {"queue": "snapshots"},
 }
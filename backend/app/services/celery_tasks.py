@@ -5,7 +5,7 @@ import logging
 from datetime import datetime, date
 from typing import List, Dict
 from sqlalchemy.orm import Session
-import finnhub
+from celery import chord
 
 from app.services.celery_app import celery_app
 from app.core.database import SessionLocal
@@ -21,61 +21,114 @@ logger = logging.getLogger(__name__)
 @celery_app.task(name="app.services.celery_tasks.update_all_asset_prices", bind=True)
 def update_all_asset_prices(self):
     """
-    Actualizar precios de todos los assets activos
+    Actualizar precios de todos los assets en uso
     Se ejecuta cada 15 minutos
+    
+    Reparte los símbolos en lotes de PRICE_UPDATE_CHUNK_SIZE que los workers
+    procesan en paralelo (group) y resume el resultado cuando terminan todos
+    (chord). La cuota de Finnhub se comparte entre lotes vía Redis.
     """
     logger.info("🔄 Iniciando actualización de precios de assets")
     
     db = SessionLocal()
     try:
-        # Obtener todos los assets únicos que están en portfolios
-        assets_in_use = db.query(Asset).join(Position).distinct().all()
-        
-        total_assets = len(assets_in_use)
-        updated = 0
-        errors = []
-        
-        logger.info(f"📊 Encontrados {total_assets} assets en uso")
-        
-        finnhub_client = finnhub.Client(api_key=settings.FINNHUB_API_KEY)
-        
-        for asset in assets_in_use:
-            try:
-                # Obtener precio actual desde Finnhub
-                quote = finnhub_client.quote(asset.symbol)
-                
-                if quote and quote.get('c'):  # 'c' es el current price
-                    current_price = quote['c']
-                    
-                    # Actualizar el asset (podrías agregar un campo last_price al modelo)
-                    logger.info(f"✓ {asset.symbol}: ${current_price}")
-                    updated += 1
-                else:
-                    logger.warning(f"⚠️ {asset.symbol}: No se pudo obtener precio")
-                    errors.append(f"{asset.symbol}: No data")
-                    
-            except Exception as e:
-                logger.error(f"✗ Error al actualizar {asset.symbol}: {str(e)}")
-                errors.append(f"{asset.symbol}: {str(e)}")
-        
-        db.commit()
-        
-        result = {
-            "total": total_assets,
-            "updated": updated,
-            "errors": len(errors),
-            "timestamp": datetime.utcnow().isoformat()
-        }
-        
-        logger.info(f"✅ Actualización completada: {updated}/{total_assets} assets")
-        return result
-        
-    except Exception as e:
-        logger.error(f"❌ Error en actualización masiva: {str(e)}")
-        db.rollback()
-        raise
+        # Assets únicos que están en portfolios: [(símbolo, asset_type)]
+        assets = [
+            (symbol, asset_type.value)
+            for symbol, asset_type in db.query(Asset.symbol, Asset.asset_type).join(Position).distinct().all()
+        ]
     finally:
         db.close()
+    
+    logger.info(f"📊 Encontrados {len(assets)} assets en uso")
+    
+    if not assets:
+        return {"total": 0, "chunks": 0, "timestamp": datetime.utcnow().isoformat()}
+    
+    chunk_size = settings.PRICE_UPDATE_CHUNK_SIZE
+    chunks = [dict(assets[i:i + chunk_size]) for i in range(0, len(assets), chunk_size)]
+    result = chord(
+        [update_asset_prices_chunk.s(chunk) for chunk in chunks]
+    )(summarize_asset_price_updates.s())
+    
+    logger.info(f"📤 {len(chunks)} lotes encolados (chord {result.id})")
+    return {
+        "total": len(assets),
+        "chunks": len(chunks),
+        "chord_id": result.id,
+        "timestamp": datetime.utcnow().isoformat()
+    }
+
+
+async def _refresh_price_chunk(assets: Dict[str, str]) -> Dict:
+    """
+    Descargar y guardar las cotizaciones de un lote
+    
+    Cada tarea corre en su propio event loop (asyncio.run), así que usa una
+    instancia propia de FinnhubService (cliente HTTP y conexión a Redis de
+    este loop) que comparte con la API la cuota y la cache de precios.
+    """
+    from app.services.finnhub_service import FinnhubService
+    from app.services.quote_refresher import quote_refresher
+    
+    service = FinnhubService()
+    try:
+        return await quote_refresher.refresh_assets(assets, service=service)
+    finally:
+        await service.close(close_redis=True)
+
+
+@celery_app.task(name="app.services.celery_tasks.update_asset_prices_chunk")
+def update_asset_prices_chunk(assets: Dict[str, str]) -> Dict:
+    """
+    Actualizar los precios de un lote de assets
+    
+    Descarga las cotizaciones con concurrencia acotada bajo el rate limit
+    compartido, las guarda en bloque (quotes del día y Asset.last_price) y
+    actualiza la cache de precios de la API.
+    
+    Args:
+        assets: {símbolo: asset_type} del lote
+    
+    Returns:
+        Dict con total_assets, updated, failed, skipped, errors y duration_seconds
+    """
+    import asyncio
+    
+    stats = asyncio.run(_refresh_price_chunk(assets))
+    logger.info(
+        f"✓ Lote de {stats['total_assets']} assets: {stats['updated']} actualizados, "
+        f"{stats['failed']} con error ({stats['duration_seconds']}s)"
+    )
+    return stats
+
+
+@celery_app.task(name="app.services.celery_tasks.summarize_asset_price_updates")
+def summarize_asset_price_updates(results: List[Dict]) -> Dict:
+    """
+    Resumir los lotes de una actualización de precios (callback del chord)
+    
+    Args:
+        results: Resultados de update_asset_prices_chunk
+    
+    Returns:
+        Dict con el total de la actualización
+    """
+    summary = {
+        "total": sum(result["total_assets"] for result in results),
+        "updated": sum(result["updated"] for result in results),
+        "errors": sum(result["failed"] for result in results),
+        "skipped": sum(result.get("skipped", 0) for result in results),
+        "chunks": len(results),
+        "timestamp": datetime.utcnow().isoformat()
+    }
+    
+    for result in results:
+        for error in result["errors"][:5]:
+            logger.warning(f"⚠️ {error['symbol']}: {error['error']}")
+    
+    logger.info(f"✅ Actualización completada: {summary['updated']}/{summary['total']} assets")
+    return summary
 
 
 @celery_app.task(name="app.services.celery_tasks.update_single_asset_price")
@@ -83,12 +136,17 @@ def update_single_asset_price(symbol: str) -> Dict:
     """
     Actualizar precio de un asset específico
     
+    Pasa por el mismo camino que los lotes: cuota compartida de Finnhub,
+    quotes del día, Asset.last_price y cache de precios.
+    
     Args:
         symbol: Símbolo del asset
     
     Returns:
         Dict con el resultado de la actualización
     """
+    import asyncio
+    
     logger.info(f"🔄 Actualizando precio de {symbol}")
     
     db = SessionLocal()
@@ -99,22 +157,26 @@ def update_single_asset_price(symbol: str) -> Dict:
             logger.error(f"❌ Asset {symbol} no encontrado")
             return {"success": False, "error": "Asset not found"}
         
-        finnhub_client = finnhub.Client(api_key=settings.FINNHUB_API_KEY)
-        quote = finnhub_client.quote(symbol.upper())
+        stats = asyncio.run(_refresh_price_chunk({asset.symbol: asset.asset_type.value}))
         
-        if quote and quote.get('c'):
-            current_price = quote['c']
-            logger.info(f"✓ {symbol}: ${current_price}")
-            
-            return {
-                "success": True,
-                "symbol": symbol,
-                "price": current_price,
-                "timestamp": datetime.utcnow().isoformat()
-            }
-        else:
-            logger.warning(f"⚠️ No se pudo obtener precio para {symbol}")
-            return {"success": False, "error": "No price data available"}
+        if stats["skipped"]:
+            # cash y tipos sin cotización en Finnhub
+            return {"success": False, "error": f"No price source for {asset.asset_type.value}"}
+        
+        if not stats["updated"]:
+            error = stats["errors"][0]["error"] if stats["errors"] else "No price data available"
+            logger.warning(f"⚠️ No se pudo obtener precio para {symbol}: {error}")
+            return {"success": False, "error": error}
+        
+        db.refresh(asset)
+        logger.info(f"✓ {symbol}: ${asset.last_price}")
+        
+        return {
+            "success": True,
+            "symbol": symbol,
+            "price": asset.last_price,
+            "timestamp": datetime.utcnow().isoformat()
+        }
             
     except Exception as e:
         logger.error(f"❌ Error al actualizar {symbol}: {str(e)}")
@@ -138,19 +200,16 @@ def cleanup_expired_sessions():
         async def cleanup():
             await session_manager.connect()
             
-            # Redis automáticamente elimina keys expiradas, 
-            # pero podemos verificar y contar
-            pattern = "session:*"
-            count = 0
-            
-            async for key in session_manager.redis_client.scan_iter(match=pattern):
-                count += 1
+            # Redis elimina las keys expiradas; aquí solo se podan del
+            # índice global las entradas caducadas y se cuentan las vigentes
+            pruned = await session_manager.prune_expired_sessions()
+            count = await session_manager.count_active_sessions()
             
-            logger.info(f"✓ Sesiones activas: {count}")
+            logger.info(f"✓ Sesiones activas: {count} (índice podado: {pruned})")
             
             await session_manager.disconnect()
             
-            return {"active_sessions": count, "timestamp": datetime.utcnow().isoformat()}
+            return {"active_sessions": count, "pruned": pruned, "timestamp": datetime.utcnow().isoformat()}
         
         result = asyncio.run(cleanup())
         logger.info("✅ Limpieza de sesiones completada")
@@ -206,3 +265,88 @@ def import_historical_quotes(symbol: str, start_date: str, end_date: str) -> Dic
         return {"success": False, "error": str(e)}
     finally:
         db.close()
+
+
+@celery_app.task(name="app.services.celery_tasks.recalculate_portfolio_snapshots", bind=True)
+def recalculate_portfolio_snapshots(self, portfolio_id: str) -> Dict:
+    """
+    Recalcular los snapshots pendientes de un portfolio
+
+    Se programa desde SnapshotRecalcQueue.enqueue. Si durante el debounce
+    llegaron nuevas marcas, la tarea se reprograma hasta su vencimiento; al
+    ejecutarse consume todas las marcas fusionadas en un único recálculo
+    desde la fecha más antigua hasta hoy. Si el recálculo falla (también
+    cuando no se pudo guardar ningún snapshot), la marca vuelve a la cola
+    con backoff exponencial (SnapshotRecalcQueue.retry_later).
+
+    Args:
+        portfolio_id: ID del portfolio
+
+    Returns:
+        Dict con el resultado del recálculo
+    """
+    from app.services.snapshot_queue import snapshot_recalc_queue as queue
+
+    remaining = queue.seconds_until_due(portfolio_id)
+    if remaining > 0:
+        self.apply_async((portfolio_id,), countdown=remaining)
+        return {"success": True, "status": "debounced", "retry_in": round(remaining, 2)}
+
+    token = queue.acquire_lock(portfolio_id)
+    if token is None:
+        # Otro worker está recalculando este portfolio: reintentar al terminar
+        self.apply_async((portfolio_id,), countdown=queue.debounce_seconds)
+        return {"success": True, "status": "locked"}
+
+    from_date = None
+    try:
+        from_date = queue.claim(portfolio_id)
+        if from_date is None:
+            return {"success": True, "status": "empty"}
+
+        logger.info(f"📸 Recalculando snapshots de {portfolio_id} desde {from_date}")
+        result = queue.recalculate_now(portfolio_id, from_date)
+        errors = result.get("errors", [])
+        if errors and not result.get("created"):
+            # create_daily_snapshots_for_portfolio no lanza si falla el commit
+            raise RuntimeError(f"no snapshots written: {errors[-1]['error']}")
+
+        queue.reset_attempts(portfolio_id)
+        logger.info(
+            f"✅ Snapshots de {portfolio_id}: {result.get('created', 0)} creados, "
+            f"{len(errors)} errores"
+        )
+        return {"success": True, "status": "done", "from_date": from_date.isoformat(), **result}
+
+    except Exception as e:
+        logger.error(f"❌ Error recalculando snapshots de {portfolio_id}: {str(e)}")
+        if from_date is None:
+            return {"success": False, "error": str(e)}
+        # Devolver la marca a la cola para no perder el recálculo
+        retry_in = None
+        try:
+            retry_in = queue.retry_later(portfolio_id, from_date)
+            if retry_in is None:
+                logger.error(
+                    f"❌ Recálculo de {portfolio_id} abandonado tras {queue.max_attempts} intentos; "
+                    f"queda pendiente desde {from_date}"
+                )
+        except Exception as retry_error:
+            logger.error(f"❌ No se pudo reprogramar el recálculo de {portfolio_id}: {retry_error}")
+        return {"success": False, "error": str(e), "retry_in": retry_in}
+    finally:
+        queue.release_lock(portfolio_id, token)
+
+
+@celery_app.task(name="app.services.celery_tasks.sweep_snapshot_recalculations")
+def sweep_snapshot_recalculations() -> Dict:
+    """
+    Reprogramar recálculos de snapshots pendientes cuyo job se perdió
+    Se ejecuta cada minuto
+    """
+    from app.services.snapshot_queue import snapshot_recalc_queue
+
+    rescheduled = snapshot_recalc_queue.sweep()
+    if rescheduled:
+        logger.info(f"🔁 Reprogramados {rescheduled} recálculos de snapshots")
+    return {"rescheduled": rescheduled, "timestamp": datetime.utcnow().isoformat()}
@@ -2,10 +2,16 @@
 Servicio para obtener precios de activos usando Finnhub API
 """
 import os
+import asyncio
+import importlib.util
+import time
+import uuid
 import httpx
 import logging
-from typing import Optional, Dict
+from typing import Awaitable, Callable, List, Optional, Dict, Tuple
 from ..core.config import settings
+from ..core.local_cache import LocalTTLCache
+from ..core.rate_limiter import RedisTokenBucket
 
 logger = logging.getLogger(__name__)
 
@@ -13,13 +19,48 @@ import json
 import redis.asyncio as redis
 from datetime import timedelta
 
+# HTTP/2 requiere el extra httpx[http2] (paquete h2)
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+
 class FinnhubService:
+    # Pool de conexiones compartido por todas las peticiones a Finnhub
+    MAX_CONNECTIONS = 20
+    KEEPALIVE_EXPIRY_SECONDS = 30.0
+    REQUEST_TIMEOUT_SECONDS = 2.0
+    # Espera máxima a la cache en modo stale-while-revalidate
+    CACHE_TIMEOUT_SECONDS = 0.5
+    # Clave de Redis de la cuota de Finnhub (compartida por API y Celery)
+    RATE_LIMIT_KEY = "finnhub:rate_limit"
+
     def __init__(self):
         self.api_key = settings.FINNHUB_API_KEY
         self.base_url = "https://finnhub.io/api/v1"
         self.redis_client: Optional[redis.Redis] = None
+        # Un precio es fresco durante cache_ttl; se conserva hasta stale_ttl
+        # para poder servirlo como obsoleto mientras se revalida
         self.cache_ttl = timedelta(minutes=5)
+        self.stale_ttl = timedelta(hours=24)
         self.cache_prefix = "price_cache:"
+        # Primer nivel en memoria; se invalida por pub/sub entre procesos
+        self.local_cache = LocalTTLCache(
+            max_size=settings.PRICE_LOCAL_CACHE_SIZE,
+            ttl_seconds=settings.PRICE_LOCAL_CACHE_TTL_SECONDS
+        )
+        self.invalidation_channel = f"{self.cache_prefix}invalidate"
+        self.instance_id = uuid.uuid4().hex
+        self.redis_hits = 0
+        self.redis_misses = 0
+        self._invalidation_task: Optional[asyncio.Task] = None
+        self._client: Optional[httpx.AsyncClient] = None
+        # Cuota de Finnhub compartida entre procesos a través de Redis
+        self.rate_limiter = RedisTokenBucket(
+            self._get_redis, self.RATE_LIMIT_KEY, settings.FINNHUB_RATE_LIMIT
+        )
+        # Revalidaciones en segundo plano (referencias para que no las recoja el GC)
+        self._background_tasks: set = set()
+        # Peticiones en curso por clave de cache (single-flight)
+        self._inflight: Dict[str, asyncio.Task] = {}
         
     async def connect_redis(self):
         """Lazy connection to Redis"""
@@ -29,94 +70,274 @@ class FinnhubService:
                 encoding="utf-8",
                 decode_responses=True
             )
+        if self._invalidation_task is None or self._invalidation_task.done():
+            self._invalidation_task = asyncio.create_task(self._listen_invalidations())
+
+    async def _get_redis(self) -> redis.Redis:
+        await self.connect_redis()
+        return self.redis_client
+
+    async def _listen_invalidations(self):
+        """
+        Escuchar invalidaciones de precios publicadas por otros procesos
+
+        Si la suscripción se pierde, se vacía la cache local (pudieron perderse
+        mensajes) y se reintenta.
+        """
+        while True:
+            try:
+                async with self.redis_client.pubsub() as pubsub:
+                    await pubsub.subscribe(self.invalidation_channel)
+                    async for message in pubsub.listen():
+                        if message["type"] != "message":
+                            continue
+                        payload = json.loads(message["data"])
+                        if payload.get("origin") != self.instance_id:
+                            self.local_cache.invalidate(payload["key"])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Price cache invalidation listener error: {e}")
+                self.local_cache.clear()
+                await asyncio.sleep(1)
+
+    async def publish_invalidation(self, key: str):
+        """Avisar al resto de procesos de que el precio de `key` ha cambiado"""
+        await self.connect_redis()
+        await self.redis_client.publish(
+            self.invalidation_channel,
+            json.dumps({"origin": self.instance_id, "key": key})
+        )
+
+    def get_cache_stats(self) -> Dict:
+        """Contadores de aciertos/fallos de ambos niveles de cache"""
+        redis_lookups = self.redis_hits + self.redis_misses
+        return {
+            "local": self.local_cache.stats(),
+            "redis": {
+                "hits": self.redis_hits,
+                "misses": self.redis_misses,
+                "hit_rate": round(self.redis_hits / redis_lookups, 4) if redis_lookups else 0.0
+            }
+        }
+
+    def get_client(self) -> httpx.AsyncClient:
+        """Cliente HTTP de larga duración (keep-alive y HTTP/2 si está disponible)"""
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                timeout=httpx.Timeout(self.REQUEST_TIMEOUT_SECONDS),
+                http2=HTTP2_AVAILABLE,
+                limits=httpx.Limits(
+                    max_connections=self.MAX_CONNECTIONS,
+                    max_keepalive_connections=self.MAX_CONNECTIONS,
+                    keepalive_expiry=self.KEEPALIVE_EXPIRY_SECONDS
+                )
+            )
+        return self._client
+
+    async def close(self, close_redis: bool = False):
+        """
+        Cerrar el cliente HTTP compartido y la escucha de invalidaciones
+
+        Args:
+            close_redis: Cerrar también la conexión a Redis (instancias de
+                vida corta, p. ej. en tareas de Celery)
+        """
+        if self._invalidation_task is not None:
+            self._invalidation_task.cancel()
+            self._invalidation_task = None
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+        if close_redis and self.redis_client is not None:
+            await self.redis_client.close()
+            self.redis_client = None
 
     async def _get_cache(self, symbol: str) -> Optional[Dict]:
+        cached = self.local_cache.get(symbol)
+        if cached is not None:
+            return cached
+
         await self.connect_redis()
         if self.redis_client:
             data = await self.redis_client.get(f"{self.cache_prefix}{symbol}")
             if data:
-                return json.loads(data)
+                self.redis_hits += 1
+                value = json.loads(data)
+                self.local_cache.set(symbol, value)
+                return value
+            self.redis_misses += 1
         return None
 
+    async def _get_many_cache(self, keys: List[str]) -> Dict[str, Dict]:
+        """Leer varias claves: primero en memoria y el resto con un único MGET"""
+        found: Dict[str, Dict] = {}
+        remote_keys = []
+        for key in keys:
+            cached = self.local_cache.get(key)
+            if cached is not None:
+                found[key] = cached
+            else:
+                remote_keys.append(key)
+
+        if remote_keys:
+            await self.connect_redis()
+            if self.redis_client:
+                values = await self.redis_client.mget(
+                    [f"{self.cache_prefix}{key}" for key in remote_keys]
+                )
+                for key, data in zip(remote_keys, values):
+                    if data:
+                        self.redis_hits += 1
+                        found[key] = json.loads(data)
+                        self.local_cache.set(key, found[key])
+                    else:
+                        self.redis_misses += 1
+        return found
+
     async def _set_cache(self, symbol: str, data: Dict):
+        self.local_cache.set(symbol, data)
         await self.connect_redis()
         if self.redis_client:
             await self.redis_client.setex(
                 f"{self.cache_prefix}{symbol}",
-                self.cache_ttl,
+                self.stale_ttl,
                 json.dumps(data)
             )
+            await self.publish_invalidation(symbol)
+
+    async def _single_flight(self, key: str, fetch: Callable[[], Awaitable[Optional[Dict]]]) -> Optional[Dict]:
+        """
+        Coalescer peticiones concurrentes con la misma clave
+
+        El primer llamante lanza `fetch`; los que llegan mientras está en curso
+        esperan ese mismo resultado en lugar de repetir la llamada a la API.
+        """
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fetch())
+            self._inflight[key] = task
+
+            def _release(done: asyncio.Task):
+                if self._inflight.get(key) is done:
+                    del self._inflight[key]
+
+            task.add_done_callback(_release)
+        # shield: si un llamante se cancela, los demás siguen esperando
+        return await asyncio.shield(task)
+
+    async def _fetch_quote(self, symbol: str, api_symbol: str, cache_key: str) -> Optional[Dict]:
+        """Pedir /quote a Finnhub (dentro de la cuota) y guardar el resultado en cache"""
+        # Sin token disponible a tiempo se responde None: el llamante usa su
+        # fallback en lugar de esperar a que se libere cuota
+        if not await self.rate_limiter.acquire(timeout=self.REQUEST_TIMEOUT_SECONDS):
+            logger.warning(f"Finnhub rate limit reached, skipping {api_symbol}")
+            return None
+        try:
+            response = await self.get_client().get(
+                "/quote",
+                params={"symbol": api_symbol, "token": self.api_key}
+            )
+            if response.status_code == 200:
+                data = response.json()
+                if data.get("c"):  # c = current price
+                    return await self.cache_quote(symbol, cache_key, data)
+            return None
+        except Exception as e:
+            logger.error(f"Error fetching quote for {api_symbol}: {e}")
+            return None
+
+    @staticmethod
+    def _price_data(symbol: str, data: Dict) -> Dict:
+        """Datos de precio a partir de una respuesta de /quote"""
+        return {
+            "symbol": symbol,
+            "current_price": data["c"],
+            "high": data["h"],
+            "low": data["l"],
+            "open": data["o"],
+            "previous_close": data["pc"],
+            "change": data["c"] - data["pc"],
+            "change_percent": ((data["c"] - data["pc"]) / data["pc"] * 100) if data["pc"] else 0,
+            "fetched_at": time.time()
+        }
+
+    async def cache_quote(self, symbol: str, cache_key: str, data: Dict) -> Dict:
+        """
+        Guardar en cache una respuesta de /quote y avisar al resto de procesos
+
+        Args:
+            symbol: Símbolo del activo
+            cache_key: Clave de cache (ver _lookup_for)
+            data: Respuesta de /quote de Finnhub con precio (c) no nulo
+
+        Returns:
+            Datos de precio guardados
+        """
+        result = self._price_data(symbol, data)
+        await self._set_cache(cache_key, result)
+        return result
+
+    @staticmethod
+    def _lookup_for(symbol: str, asset_type: str) -> Optional[Tuple[str, str]]:
+        """(clave de cache, símbolo en Finnhub) según el tipo de activo"""
+        if asset_type == "crypto":
+            # Finnhub usa formato BINANCE:BTCUSDT
+            return f"CRYPTO:{symbol}", f"BINANCE:{symbol}USDT"
+        if asset_type in ["stock", "etf"]:
+            return symbol, symbol
+        return None
+
+    def _is_stale(self, data: Dict) -> bool:
+        """Un precio es obsoleto si se obtuvo hace más de cache_ttl"""
+        fetched_at = data.get("fetched_at")
+        return fetched_at is None or time.time() - fetched_at > self.cache_ttl.total_seconds()
 
     async def get_stock_quote(self, symbol: str) -> Optional[Dict]:
         """Obtener cotización de una acción con caching"""
         # Intentar cache primero
         cached = await self._get_cache(symbol)
-        if cached:
+        if cached and not self._is_stale(cached):
             return cached
 
-        try:
-            async with httpx.AsyncClient(timeout=2.0) as client:
-                response = await client.get(
-                    f"{self.base_url}/quote",
-                    params={"symbol": symbol, "token": self.api_key}
-                )
-                if response.status_code == 200:
-                    data = response.json()
-                    if data.get("c"):  # c = current price
-                        result = {
-                            "symbol": symbol,
-                            "current_price": data["c"],
-                            "high": data["h"],
-                            "low": data["l"],
-                            "open": data["o"],
-                            "previous_close": data["pc"],
-                            "change": data["c"] - data["pc"],
-                            "change_percent": ((data["c"] - data["pc"]) / data["pc"] * 100) if data["pc"] else 0
-                        }
-                        # Guardar en cache
-                        await self._set_cache(symbol, result)
-                        return result
-                return None
-        except Exception as e:
-            logger.error(f"Error fetching stock quote for {symbol}: {e}")
-            return None
+        fetched = await self._single_flight(
+            symbol,
+            lambda: self._fetch_quote(symbol, symbol, symbol)
+        )
+        # Si Finnhub falla, mejor un precio obsoleto que ninguno
+        return fetched or cached
     
     async def get_crypto_price(self, symbol: str) -> Optional[Dict]:
         """Obtener precio de criptomoneda con caching"""
         # Cache key para crypto
         cache_key = f"CRYPTO:{symbol}"
         cached = await self._get_cache(cache_key)
-        if cached:
+        if cached and not self._is_stale(cached):
             return cached
 
         # Finnhub usa formato BINANCE:BTCUSDT
         crypto_symbol = f"BINANCE:{symbol}USDT"
-        try:
-            async with httpx.AsyncClient(timeout=2.0) as client:
-                response = await client.get(
-                    f"{self.base_url}/quote",
-                    params={"symbol": crypto_symbol, "token": self.api_key}
-                )
-                if response.status_code == 200:
-                    data = response.json()
-                    if data.get("c"):
-                        result = {
-                            "symbol": symbol,
-                            "current_price": data["c"],
-                            "high": data["h"],
-                            "low": data["l"],
-                            "open": data["o"],
-                            "previous_close": data["pc"],
-                            "change": data["c"] - data["pc"],
-                            "change_percent": ((data["c"] - data["pc"]) / data["pc"] * 100) if data["pc"] else 0
-                        }
-                        await self._set_cache(cache_key, result)
-                        return result
-                return None
-        except Exception as e:
-            logger.error(f"Error fetching crypto price for {symbol}: {e}")
-            return None
+        fetched = await self._single_flight(
+            cache_key,
+            lambda: self._fetch_quote(symbol, crypto_symbol, cache_key)
+        )
+        return fetched or cached
     
+    @staticmethod
+    def _cash_price(symbol: str) -> Dict:
+        # Para cash, el precio es siempre 1 (no cache needed really, but consistent interface)
+        return {
+            "symbol": symbol,
+            "current_price": 1.0,
+            "high": 1.0,
+            "low": 1.0,
+            "open": 1.0,
+            "previous_close": 1.0,
+            "change": 0.0,
+            "change_percent": 0.0
+        }
+
     async def get_asset_price(self, symbol: str, asset_type: str) -> Optional[Dict]:
         """Obtener precio de cualquier tipo de asset"""
         if asset_type == "crypto":
@@ -124,18 +345,97 @@ class FinnhubService:
         elif asset_type in ["stock", "etf"]:
             return await self.get_stock_quote(symbol)
         elif asset_type == "cash":
-            # Para cash, el precio es siempre 1 (no cache needed really, but consistent interface)
-            return {
-                "symbol": symbol,
-                "current_price": 1.0,
-                "high": 1.0,
-                "low": 1.0,
-                "open": 1.0,
-                "previous_close": 1.0,
-                "change": 0.0,
-                "change_percent": 0.0
-            }
+            return self._cash_price(symbol)
         return None
 
+    async def get_asset_prices(
+        self,
+        symbols: Dict[str, str],
+        stale_while_revalidate: bool = False
+    ) -> Dict[str, Optional[Dict]]:
+        """
+        Obtener precios de varios assets a la vez
+
+        Resuelve todos los símbolos cacheados con un único MGET y solo pide a
+        Finnhub los que faltan o están obsoletos, en paralelo y dentro de la
+        cuota.
+
+        Con stale_while_revalidate=True nunca espera a Finnhub: responde con lo
+        que haya en cache (aunque esté obsoleto) y programa en segundo plano la
+        actualización de los precios obsoletos o ausentes.
+
+        Args:
+            symbols: {símbolo: asset_type}
+            stale_while_revalidate: No bloquear en llamadas a Finnhub
+
+        Returns:
+            {símbolo: datos de precio con "stale" (bool), o None si no hay precio}
+        """
+        results: Dict[str, Optional[Dict]] = {}
+        lookups: Dict[str, Tuple[str, str]] = {}  # clave de cache -> (símbolo, símbolo Finnhub)
+
+        for symbol, asset_type in symbols.items():
+            if asset_type == "cash":
+                results[symbol] = {**self._cash_price(symbol), "stale": False}
+                continue
+            lookup = self._lookup_for(symbol, asset_type)
+            if lookup is None:
+                results[symbol] = None
+                continue
+            cache_key, api_symbol = lookup
+            lookups[cache_key] = (symbol, api_symbol)
+
+        if stale_while_revalidate:
+            # Ni siquiera una cache lenta o caída debe retrasar la respuesta
+            try:
+                cached = await asyncio.wait_for(
+                    self._get_many_cache(list(lookups)), self.CACHE_TIMEOUT_SECONDS
+                )
+            except Exception as e:
+                logger.warning(f"Price cache unavailable, serving without it: {e}")
+                cached = {}
+        else:
+            cached = await self._get_many_cache(list(lookups))
+
+        to_fetch: List[Tuple[str, str, str]] = []
+        for cache_key, (symbol, api_symbol) in lookups.items():
+            price_data = cached.get(cache_key)
+            stale = price_data is None or self._is_stale(price_data)
+            results[symbol] = {**price_data, "stale": stale} if price_data else None
+            if stale:
+                to_fetch.append((cache_key, symbol, api_symbol))
+
+        if not to_fetch:
+            return results
+
+        if stale_while_revalidate:
+            self._revalidate_in_background(to_fetch)
+            return results
+
+        fetched = await self._fetch_many(to_fetch)
+        for (_, symbol, _), price_data in zip(to_fetch, fetched):
+            # Si Finnhub falla se mantiene el valor obsoleto (si lo hay)
+            if price_data:
+                results[symbol] = {**price_data, "stale": False}
+
+        return results
+
+    async def _fetch_many(self, lookups: List[Tuple[str, str, str]]) -> List[Optional[Dict]]:
+        """Pedir a Finnhub varios (clave de cache, símbolo, símbolo Finnhub) en paralelo"""
+        return await asyncio.gather(*[
+            self._single_flight(
+                cache_key,
+                lambda symbol=symbol, api_symbol=api_symbol, cache_key=cache_key:
+                    self._fetch_quote(symbol, api_symbol, cache_key)
+            )
+            for cache_key, symbol, api_symbol in lookups
+        ])
+
+    def _revalidate_in_background(self, lookups: List[Tuple[str, str, str]]):
+        """Programar la actualización de precios sin esperar el resultado"""
+        task = asyncio.create_task(self._fetch_many(lookups))
+        self._background_tasks.add(task)
+        task.add_done_callback(self._background_tasks.discard)
+
 # Instancia global del servicio
 finnhub_service = FinnhubService()
@@ -1,98 +1,286 @@
-from typing import List, Dict, Deque, Optional
-from datetime import date, datetime
+import logging
+from typing import List, Dict, Optional, Tuple
+from datetime import date, datetime, timezone
+from decimal import Decimal
 from sqlalchemy.orm import Session
-from sqlalchemy import select, and_
+from sqlalchemy import select, and_, delete, insert, func, literal_column
 from uuid import UUID
 from collections import deque
 
+from app.models.asset import Asset
+from app.models.fiscal import FiscalYearClose
 from app.models.transaction import Transaction, TransactionType
 from app.schemas.fiscal import FiscalResultItem, FiscalResultResponse
 
+logger = logging.getLogger(__name__)
+
+FIFO_TYPES = (TransactionType.BUY, TransactionType.SELL)
+
+
+def _as_utc(value: Optional[datetime]) -> Optional[datetime]:
+    """Normalizar fechas naive (se asumen UTC) para poder compararlas"""
+    if value is not None and value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value
+
+
+def _year_start(year: int) -> datetime:
+    return datetime(year, 1, 1, tzinfo=timezone.utc)
+
+
 class FiscalService:
+    """
+    Resultado fiscal FIFO con lotes en Decimal y cierres anuales persistidos
+
+    Los años ya terminados se guardan en FiscalYearClose (ventas casadas y
+    lotes abiertos a 31 de diciembre). Una consulta reanuda el cálculo desde
+    el último cierre válido y solo reprocesa las transacciones posteriores.
+    """
+
     def __init__(self, db: Session):
         self.db = db
 
+    def _year_fingerprints(self, portfolio_id: UUID) -> Dict[int, Tuple[int, Optional[datetime]]]:
+        """
+        Huella por año de las compras/ventas: (número, última modificación)
+
+        Un alta, baja o edición retroactiva cambia la huella del año afectado
+        y con ella la validez de su cierre y de los siguientes.
+        """
+        # Zona literal (no parámetro) para que SELECT y GROUP BY sean la misma expresión
+        year = func.extract("year", func.timezone(literal_column("'UTC'"), Transaction.transaction_date))
+        rows = self.db.execute(
+            select(
+                year,
+                func.count(Transaction.id),
+                func.max(func.coalesce(Transaction.updated_at, Transaction.created_at))
+            )
+            .where(
+                and_(
+                    Transaction.portfolio_id == portfolio_id,
+                    Transaction.transaction_type.in_(FIFO_TYPES)
+                )
+            )
+            .group_by(year)
+        ).all()
+        return {int(row[0]): (row[1], _as_utc(row[2])) for row in rows}
+
+    def _load_transactions(self, portfolio_id: UUID, from_year: int, to_year: int):
+        """Compras y ventas de [from_year, to_year] con su símbolo, en una consulta"""
+        return self.db.execute(
+            select(
+                Transaction.asset_id,
+                Transaction.transaction_type,
+                Transaction.quantity,
+                Transaction.price,
+                Transaction.transaction_date,
+                Asset.symbol
+            )
+            .join(Asset, Transaction.asset_id == Asset.id)
+            .where(
+                and_(
+                    Transaction.portfolio_id == portfolio_id,
+                    Transaction.transaction_type.in_(FIFO_TYPES),
+                    Transaction.transaction_date >= _year_start(from_year),
+                    Transaction.transaction_date < _year_start(to_year + 1)
+                )
+            )
+            .order_by(Transaction.transaction_date, Transaction.id)
+        ).all()
+
+    @staticmethod
+    def _apply(lots: Dict[str, Dict], tx, items: List[Dict]):
+        """
+        Aplicar una transacción a los lotes abiertos (FIFO)
+
+        Args:
+            lots: {asset_id: {"symbol", "lots": deque([fecha, cantidad, precio])}}
+            tx: Fila de _load_transactions
+            items: Lista donde se añaden las ventas casadas
+        """
+        entry = lots.setdefault(str(tx.asset_id), {"symbol": tx.symbol, "lots": deque()})
+        queue = entry["lots"]
+        tx_date = _as_utc(tx.transaction_date).date()
+        quantity = Decimal(str(tx.quantity))
+        price = Decimal(str(tx.price))
+
+        if tx.transaction_type == TransactionType.BUY:
+            queue.append([tx_date, quantity, price])
+            return
+
+        # Venta: casar contra las compras más antiguas
+        while quantity > 0 and queue:
+            oldest_buy = queue[0]
+            match_qty = min(quantity, oldest_buy[1])
+
+            items.append({
+                "symbol": entry["symbol"],
+                "date_sell": tx_date,
+                "date_buy": oldest_buy[0],
+                "quantity": match_qty,
+                "price_sell": price,
+                "price_buy": oldest_buy[2],
+                # Resultado = (Precio Venta - Precio Compra) * Cantidad
+                "result": (price - oldest_buy[2]) * match_qty,
+            })
+
+            quantity -= match_qty
+            oldest_buy[1] -= match_qty
+            if oldest_buy[1] == 0:
+                queue.popleft()
+
+        # La parte no cubierta por compras (venta en corto o datos
+        # incompletos) no genera resultado fiscal
+
+    @staticmethod
+    def _dump_lots(lots: Dict[str, Dict]) -> Dict:
+        return {
+            asset_id: {
+                "symbol": entry["symbol"],
+                "lots": [[lot_date.isoformat(), str(qty), str(price)] for lot_date, qty, price in entry["lots"]]
+            }
+            for asset_id, entry in lots.items()
+            if entry["lots"]
+        }
+
+    @staticmethod
+    def _load_lots(data: Dict) -> Dict[str, Dict]:
+        return {
+            asset_id: {
+                "symbol": entry["symbol"],
+                "lots": deque(
+                    [date.fromisoformat(lot_date), Decimal(qty), Decimal(price)]
+                    for lot_date, qty, price in entry["lots"]
+                )
+            }
+            for asset_id, entry in data.items()
+        }
+
+    @staticmethod
+    def _dump_items(items: List[Dict]) -> List[Dict]:
+        return [
+            {
+                key: value.isoformat() if isinstance(value, date) else str(value) if isinstance(value, Decimal) else value
+                for key, value in item.items()
+            }
+            for item in items
+        ]
+
+    @staticmethod
+    def _load_items(data: List[Dict]) -> List[Dict]:
+        return [
+            {
+                "symbol": item["symbol"],
+                "date_sell": date.fromisoformat(item["date_sell"]),
+                "date_buy": date.fromisoformat(item["date_buy"]),
+                "quantity": Decimal(item["quantity"]),
+                "price_sell": Decimal(item["price_sell"]),
+                "price_buy": Decimal(item["price_buy"]),
+                "result": Decimal(item["result"]),
+            }
+            for item in data
+        ]
+
+    def _save_closes(self, portfolio_id: UUID, from_year: int, rows: List[Dict]):
+        """Reemplazar los cierres desde from_year (caché: un fallo no es fatal)"""
+        try:
+            self.db.execute(
+                delete(FiscalYearClose).where(
+                    and_(
+                        FiscalYearClose.portfolio_id == portfolio_id,
+                        FiscalYearClose.fiscal_year >= from_year
+                    )
+                )
+            )
+            if rows:
+                self.db.execute(insert(FiscalYearClose), rows)
+            self.db.commit()
+        except Exception as e:
+            self.db.rollback()
+            logger.warning(f"No se pudieron guardar los cierres fiscales de {portfolio_id}: {e}")
+
     def calculate_fiscal_result(
-        self, 
-        portfolio_id: UUID, 
-        start_date: Optional[date] = None, 
+        self,
+        portfolio_id: UUID,
+        start_date: Optional[date] = None,
         end_date: Optional[date] = None
     ) -> FiscalResultResponse:
         """
         Calcula el resultado fiscal usando el método FIFO.
+
+        Reanuda desde el último año cerrado cuya huella sigue coincidiendo y
+        solo reprocesa las transacciones posteriores; los años terminados que
+        se recalculan quedan guardados para las siguientes consultas.
         """
-        # 1. Obtener todas las transacciones ordenadas por fecha
-        transactions = self.db.scalars(
-            select(Transaction)
-            .where(Transaction.portfolio_id == portfolio_id)
-            .order_by(Transaction.transaction_date)
-        ).all()
+        fingerprints = self._year_fingerprints(portfolio_id)
+        if not fingerprints:
+            return FiscalResultResponse(items=[], total_result=0.0)
+
+        current_year = datetime.now(timezone.utc).year
+        first_year = min(fingerprints)
+        last_year = max(max(fingerprints), current_year)
+        if end_date:
+            last_year = min(last_year, max(end_date.year, first_year))
+
+        closes = {
+            row.fiscal_year: row
+            for row in self.db.scalars(
+                select(FiscalYearClose).where(FiscalYearClose.portfolio_id == portfolio_id)
+            )
+        }
+
+        # Prefijo de años cerrados cuyo cierre sigue siendo válido
+        items_by_year: Dict[int, List[Dict]] = {}
+        lots: Dict[str, Dict] = {}
+        resume_year = first_year
+        for year in range(first_year, min(current_year, last_year + 1)):
+            close = closes.get(year)
+            if close is None or (close.transaction_count, _as_utc(close.last_change_at)) != fingerprints.get(year, (0, None)):
+                break
+            if start_date is None or year >= start_date.year:
+                items_by_year[year] = self._load_items(close.items)
+            resume_year = year + 1
+        if resume_year > first_year:
+            lots = self._load_lots(closes[resume_year - 1].open_lots)
+
+        # Reprocesar solo desde el primer año sin cierre válido
+        if resume_year <= last_year:
+            transactions = self._load_transactions(portfolio_id, resume_year, last_year)
+            new_closes: List[Dict] = []
+            tx_index = 0
+            for year in range(resume_year, last_year + 1):
+                year_end = _year_start(year + 1)
+                year_items: List[Dict] = []
+                while tx_index < len(transactions) and _as_utc(transactions[tx_index].transaction_date) < year_end:
+                    self._apply(lots, transactions[tx_index], year_items)
+                    tx_index += 1
+                items_by_year[year] = year_items
+
+                if year < current_year:
+                    count, last_change_at = fingerprints.get(year, (0, None))
+                    new_closes.append({
+                        "portfolio_id": portfolio_id,
+                        "fiscal_year": year,
+                        "total_result": sum((item["result"] for item in year_items), Decimal("0")),
+                        "items": self._dump_items(year_items),
+                        "open_lots": self._dump_lots(lots),
+                        "transaction_count": count,
+                        "last_change_at": last_change_at,
+                    })
+
+            if new_closes or any(year >= resume_year for year in closes):
+                self._save_closes(portfolio_id, resume_year, new_closes)
 
-        # Cola de compras por símbolo: {symbol: deque([ {'date': ..., 'qty': ..., 'price': ...} ])}
-        buy_queues: Dict[str, Deque[dict]] = {}
+        # Filtrar por rango de fechas
         results: List[FiscalResultItem] = []
-        total_result = 0.0
-
-        for tx in transactions:
-            symbol = tx.asset.symbol if tx.asset else "UNKNOWN"
-            
-            if symbol not in buy_queues:
-                buy_queues[symbol] = deque()
-
-            if tx.transaction_type == TransactionType.BUY:
-                # Añadir a la cola de compras
-                buy_queues[symbol].append({
-                    'date': tx.transaction_date,
-                    'quantity': tx.quantity,
-                    'price': tx.price
-                })
-            
-            elif tx.transaction_type == TransactionType.SELL:
-                qty_to_sell = tx.quantity
-                
-                # Procesar venta contra la cola de compras (FIFO)
-                while qty_to_sell > 0 and buy_queues[symbol]:
-                    oldest_buy = buy_queues[symbol][0]
-                    
-                    match_qty = min(qty_to_sell, oldest_buy['quantity'])
-                    
-                    # Calcular resultado para esta porción
-                    # Resultado = (Precio Venta - Precio Compra) * Cantidad
-                    pnl = (tx.price - oldest_buy['price']) * match_qty
-                    
-                    # Crear registro de resultado
-                    # Solo añadimos si está dentro del rango de fechas solicitado (si se especificó)
-                    tx_date = tx.transaction_date.date() if isinstance(tx.transaction_date, datetime) else tx.transaction_date
-                    
-                    in_range = True
-                    if start_date and tx_date < start_date:
-                        in_range = False
-                    if end_date and tx_date > end_date:
-                        in_range = False
-                        
-                    if in_range:
-                        results.append(FiscalResultItem(
-                            symbol=symbol,
-                            date_sell=tx_date,
-                            date_buy=oldest_buy['date'].date() if isinstance(oldest_buy['date'], datetime) else oldest_buy['date'],
-                            quantity=match_qty,
-                            price_sell=tx.price,
-                            price_buy=oldest_buy['price'],
-                            result=pnl
-                        ))
-                        total_result += pnl
-
-                    # Actualizar cantidades
-                    qty_to_sell -= match_qty
-                    oldest_buy['quantity'] -= match_qty
-                    
-                    # Si la compra se agotó, quitarla de la cola
-                    if oldest_buy['quantity'] <= 0.000001: # Usar epsilon para float
-                        buy_queues[symbol].popleft()
-                
-                # Si todavía queda cantidad por vender pero no hay compras (Short selling o error de datos)
-                # Por ahora lo ignoramos o podríamos registrar un error. 
-                # El requerimiento dice "Validar que no se vendan más acciones de las disponibles"
-                # Aquí simplemente no generamos resultado fiscal para la parte no cubierta.
+        total_result = Decimal("0")
+        for year in sorted(items_by_year):
+            for item in items_by_year[year]:
+                if start_date and item["date_sell"] < start_date:
+                    continue
+                if end_date and item["date_sell"] > end_date:
+                    continue
+                results.append(FiscalResultItem(**item))
+                total_result += item["result"]
 
         return FiscalResultResponse(items=results, total_result=total_result)
@@ -1,17 +1,21 @@
 """
 Servicio para importación y exportación de datos (CSV/XLSX)
 """
+import csv
 import io
-from typing import List, Dict, Optional, Tuple
-from datetime import datetime, date as DateType
+import tempfile
+import uuid
+from typing import IO, Iterable, Iterator, List, Dict, Optional, Tuple, Union
+from datetime import datetime, timedelta, date as DateType
 import pandas as pd
+from openpyxl import Workbook, load_workbook
 from sqlalchemy.orm import Session
-from sqlalchemy import and_
+from sqlalchemy import and_, or_, func, select, insert
 from uuid import UUID
 
-from app.models.transaction import Transaction
+from app.models.transaction import Transaction, TransactionType
 from app.models.quote import Quote
-from app.models.portfolio import Portfolio
+from app.models.portfolio import Portfolio, AssetType
 from app.models.asset import Asset
 
 
@@ -22,211 +26,256 @@ class ImportExportService:
         self.db = db
     
     # ==================== EXPORTACIÓN ====================
-    
-    def export_transactions_csv(self, portfolio_id: UUID) -> str:
+
+    # Filas por lote al leer con cursor de servidor (memoria constante)
+    EXPORT_BATCH_SIZE = 2000
+
+    # Tamaño de cada bloque emitido al cliente al servir un XLSX
+    EXPORT_STREAM_CHUNK_BYTES = 64 * 1024
+
+    TRANSACTION_EXPORT_COLUMNS = ['date', 'type', 'asset_symbol', 'quantity', 'price', 'fees', 'notes']
+    QUOTE_EXPORT_COLUMNS = ['symbol', 'date', 'open', 'high', 'low', 'close', 'volume', 'source']
+
+    def _iter_transaction_rows(self, portfolio_id: UUID) -> Iterator[tuple]:
+        """
+        Recorrer las transacciones de un portfolio en lotes de EXPORT_BATCH_SIZE
+
+        Usa yield_per (cursor de servidor en PostgreSQL), por lo que nunca se
+        materializa el resultado completo en memoria.
+        """
+        stmt = (
+            select(
+                Transaction.transaction_date,
+                Transaction.transaction_type,
+                Asset.symbol,
+                Transaction.quantity,
+                Transaction.price,
+                Transaction.fees,
+                Transaction.notes
+            )
+            .join(Asset, Transaction.asset_id == Asset.id)
+            .where(Transaction.portfolio_id == portfolio_id)
+            .order_by(Transaction.transaction_date.desc())
+            .execution_options(yield_per=self.EXPORT_BATCH_SIZE)
+        )
+
+        for row in self.db.execute(stmt):
+            yield (
+                row.transaction_date.strftime('%Y-%m-%d'),
+                row.transaction_type.value,
+                row.symbol,
+                row.quantity,
+                row.price,
+                row.fees or 0,
+                row.notes or ''
+            )
+
+    def _iter_quote_rows(
+        self,
+        symbol: Optional[str] = None,
+        start_date: Optional[DateType] = None,
+        end_date: Optional[DateType] = None
+    ) -> Iterator[tuple]:
+        """
+        Recorrer las cotizaciones filtradas en lotes de EXPORT_BATCH_SIZE
+        """
+        stmt = (
+            select(
+                Asset.symbol,
+                Quote.timestamp,
+                Quote.open,
+                Quote.high,
+                Quote.low,
+                Quote.close,
+                Quote.volume,
+                Quote.source
+            )
+            .join(Asset, Quote.asset_id == Asset.id)
+        )
+
+        if symbol:
+            stmt = stmt.where(Asset.symbol == symbol.upper())
+        # Comparar el timestamp directamente para aprovechar idx_quote_timestamp
+        if start_date:
+            stmt = stmt.where(Quote.timestamp >= start_date)
+        if end_date:
+            stmt = stmt.where(Quote.timestamp < end_date + timedelta(days=1))
+
+        stmt = (
+            stmt.order_by(Quote.timestamp.desc())
+            .execution_options(yield_per=self.EXPORT_BATCH_SIZE)
+        )
+
+        for row in self.db.execute(stmt):
+            yield (
+                row.symbol,
+                row.timestamp.strftime('%Y-%m-%d'),
+                row.open,
+                row.high,
+                row.low,
+                row.close,
+                row.volume or 0,
+                row.source or 'manual'
+            )
+
+    def _stream_csv(self, header: List[str], rows: Iterable[tuple]) -> Iterator[bytes]:
+        """
+        Serializar filas a CSV emitiendo un bloque por cada lote de filas
+        """
+        buffer = io.StringIO()
+        writer = csv.writer(buffer, lineterminator='\n')
+        writer.writerow(header)
+
+        for count, row in enumerate(rows, start=1):
+            writer.writerow(row)
+            if count % self.EXPORT_BATCH_SIZE == 0:
+                yield buffer.getvalue().encode('utf-8')
+                buffer.seek(0)
+                buffer.truncate(0)
+
+        yield buffer.getvalue().encode('utf-8')
+
+    def _stream_xlsx(self, sheet_name: str, header: List[str], rows: Iterable[tuple]) -> Iterator[bytes]:
+        """
+        Generar un XLSX con memoria constante y emitirlo por bloques
+
+        El libro se escribe en modo write_only (openpyxl vuelca cada fila a
+        disco) y el zip resultante se sirve desde un fichero temporal, ya que
+        el formato necesita el directorio central al final del archivo.
+        """
+        workbook = Workbook(write_only=True)
+        sheet = workbook.create_sheet(title=sheet_name)
+        sheet.append(header)
+        for row in rows:
+            sheet.append(row)
+
+        with tempfile.TemporaryFile() as output:
+            workbook.save(output)
+            output.seek(0)
+            while True:
+                chunk = output.read(self.EXPORT_STREAM_CHUNK_BYTES)
+                if not chunk:
+                    break
+                yield chunk
+
+    def export_transactions_csv(self, portfolio_id: UUID) -> Iterator[bytes]:
         """
         Exportar transacciones de un portfolio a CSV
-        
+
         Args:
             portfolio_id: ID del portfolio
-            
+
         Returns:
-            String con contenido CSV
+            Iterador de bloques CSV (utf-8) listo para StreamingResponse
         """
-        transactions = (
-            self.db.query(Transaction)
-            .join(Asset, Transaction.asset_id == Asset.id)
-            .filter(Transaction.portfolio_id == portfolio_id)
-            .order_by(Transaction.transaction_date.desc())
-            .all()
+        return self._stream_csv(
+            self.TRANSACTION_EXPORT_COLUMNS,
+            self._iter_transaction_rows(portfolio_id)
         )
-        
-        # Convertir a diccionarios
-        data = []
-        for tx in transactions:
-            data.append({
-                'date': tx.transaction_date.strftime('%Y-%m-%d'),
-                'type': tx.transaction_type,
-                'asset_symbol': tx.asset.symbol,
-                'quantity': tx.quantity,
-                'price': tx.price,
-                'fees': tx.fees or 0,
-                'notes': tx.notes or ''
-            })
-        
-        # Crear DataFrame y exportar
-        df = pd.DataFrame(data)
-        return df.to_csv(index=False)
-    
-    def export_transactions_xlsx(self, portfolio_id: UUID) -> bytes:
+
+    def export_transactions_xlsx(self, portfolio_id: UUID) -> Iterator[bytes]:
         """
         Exportar transacciones de un portfolio a XLSX
-        
+
         Args:
             portfolio_id: ID del portfolio
-            
+
         Returns:
-            Bytes con archivo XLSX
+            Iterador de bloques del archivo XLSX
         """
-        transactions = (
-            self.db.query(Transaction)
-            .join(Asset, Transaction.asset_id == Asset.id)
-            .filter(Transaction.portfolio_id == portfolio_id)
-            .order_by(Transaction.transaction_date.desc())
-            .all()
+        return self._stream_xlsx(
+            'Transactions',
+            self.TRANSACTION_EXPORT_COLUMNS,
+            self._iter_transaction_rows(portfolio_id)
         )
-        
-        data = []
-        for tx in transactions:
-            data.append({
-                'date': tx.transaction_date.strftime('%Y-%m-%d'),
-                'type': tx.transaction_type,
-                'asset_symbol': tx.asset.symbol,
-                'quantity': tx.quantity,
-                'price': tx.price,
-                'fees': tx.fees or 0,
-                'notes': tx.notes or ''
-            })
-        
-        df = pd.DataFrame(data)
-        
-        # Exportar a bytes
-        output = io.BytesIO()
-        with pd.ExcelWriter(output, engine='openpyxl') as writer:
-            df.to_excel(writer, sheet_name='Transactions', index=False)
-        
-        return output.getvalue()
-    
+
     def export_quotes_csv(
-        self, 
+        self,
         symbol: Optional[str] = None,
         start_date: Optional[DateType] = None,
         end_date: Optional[DateType] = None
-    ) -> str:
+    ) -> Iterator[bytes]:
         """
         Exportar cotizaciones a CSV
-        
+
         Args:
             symbol: Filtrar por símbolo (opcional)
             start_date: Fecha inicio (opcional)
             end_date: Fecha fin (opcional)
-            
+
         Returns:
-            String con contenido CSV
+            Iterador de bloques CSV (utf-8) listo para StreamingResponse
         """
-        query = self.db.query(Quote)
-        
-        if symbol:
-            query = query.filter(Quote.symbol == symbol.upper())
-        if start_date:
-            query = query.filter(Quote.date >= start_date)
-        if end_date:
-            query = query.filter(Quote.date <= end_date)
-        
-        quotes = query.order_by(Quote.date.desc()).all()
-        
-        data = []
-        for quote in quotes:
-            data.append({
-                'symbol': quote.symbol,
-                'date': quote.date.strftime('%Y-%m-%d'),
-                'open': quote.open,
-                'high': quote.high,
-                'low': quote.low,
-                'close': quote.close,
-                'volume': quote.volume or 0,
-                'source': quote.source or 'manual'
-            })
-        
-        df = pd.DataFrame(data)
-        return df.to_csv(index=False)
-    
+        return self._stream_csv(
+            self.QUOTE_EXPORT_COLUMNS,
+            self._iter_quote_rows(symbol, start_date, end_date)
+        )
+
     def export_quotes_xlsx(
-        self, 
+        self,
         symbol: Optional[str] = None,
         start_date: Optional[DateType] = None,
         end_date: Optional[DateType] = None
-    ) -> bytes:
+    ) -> Iterator[bytes]:
         """
         Exportar cotizaciones a XLSX
-        
+
         Args:
             symbol: Filtrar por símbolo (opcional)
             start_date: Fecha inicio (opcional)
             end_date: Fecha fin (opcional)
-            
+
         Returns:
-            Bytes con archivo XLSX
+            Iterador de bloques del archivo XLSX
         """
-        query = self.db.query(Quote)
-        
-        if symbol:
-            query = query.filter(Quote.symbol == symbol.upper())
-        if start_date:
-            query = query.filter(Quote.date >= start_date)
-        if end_date:
-            query = query.filter(Quote.date <= end_date)
-        
-        quotes = query.order_by(Quote.date.desc()).all()
-        
-        data = []
-        for quote in quotes:
-            data.append({
-                'symbol': quote.symbol,
-                'date': quote.date.strftime('%Y-%m-%d'),
-                'open': quote.open,
-                'high': quote.high,
-                'low': quote.low,
-                'close': quote.close,
-                'volume': quote.volume or 0,
-                'source': quote.source or 'manual'
-            })
-        
-        df = pd.DataFrame(data)
-        
-        output = io.BytesIO()
-        with pd.ExcelWriter(output, engine='openpyxl') as writer:
-            df.to_excel(writer, sheet_name='Quotes', index=False)
-        
-        return output.getvalue()
-    
-    # ==================== IMPORTACIÓN ====================
-    
+        return self._stream_xlsx(
+            'Quotes',
+            self.QUOTE_EXPORT_COLUMNS,
+            self._iter_quote_rows(symbol, start_date, end_date)
+        )
+
     # ==================== IMPORTACIÓN ====================
     
-    def _process_transactions_df(
-        self,
-        df: pd.DataFrame,
-        portfolio_id: UUID,
-        skip_duplicates: bool
-    ) -> Dict[str, any]:
-        """Helper para procesar DataFrame de transacciones"""
-        # Normalizar columnas (strip whitespace y lower case para comparación flexible)
-        df.columns = df.columns.str.strip()
-        
-        # Definir mapeo de columnas (Aliases)
-        column_mapping = {
-            'date': ['date', 'data', 'fecha'],
-            'type': ['type', 'c/v', 'tipo'],
-            'asset_symbol': ['asset_symbol', 'activo', 'symbol', 'simbolo'],
-            'quantity': ['quantity', 'cantidad', 'cuantida', 'cuantidad', 'unidades'],
-            'price': ['price', 'precio'],
-            'fees': ['fees', 'fee', 'comision'],
-            'notes': ['notes', 'nota', 'notas', 'comentarios']
-        }
-        
-        # Normalizar nombres de columnas en el DataFrame
+    # Filas por bloque al importar transacciones (memoria acotada)
+    IMPORT_CHUNK_SIZE = 5000
+
+    # Mapeo de columnas (Aliases) -> nombre canónico
+    TRANSACTION_COLUMN_ALIASES = {
+        'date': ['date', 'data', 'fecha'],
+        'type': ['type', 'c/v', 'tipo'],
+        'asset_symbol': ['asset_symbol', 'activo', 'symbol', 'simbolo'],
+        'quantity': ['quantity', 'cantidad', 'cuantida', 'cuantidad', 'unidades'],
+        'price': ['price', 'precio'],
+        'fees': ['fees', 'fee', 'comision'],
+        'notes': ['notes', 'nota', 'notas', 'comentarios']
+    }
+
+    # Tipos aceptados (C/V o BUY/SELL)
+    TRANSACTION_TYPE_MAP = {
+        'C': TransactionType.BUY, 'V': TransactionType.SELL,
+        'BUY': TransactionType.BUY, 'SELL': TransactionType.SELL,
+        'COMPRA': TransactionType.BUY, 'VENTA': TransactionType.SELL
+    }
+
+    def _normalize_transaction_columns(self, columns: Iterable) -> List[str]:
+        """
+        Renombrar columnas a sus nombres canónicos y validar las requeridas
+
+        Returns:
+            Lista de nombres de columna normalizados
+        """
         # Crear un mapa inverso: alias -> nombre_canonico
         alias_to_canonical = {}
-        for canonical, aliases in column_mapping.items():
+        for canonical, aliases in self.TRANSACTION_COLUMN_ALIASES.items():
             for alias in aliases:
                 alias_to_canonical[alias.lower()] = canonical
-        
-        # Renombrar columnas del DF si coinciden con algún alias
+
+        # Renombrar columnas (strip whitespace y lower case para comparación flexible)
         new_columns = []
         found_canonical = set()
-        
-        for col in df.columns:
+
+        for col in columns:
+            col = str(col).strip()
             col_lower = col.lower()
             if col_lower in alias_to_canonical:
                 canonical = alias_to_canonical[col_lower]
@@ -234,281 +283,365 @@ class ImportExportService:
                 found_canonical.add(canonical)
             else:
                 new_columns.append(col)
-        
-        df.columns = new_columns
 
         # Validar columnas requeridas (Canonical names)
         required_columns = ['date', 'type', 'asset_symbol', 'quantity', 'price']
         missing_columns = [col for col in required_columns if col not in found_canonical]
-        
+
         if missing_columns:
-            found_columns = list(df.columns)
-            raise ValueError(f"Columnas requeridas faltantes (o no reconocidas): {', '.join(missing_columns)}. Columnas encontradas: {', '.join(found_columns)}")
-        
+            raise ValueError(f"Columnas requeridas faltantes (o no reconocidas): {', '.join(missing_columns)}. Columnas encontradas: {', '.join(new_columns)}")
+
+        return new_columns
+
+    @staticmethod
+    def _parse_spanish_float_series(series: pd.Series) -> pd.Series:
+        """
+        Parsear números en formato español (1.234,56) de forma vectorizada
+
+        Los valores numéricos se respetan tal cual, los vacíos valen 0.0 y
+        los textos no convertibles quedan como NaN.
+        """
+        if pd.api.types.is_numeric_dtype(series):
+            return series.astype(float).fillna(0.0)
+
+        is_text = series.map(lambda v: isinstance(v, str))
+        result = pd.to_numeric(series.astype(object).where(~is_text), errors='coerce').fillna(0.0)
+
+        if is_text.any():
+            # Reemplazar punto de miles por nada y coma decimal por punto
+            cleaned = (
+                series[is_text].str.strip()
+                .str.replace('.', '', regex=False)
+                .str.replace(',', '.', regex=False)
+            )
+            result[is_text] = pd.to_numeric(cleaned, errors='coerce')
+
+        return result
+
+    @staticmethod
+    def _parse_date_series(series: pd.Series) -> pd.Series:
+        """
+        Parsear fechas (DD/MM/YYYY, YYYY-MM-DD u otros formatos reconocibles)
+
+        Returns:
+            Serie de Timestamps normalizados a medianoche (NaT si no es válida)
+        """
+        is_text = series.map(lambda v: isinstance(v, str))
+        text = series.astype(object).where(is_text).str.strip()
+
+        parsed = pd.to_datetime(text, format='%d/%m/%Y', errors='coerce')
+        parsed = parsed.fillna(pd.to_datetime(text, format='%Y-%m-%d', errors='coerce'))
+
+        pending = is_text & parsed.isna() & text.notna()
+        if pending.any():
+            parsed[pending] = pd.to_datetime(text[pending], format='mixed', errors='coerce')
+
+        # Si pandas ya lo parseó (ej: desde Excel)
+        if (~is_text).any():
+            parsed[~is_text] = pd.to_datetime(series[~is_text], errors='coerce')
+
+        return parsed.dt.normalize()
+
+    @staticmethod
+    def _extract_asset_symbol(raw_value) -> str:
+        """Limpiar el valor de la columna de activo y extraer el ticker si es posible"""
+        raw = str(raw_value)
+
+        # Limpiar saltos de línea y espacios múltiples
+        asset_symbol_or_name = ' '.join(raw.strip().split())
+
+        # Si contiene saltos de línea originales, intentar extraer el ticker
+        # Formato común: "COMPANY NAME\nTICKER\nEXCHANGE" → extraer TICKER
+        parts = raw.split('\n')
+        if len(parts) > 1:
+            # El ticker suele ser la parte más corta (2-5 caracteres)
+            ticker_candidates = [p.strip().upper() for p in parts if 2 <= len(p.strip()) <= 10]
+            if ticker_candidates:
+                asset_symbol_or_name = ticker_candidates[0]
+
+        return asset_symbol_or_name
+
+    def _resolve_assets(
+        self,
+        names: Iterable[str],
+        asset_cache: Dict[str, UUID]
+    ) -> int:
+        """
+        Resolver (o crear) los activos de un bloque con consultas por conjunto
+
+        Busca primero por símbolo (sin distinguir mayúsculas), después por
+        nombre de empresa y crea los que falten. Rellena asset_cache.
+
+        Returns:
+            Número de activos creados
+        """
+        pending = {name for name in names if name not in asset_cache}
+        if not pending:
+            return 0
+
+        # 1. Por símbolo (case-insensitive)
+        by_upper = {}
+        for name in pending:
+            by_upper.setdefault(name.upper(), []).append(name)
+
+        for symbol, asset_id in self.db.execute(
+            select(Asset.symbol, Asset.id).where(func.upper(Asset.symbol).in_(by_upper.keys()))
+        ):
+            for name in by_upper.get(symbol.upper(), []):
+                asset_cache[name] = asset_id
+                pending.discard(name)
+
+        # 2. Por nombre de empresa
+        if pending:
+            candidates = self.db.execute(
+                select(Asset.symbol, Asset.name, Asset.id)
+                .where(or_(*[Asset.name.ilike(f"%{name}%") for name in pending]))
+            ).all()
+            for name in list(pending):
+                name_lower = name.lower()
+                match = next((c for c in candidates if c.name and name_lower in c.name.lower()), None)
+                if match:
+                    asset_cache[name] = match.id
+                    pending.discard(name)
+                    print(f"🔍 Activo encontrado por nombre: '{name}' → {match.symbol} ({match.name})")
+
+        # 3. Crear los que no existen
+        if pending:
+            new_assets = {}
+            for name in pending:
+                # Limpiar y validar el símbolo antes de crear
+                asset_symbol = name.upper()[:20]  # Limitar a 20 caracteres
+                if asset_symbol in new_assets:
+                    continue
+                new_assets[asset_symbol] = {
+                    'id': uuid.uuid4(),
+                    'symbol': asset_symbol,
+                    'name': name[:100],  # Limitar nombre también
+                    'asset_type': AssetType.STOCK,  # Default
+                    'currency': 'USD',  # Default currency
+                    'market': None,
+                }
+
+            self.db.execute(insert(Asset), list(new_assets.values()))
+
+            for name in pending:
+                asset_cache[name] = new_assets[name.upper()[:20]]['id']
+
+            # Log para tracking
+            print(f"✨ Activos creados automáticamente: {', '.join(new_assets.keys())}")
+            return len(new_assets)
+
+        return 0
+
+    def _iter_xlsx_chunks(self, source: Union[bytes, IO], chunk_size: int) -> Iterator[pd.DataFrame]:
+        """Leer la primera hoja de un XLSX por bloques en modo read-only (memoria constante)"""
+        if isinstance(source, (bytes, bytearray)):
+            source = io.BytesIO(source)
+
+        workbook = load_workbook(source, read_only=True, data_only=True)
+        try:
+            rows = workbook.active.iter_rows(values_only=True)
+            header = next(rows, None)
+            if header is None:
+                return
+            columns = [
+                str(col) if col is not None else f"Unnamed: {i}"
+                for i, col in enumerate(header)
+            ]
+
+            buffer = []
+            index = []
+            for row_number, row in enumerate(rows):
+                if all(value is None for value in row):
+                    continue
+                buffer.append(row[:len(columns)])
+                index.append(row_number)
+                if len(buffer) >= chunk_size:
+                    yield pd.DataFrame(buffer, columns=columns, index=index)
+                    buffer, index = [], []
+
+            if buffer:
+                yield pd.DataFrame(buffer, columns=columns, index=index)
+        finally:
+            workbook.close()
+
+    def _process_transaction_chunks(
+        self,
+        chunks: Iterable[pd.DataFrame],
+        portfolio_id: UUID,
+        skip_duplicates: bool
+    ) -> Dict[str, any]:
+        """
+        Procesar transacciones por bloques
+
+        Cada bloque se parsea de forma vectorizada, resuelve activos y
+        duplicados con una consulta por conjunto y se inserta en bloque.
+        """
         # Verificar que el portfolio existe
         portfolio = self.db.query(Portfolio).filter(Portfolio.id == portfolio_id).first()
         if not portfolio:
             raise ValueError(f"Portfolio {portfolio_id} no encontrado")
-        
+
         stats = {
-            'total': len(df),
+            'total': 0,
             'created': 0,
             'skipped': 0,
             'assets_created': 0,  # Nuevos activos creados
             'errors': [],
             'min_date': None  # Para snapshot recalculation
         }
-        
-        def parse_spanish_float(val):
-            if pd.isna(val):
-                return 0.0
-            if isinstance(val, (int, float)):
-                return float(val)
-            val_str = str(val).strip()
-            # Reemplazar punto de miles por nada y coma decimal por punto
-            val_str = val_str.replace('.', '').replace(',', '.')
-            return float(val_str)
 
-        for idx, row in df.iterrows():
+        asset_cache: Dict[str, UUID] = {}
+        affected_assets = set()
+        columns = None
+
+        for df in chunks:
+            if columns is None:
+                columns = self._normalize_transaction_columns(df.columns)
+            df.columns = columns
+            stats['total'] += len(df)
+            if df.empty:
+                continue
+
+            # Parseo vectorizado
+            symbols = df['asset_symbol'].map(self._extract_asset_symbol)
+            dates = self._parse_date_series(df['date'])
+            quantities = self._parse_spanish_float_series(df['quantity'])
+            prices = self._parse_spanish_float_series(df['price'])
+            fees = (
+                self._parse_spanish_float_series(df['fees'])
+                if 'fees' in df.columns else pd.Series(0.0, index=df.index)
+            )
+            raw_types = df['type'].astype(str).str.upper().str.strip()
+            tx_types = raw_types.map(self.TRANSACTION_TYPE_MAP)
+            notes = (
+                df['notes'].astype(object).map(lambda v: str(v) if pd.notna(v) else None)
+                if 'notes' in df.columns else pd.Series(None, index=df.index, dtype=object)
+            )
+
+            # Validación por fila
+            invalid = pd.Series('', index=df.index)
+            invalid[tx_types.isna()] = "Tipo desconocido: " + raw_types[tx_types.isna()] + ". Use C/V o BUY/SELL."
+            invalid[dates.isna() & (invalid == '')] = "Fecha inválida: " + df['date'].astype(str)
+            for label, values in (('quantity', quantities), ('price', prices), ('fees', fees)):
+                bad = values.isna() & (invalid == '')
+                if not bad.any():
+                    continue
+                invalid[bad] = f"Valor numérico inválido en {label}: " + df.loc[bad, label].astype(str)
+
+            for idx in invalid.index[invalid != '']:
+                stats['errors'].append(f"Fila {idx + 2}: {invalid[idx]}")
+                print(f"❌ Error en fila {idx + 2}: {invalid[idx]}")
+
+            valid = invalid == ''
+            if not valid.any():
+                continue
+
             try:
-                # Buscar o crear asset
-                asset_symbol_or_name = str(row['asset_symbol']).strip()
-                
-                # Limpiar saltos de línea y espacios múltiples
-                asset_symbol_or_name = ' '.join(asset_symbol_or_name.split())
-                
-                # Si contiene saltos de línea originales, intentar extraer el ticker
-                # Formato común: "COMPANY NAME\nTICKER\nEXCHANGE" → extraer TICKER
-                parts = str(row['asset_symbol']).split('\n')
-                if len(parts) > 1:
-                    # El ticker suele ser la parte más corta (2-5 caracteres)
-                    ticker_candidates = [p.strip().upper() for p in parts if 2 <= len(p.strip()) <= 10]
-                    if ticker_candidates:
-                        asset_symbol_or_name = ticker_candidates[0]
-                        print(f"📝 Extrayendo ticker: {parts} → {asset_symbol_or_name}")
-                
-                # Primero intentar buscar por símbolo (case-insensitive)
-                asset = self.db.query(Asset).filter(
-                    Asset.symbol.ilike(asset_symbol_or_name)
-                ).first()
-                
-                # Si no se encuentra, buscar por nombre de empresa
-                if not asset:
-                    asset = self.db.query(Asset).filter(
-                        Asset.name.ilike(f"%{asset_symbol_or_name}%")
-                    ).first()
-                    
-                    if asset:
-                        print(f"🔍 Activo encontrado por nombre: '{asset_symbol_or_name}' → {asset.symbol} ({asset.name})")
-                
-                if not asset:
-                    # Crear asset si no existe
-                    # Limpiar y validar el símbolo antes de crear
-                    asset_symbol = asset_symbol_or_name.upper()[:20]  # Limitar a 20 caracteres
-                    asset_name = asset_symbol_or_name[:100]  # Limitar nombre también
-                    asset_type = 'stock'  # Default
-                    
-                    # Intentar detectar el tipo por el símbolo
-                    if asset_symbol.endswith('.L') or asset_symbol.endswith('.LON'):
-                        asset_type = 'stock'
-                    elif asset_symbol.startswith('EUR') or asset_symbol.startswith('USD'):
-                        asset_type = 'forex'
-                    elif len(asset_symbol) <= 5 and asset_symbol.isalpha():
-                        asset_type = 'stock'
-                    
-                    asset = Asset(
-                        symbol=asset_symbol,
-                        name=asset_name,
-                        asset_type=asset_type,
-                        currency='USD',  # Default currency
-                        market=None
-                    )
-                    self.db.add(asset)
-                    self.db.flush()
-                    
-                    # Incrementar contador de activos creados
-                    stats['assets_created'] += 1
-                    
-                    # Log para tracking
-                    print(f"✨ Activo creado automáticamente: {asset_symbol} ({asset_type})")
-                
-                # Parsear fecha (DD/MM/YYYY o YYYY-MM-DD)
-                date_val = row['date']
-                if isinstance(date_val, str):
-                    # Intentar varios formatos
-                    try:
-                        transaction_date = datetime.strptime(date_val, '%d/%m/%Y').date()
-                    except ValueError:
-                        try:
-                            transaction_date = datetime.strptime(date_val, '%Y-%m-%d').date()
-                        except ValueError:
-                             transaction_date = pd.to_datetime(date_val).date()
-                else:
-                    # Si pandas ya lo parseó (ej: desde Excel)
-                    transaction_date = pd.to_datetime(date_val).date()
-                
-                # Parsear valores numéricos
-                quantity = parse_spanish_float(row['quantity'])
-                price = parse_spanish_float(row['price'])
-                fees = parse_spanish_float(row.get('fees', 0))
-                notes = str(row.get('notes', '')) if pd.notna(row.get('notes')) else None
-
-                # Parsear tipo (C/V o BUY/SELL)
-                raw_type = str(row['type']).upper().strip()
-                type_map = {
-                    'C': 'buy', 'V': 'sell',
-                    'BUY': 'buy', 'SELL': 'sell',
-                    'COMPRA': 'buy', 'VENTA': 'sell'
-                }
-                
-                if raw_type not in type_map:
-                    raise ValueError(f"Tipo desconocido: {raw_type}. Use C/V o BUY/SELL.")
-                tx_type = type_map[raw_type]
+                # Buscar o crear assets del bloque
+                assets_created = self._resolve_assets(symbols[valid].unique(), asset_cache)
+
+                chunk = pd.DataFrame({
+                    'asset_id': symbols[valid].map(asset_cache),
+                    'transaction_date': dates[valid],
+                    'transaction_type': tx_types[valid],
+                    'quantity': quantities[valid],
+                    'price': prices[valid],
+                    'fees': fees[valid],
+                    'notes': notes[valid],
+                })
 
-                # Verificar duplicado
+                # Verificar duplicados (contra la BD y dentro del propio bloque)
                 if skip_duplicates:
-                    existing = self.db.query(Transaction).filter(
-                        and_(
-                            Transaction.portfolio_id == portfolio_id,
-                            Transaction.asset_id == asset.id,
-                            Transaction.transaction_date == transaction_date,
-                            Transaction.transaction_type == tx_type,
-                            Transaction.quantity == quantity,
-                            Transaction.price == price
+                    key_columns = ['asset_id', 'transaction_date', 'transaction_type', 'quantity', 'price']
+                    existing = self.db.execute(
+                        select(
+                            Transaction.asset_id,
+                            Transaction.transaction_date,
+                            Transaction.transaction_type,
+                            Transaction.quantity,
+                            Transaction.price
+                        ).where(
+                            and_(
+                                Transaction.portfolio_id == portfolio_id,
+                                Transaction.asset_id.in_(set(chunk['asset_id'])),
+                                Transaction.transaction_date.in_(
+                                    set(chunk['transaction_date'].dt.to_pydatetime())
+                                )
+                            )
                         )
-                    ).first()
-                    
-                    if existing:
-                        stats['skipped'] += 1
-                        continue
-                
-                # Crear transacción
-                transaction = Transaction(
-                    portfolio_id=portfolio_id,
-                    asset_id=asset.id,
-                    transaction_type=tx_type,
-                    transaction_date=transaction_date,
-                    quantity=quantity,
-                    price=price,
-                    fees=fees,
-                    notes=notes
-                )
-                
-                self.db.add(transaction)
-                stats['created'] += 1
-                
+                    ).all()
+                    existing_keys = {
+                        (row.asset_id, row.transaction_date.replace(tzinfo=None), row.transaction_type, row.quantity, row.price)
+                        for row in existing
+                    }
+                    keys = pd.Series(list(zip(*(chunk[c] for c in key_columns))), index=chunk.index)
+                    duplicated = keys.isin(existing_keys) | keys.duplicated()
+                    stats['skipped'] += int(duplicated.sum())
+                    chunk = chunk[~duplicated]
+
+                if chunk.empty:
+                    self.db.commit()
+                    stats['assets_created'] += assets_created
+                    continue
+
+                # Crear transacciones
+                records = chunk.to_dict('records')
+                for record in records:
+                    record['id'] = uuid.uuid4()
+                    record['portfolio_id'] = portfolio_id
+                    record['transaction_date'] = record['transaction_date'].to_pydatetime()
+                self.db.execute(insert(Transaction), records)
+                self.db.commit()
+
+                stats['assets_created'] += assets_created
+                stats['created'] += len(records)
+                affected_assets.update(chunk['asset_id'])
+
                 # Track min date for snapshot recalculation
-                if stats['min_date'] is None or transaction_date < stats['min_date']:
-                    stats['min_date'] = transaction_date
-                
+                chunk_min_date = chunk['transaction_date'].min().date()
+                if stats['min_date'] is None or chunk_min_date < stats['min_date']:
+                    stats['min_date'] = chunk_min_date
+
             except Exception as e:
-                # Rollback para esta fila específica
+                # Rollback para este bloque
                 self.db.rollback()
-                stats['errors'].append(f"Fila {idx + 2}: {str(e)}")
-                print(f"❌ Error en fila {idx + 2}: {str(e)}")
-        
-        # Commit final solo si no hubo errores críticos
-        try:
-            self.db.commit()
-        except Exception as e:
-            self.db.rollback()
-            raise ValueError(f"Error al guardar transacciones: {str(e)}")
-        
-        # Recalcular posiciones para los assets afectados
-        # Optimizacion: Recolectar assets afectados y recalcular solo esos
+                first_row, last_row = df.index[0] + 2, df.index[-1] + 2
+                stats['errors'].append(f"Filas {first_row}-{last_row}: {str(e)}")
+                print(f"❌ Error en filas {first_row}-{last_row}: {str(e)}")
+                # Los activos creados en este bloque no se han guardado
+                asset_cache.clear()
+
+        if columns is None:
+            self._normalize_transaction_columns([])
+
+        # Recalcular posiciones solo para los assets afectados (en bloque)
         from app.services.position_service import PositionService
-        position_service = PositionService(self.db)
-        
-        affected_assets = set()
-        for idx, row in df.iterrows():
-             try:
-                asset_symbol = str(row['asset_symbol']).upper()
-                asset = self.db.query(Asset).filter(Asset.symbol == asset_symbol).first()
-                if asset:
-                    affected_assets.add(asset.id)
-             except:
-                 pass
-                 
-        for asset_id in affected_assets:
-            position_service.recalculate_position(portfolio_id, asset_id)
-            
+        PositionService(self.db).rebuild_positions(portfolio_id, affected_assets)
+
         self.db.commit()
         return stats
 
     def import_transactions_csv(
         self, 
         portfolio_id: UUID,
-        csv_content: str,
+        csv_content: Union[str, IO],
         skip_duplicates: bool = True
     ) -> Dict[str, any]:
-        """Importar transacciones desde CSV"""
-        df = pd.read_csv(io.StringIO(csv_content))
-        stats = self._process_transactions_df(df, portfolio_id, skip_duplicates)
-        
-        # Trigger snapshot recalculation if transactions were created
-        if stats.get('created', 0) > 0 and stats.get('min_date'):
-            from datetime import datetime
-            from app.services.snapshot_service import SnapshotService
-            
-            today = datetime.now().date()
-            min_date = stats['min_date']
-            
-            # Create a new session for the background task
-            # This is a placeholder for actual background task handling in a web framework
-            # In a real FastAPI app, this would be passed to background_tasks.add_task
-            def run_recalculation_in_background(pid, start_date, end_date):
-                from app.core.database import SessionLocal
-                db_bg = SessionLocal()
-                try:
-                    snapshot_service_bg = SnapshotService(db_bg)
-                    snapshot_service_bg.create_daily_snapshots_for_portfolio(
-                        pid, start_date, end_date, overwrite=True
-                    )
-                finally:
-                    db_bg.close()
-            
-            # In a service layer, we can't directly add to FastAPI's BackgroundTasks.
-            # This is a conceptual trigger. The actual background task execution
-            # would happen in the API endpoint that calls this service method.
-            # For now, we'll just return the stats. The API layer would handle the task.
-            # If this service method were to directly trigger it, it would need a way
-            # to manage background processes, which is usually handled by the framework.
-            pass # The actual background task logic is moved to the API layer.
-        
-        return stats
+        """Importar transacciones desde CSV (texto o fichero), leyendo por bloques"""
+        source = io.StringIO(csv_content) if isinstance(csv_content, str) else csv_content
+        chunks = pd.read_csv(source, chunksize=self.IMPORT_CHUNK_SIZE, encoding='utf-8')
+        return self._process_transaction_chunks(chunks, portfolio_id, skip_duplicates)
 
     def import_transactions_xlsx(
         self, 
         portfolio_id: UUID,
-        file_content: bytes,
+        file_content: Union[bytes, IO],
         skip_duplicates: bool = True
     ) -> Dict[str, any]:
-        """Importar transacciones desde XLSX"""
-        df = pd.read_excel(io.BytesIO(file_content))
-        stats = self._process_transactions_df(df, portfolio_id, skip_duplicates)
-
-        # Trigger snapshot recalculation if transactions were created
-        if stats.get('created', 0) > 0 and stats.get('min_date'):
-            from datetime import datetime
-            from app.services.snapshot_service import SnapshotService
-            
-            today = datetime.now().date()
-            min_date = stats['min_date']
-            
-            def run_recalculation_in_background(pid, start_date, end_date):
-                from app.core.database import SessionLocal
-                db_bg = SessionLocal()
-                try:
-                    snapshot_service_bg = SnapshotService(db_bg)
-                    snapshot_service_bg.create_daily_snapshots_for_portfolio(
-                        pid, start_date, end_date, overwrite=True
-                    )
-                finally:
-                    db_bg.close()
-            
-            pass # The actual background task logic is moved to the API layer.
-        
-        return stats
+        """Importar transacciones desde XLSX (bytes o fichero), leyendo por bloques"""
+        chunks = self._iter_xlsx_chunks(file_content, self.IMPORT_CHUNK_SIZE)
+        return self._process_transaction_chunks(chunks, portfolio_id, skip_duplicates)
     
     def import_quotes_csv(
         self,
@@ -0,0 +1,360 @@
+"""
+Snapshot Metrics Materializer - Incremental SnapshotMetrics maintenance
+"""
+import bisect
+import logging
+import math
+import uuid
+from datetime import date, timedelta
+from typing import Dict, List, Optional
+from uuid import UUID
+
+from sqlalchemy import and_, delete, desc, insert, select
+from sqlalchemy.orm import Session
+
+from app.models.asset import Asset
+from app.db.models_snapshots import PortfolioSnapshot, PositionSnapshot, SnapshotMetrics
+
+logger = logging.getLogger(__name__)
+
+
+# Observations in the rolling volatility/Sharpe window
+VOLATILITY_WINDOW = 30
+
+# Snapshots are taken every calendar day
+PERIODS_PER_YEAR = 365
+
+# Look-back needed for weekly/monthly/yearly returns and the rolling window
+LOOKBACK_DAYS = 366
+
+
+class MetricsMaterializer:
+    """
+    Maintains one SnapshotMetrics row per portfolio snapshot
+
+    Each row stores, besides the published metrics, the running state it
+    was derived from (accumulators): the time-weighted wealth index, its
+    peak, the day's return and the rolling-window sums. The next day's row
+    is computed from the previous row and the new snapshot in O(1); period
+    returns read the wealth index of the rows 7/30/365 days back.
+    """
+
+    @staticmethod
+    def _daily_return(
+        value: float,
+        invested: float,
+        prev_value: float,
+        prev_invested: float
+    ) -> float:
+        """Flow-neutral return between two snapshots"""
+        if prev_value <= 0:
+            return 0.0
+        return (value - (invested - prev_invested)) / prev_value - 1.0
+
+    @staticmethod
+    def _period_return(
+        history_dates: List[date],
+        history_wealth: List[float],
+        wealth: float,
+        since: date
+    ) -> Optional[float]:
+        """Return since the last row on or before `since` (None if none)"""
+        index = bisect.bisect_right(history_dates, since) - 1
+        if index < 0 or history_wealth[index] <= 0:
+            return None
+        return (wealth / history_wealth[index] - 1.0) * 100
+
+    @staticmethod
+    def _load_allocations(
+        db: Session,
+        portfolio_id: UUID,
+        from_date: date,
+        to_date: date
+    ) -> Dict[date, Dict[str, Dict]]:
+        """
+        Asset and asset-type allocation per day, for the whole range at once
+
+        Returns:
+            {snapshot_date: {"assets": {ticker: weight}, "types": {type: weight}}}
+        """
+        allocations: Dict[date, Dict[str, Dict]] = {}
+        rows = db.execute(
+            select(
+                PositionSnapshot.snapshot_date,
+                PositionSnapshot.ticker,
+                PositionSnapshot.portfolio_weight,
+                Asset.asset_type
+            )
+            .join(PortfolioSnapshot, PositionSnapshot.portfolio_snapshot_id == PortfolioSnapshot.id)
+            .join(Asset, PositionSnapshot.asset_id == Asset.id)
+            .where(
+                and_(
+                    PortfolioSnapshot.portfolio_id == portfolio_id,
+                    PositionSnapshot.snapshot_date >= from_date,
+                    PositionSnapshot.snapshot_date <= to_date
+                )
+            )
+        )
+        for snapshot_date, ticker, weight, asset_type in rows:
+            day = allocations.setdefault(snapshot_date, {"assets": {}, "types": {}})
+            weight = float(weight)
+            type_name = asset_type.value if hasattr(asset_type, "value") else str(asset_type)
+            day["assets"][ticker] = round(weight, 4)
+            day["types"][type_name] = round(day["types"].get(type_name, 0.0) + weight, 4)
+        return allocations
+
+    @staticmethod
+    def materialize(
+        db: Session,
+        portfolio_id: UUID,
+        from_date: date,
+        to_date: Optional[date] = None
+    ) -> int:
+        """
+        (Re)build SnapshotMetrics rows from a date onwards
+
+        Continues from the last metrics row before from_date. Rows from
+        from_date to the last snapshot are rewritten, since every later row
+        depends on the earlier ones through the wealth index. After a daily
+        snapshot this touches a single row with a constant number of queries.
+
+        Args:
+            db: Database session
+            portfolio_id: Portfolio ID
+            from_date: First date whose snapshot changed
+            to_date: Last date to materialize (None = last snapshot)
+
+        Returns:
+            Number of metrics rows written
+        """
+        anchor = db.execute(
+            select(SnapshotMetrics)
+            .where(
+                and_(
+                    SnapshotMetrics.portfolio_id == portfolio_id,
+                    SnapshotMetrics.metric_date < from_date,
+                    SnapshotMetrics.accumulators.isnot(None)
+                )
+            )
+            .order_by(desc(SnapshotMetrics.metric_date))
+            .limit(1)
+        ).scalar_one_or_none()
+
+        def load_snapshots(start: Optional[date]):
+            conditions = [PortfolioSnapshot.portfolio_id == portfolio_id]
+            if start:
+                conditions.append(PortfolioSnapshot.snapshot_date >= start)
+            if to_date:
+                conditions.append(PortfolioSnapshot.snapshot_date <= to_date)
+            return db.execute(
+                select(
+                    PortfolioSnapshot.snapshot_date,
+                    PortfolioSnapshot.total_value,
+                    PortfolioSnapshot.total_invested
+                )
+                .where(and_(*conditions))
+                .order_by(PortfolioSnapshot.snapshot_date)
+            ).all()
+
+        snapshots = load_snapshots(anchor.metric_date if anchor else None)
+
+        # Look-back rows (wealth index and daily returns) before the first new day
+        history_dates: List[date] = []
+        history_wealth: List[float] = []
+        history_returns: List[Optional[float]] = []
+        if anchor:
+            history_rows = db.execute(
+                select(SnapshotMetrics.metric_date, SnapshotMetrics.accumulators)
+                .where(
+                    and_(
+                        SnapshotMetrics.portfolio_id == portfolio_id,
+                        SnapshotMetrics.metric_date <= anchor.metric_date,
+                        SnapshotMetrics.metric_date > anchor.metric_date - timedelta(days=LOOKBACK_DAYS)
+                    )
+                )
+                .order_by(SnapshotMetrics.metric_date)
+            ).all()
+            for metric_date, accumulators in history_rows:
+                if accumulators:
+                    history_dates.append(metric_date)
+                    history_wealth.append(accumulators["wealth"])
+                    history_returns.append(accumulators.get("daily_return"))
+
+            # The anchor must line up with its snapshot and carry a full
+            # window of returns to drop from; otherwise rebuild from scratch
+            state = anchor.accumulators
+            if (
+                not snapshots
+                or snapshots[0].snapshot_date != anchor.metric_date
+                or len(history_returns) < state.get("window_count", 0)
+            ):
+                anchor = None
+                history_dates, history_wealth, history_returns = [], [], []
+                snapshots = load_snapshots(None)
+
+        new_snapshots = snapshots[1:] if anchor else snapshots
+        if not new_snapshots:
+            return 0
+
+        first_new_date = new_snapshots[0].snapshot_date
+        last_new_date = new_snapshots[-1].snapshot_date
+        allocations = MetricsMaterializer._load_allocations(
+            db, portfolio_id, first_new_date, last_new_date
+        )
+
+        if anchor:
+            state = dict(anchor.accumulators)
+            best = (anchor.best_day_return, anchor.best_day_date)
+            worst = (anchor.worst_day_return, anchor.worst_day_date)
+            max_drawdown = (anchor.max_drawdown, anchor.max_drawdown_date)
+            prev = snapshots[0]
+        else:
+            state = None
+            best = worst = max_drawdown = (None, None)
+            prev = None
+
+        rows = []
+        for snapshot in new_snapshots:
+            value = float(snapshot.total_value)
+            invested = float(snapshot.total_invested)
+
+            if state is None:
+                # First snapshot of the portfolio
+                daily_return = None
+                state = {
+                    "wealth": 1.0,
+                    "peak_wealth": 1.0,
+                    "ytd_base": 1.0,
+                    "window_sum": 0.0,
+                    "window_sum_sq": 0.0,
+                    "window_count": 0,
+                }
+            else:
+                daily_return = MetricsMaterializer._daily_return(
+                    value, invested, float(prev.total_value), float(prev.total_invested)
+                )
+                if snapshot.snapshot_date.year != prev.snapshot_date.year:
+                    state["ytd_base"] = state["wealth"]
+                state["wealth"] *= 1.0 + daily_return
+                state["peak_wealth"] = max(state["peak_wealth"], state["wealth"])
+
+                # Rolling window: add today's return, drop the one leaving it
+                state["window_sum"] += daily_return
+                state["window_sum_sq"] += daily_return ** 2
+                state["window_count"] += 1
+                if state["window_count"] > VOLATILITY_WINDOW:
+                    dropped = history_returns[-VOLATILITY_WINDOW] or 0.0
+                    state["window_sum"] -= dropped
+                    state["window_sum_sq"] -= dropped ** 2
+                    state["window_count"] = VOLATILITY_WINDOW
+
+                daily_percent = daily_return * 100
+                if best[0] is None or daily_percent > float(best[0]):
+                    best = (daily_percent, snapshot.snapshot_date)
+                if worst[0] is None or daily_percent < float(worst[0]):
+                    worst = (daily_percent, snapshot.snapshot_date)
+
+            state["daily_return"] = daily_return
+            wealth = state["wealth"]
+
+            drawdown = (wealth / state["peak_wealth"] - 1.0) * 100 if state["peak_wealth"] > 0 else 0.0
+            if max_drawdown[0] is None or drawdown < float(max_drawdown[0]):
+                max_drawdown = (drawdown, snapshot.snapshot_date)
+
+            daily_volatility = sharpe_ratio = weekly_volatility = None
+            count = state["window_count"]
+            if count >= 2:
+                mean = state["window_sum"] / count
+                variance = max((state["window_sum_sq"] - count * mean ** 2) / (count - 1), 0.0)
+                std = math.sqrt(variance)
+                daily_volatility = std * 100
+                weekly_volatility = daily_volatility * math.sqrt(7)
+                if std > 0:
+                    sharpe_ratio = mean / std * math.sqrt(PERIODS_PER_YEAR)
+
+            current_date = snapshot.snapshot_date
+            allocation = allocations.get(current_date, {"assets": {}, "types": {}})
+            rows.append({
+                "id": uuid.uuid4(),
+                "portfolio_id": portfolio_id,
+                "metric_date": current_date,
+                "weekly_return": MetricsMaterializer._period_return(
+                    history_dates, history_wealth, wealth, current_date - timedelta(days=7)
+                ),
+                "monthly_return": MetricsMaterializer._period_return(
+                    history_dates, history_wealth, wealth, current_date - timedelta(days=30)
+                ),
+                "yearly_return": MetricsMaterializer._period_return(
+                    history_dates, history_wealth, wealth, current_date - timedelta(days=365)
+                ),
+                "ytd_return": (wealth / state["ytd_base"] - 1.0) * 100 if state["ytd_base"] > 0 else None,
+                "daily_volatility": daily_volatility,
+                "weekly_volatility": weekly_volatility,
+                "sharpe_ratio": sharpe_ratio,
+                "max_drawdown": max_drawdown[0],
+                "max_drawdown_date": max_drawdown[1],
+                "best_day_return": best[0],
+                "best_day_date": best[1],
+                "worst_day_return": worst[0],
+                "worst_day_date": worst[1],
+                "asset_allocation": allocation["assets"],
+                "sector_allocation": allocation["types"],
+                "accumulators": dict(state),
+            })
+
+            history_dates.append(current_date)
+            history_wealth.append(wealth)
+            history_returns.append(daily_return)
+            prev = snapshot
+
+        db.execute(
+            delete(SnapshotMetrics).where(
+                and_(
+                    SnapshotMetrics.portfolio_id == portfolio_id,
+                    SnapshotMetrics.metric_date >= first_new_date,
+                    SnapshotMetrics.metric_date <= last_new_date
+                )
+            )
+        )
+        db.execute(insert(SnapshotMetrics), rows)
+        db.commit()
+
+        return len(rows)
+
+    @staticmethod
+    def materialize_safely(
+        db: Session,
+        portfolio_id: UUID,
+        from_date: date
+    ) -> int:
+        """
+        Materialize metrics without propagating errors to the snapshot writer
+
+        Args:
+            db: Database session
+            portfolio_id: Portfolio ID
+            from_date: First date whose snapshot changed
+
+        Returns:
+            Number of metrics rows written (0 on error)
+        """
+        try:
+            return MetricsMaterializer.materialize(db, portfolio_id, from_date)
+        except Exception as e:
+            db.rollback()
+            logger.error(f"Failed to materialize metrics for portfolio {portfolio_id}: {e}")
+            return 0
+
+    @staticmethod
+    def get_latest(db: Session, portfolio_id: UUID) -> Optional[SnapshotMetrics]:
+        """Most recent metrics row of a portfolio"""
+        return db.execute(
+            select(SnapshotMetrics)
+            .where(SnapshotMetrics.portfolio_id == portfolio_id)
+            .order_by(desc(SnapshotMetrics.metric_date))
+            .limit(1)
+        ).scalar_one_or_none()
+
+
+# Global instance
+metrics_materializer = MetricsMaterializer()
@@ -0,0 +1,446 @@
+"""
+Portfolio Performance Analytics - Vectorized metrics over snapshot series
+"""
+from dataclasses import dataclass
+from datetime import date
+from typing import Dict, Optional
+from uuid import UUID
+
+import numpy as np
+from sqlalchemy import Date, and_, func, select
+from sqlalchemy.orm import Session
+
+from app.models.asset import Asset
+from app.models.quote import Quote
+from app.db.models_snapshots import PortfolioSnapshot
+
+
+# Fallback when the series is too short to infer its sampling frequency
+TRADING_DAYS_PER_YEAR = 252
+DAYS_PER_YEAR = 365.25
+
+# Keys of the compute_metrics() result
+METRIC_KEYS = (
+    "period_return",
+    "time_weighted_return",
+    "time_weighted_return_annualized",
+    "money_weighted_return",
+    "volatility",
+    "annualized_volatility",
+    "rolling_volatility",
+    "sharpe_ratio",
+    "sortino_ratio",
+    "best_day",
+    "worst_day",
+    "drawdown",
+    "benchmark",
+    "number_of_days",
+)
+
+
+@dataclass
+class SnapshotSeries:
+    """Columnar snapshot history (one element per snapshot, sorted by date)"""
+    dates: np.ndarray           # datetime64[D]
+    total_value: np.ndarray     # float64
+    total_invested: np.ndarray  # float64
+
+    def __len__(self) -> int:
+        return len(self.dates)
+
+
+class PerformanceAnalytics:
+    """Performance analytics computed with NumPy over columnar snapshot data"""
+
+    @staticmethod
+    def load_series(
+        db: Session,
+        portfolio_id: UUID,
+        from_date: Optional[date],
+        to_date: date
+    ) -> SnapshotSeries:
+        """
+        Fetch the value/invested series of a portfolio as NumPy columns
+
+        Args:
+            db: Database session
+            portfolio_id: Portfolio ID
+            from_date: Start date (None = first snapshot)
+            to_date: End date
+
+        Returns:
+            SnapshotSeries sorted by date
+        """
+        conditions = [
+            PortfolioSnapshot.portfolio_id == portfolio_id,
+            PortfolioSnapshot.snapshot_date <= to_date
+        ]
+        if from_date:
+            conditions.append(PortfolioSnapshot.snapshot_date >= from_date)
+
+        rows = db.execute(
+            select(
+                PortfolioSnapshot.snapshot_date,
+                PortfolioSnapshot.total_value,
+                PortfolioSnapshot.total_invested
+            )
+            .where(and_(*conditions))
+            .order_by(PortfolioSnapshot.snapshot_date)
+        ).all()
+
+        if not rows:
+            empty = np.array([], dtype=np.float64)
+            return SnapshotSeries(np.array([], dtype="datetime64[D]"), empty, empty)
+
+        dates, values, invested = zip(*rows)
+        return SnapshotSeries(
+            dates=np.array(dates, dtype="datetime64[D]"),
+            total_value=np.array(values, dtype=np.float64),
+            total_invested=np.array(invested, dtype=np.float64)
+        )
+
+    @staticmethod
+    def load_benchmark(
+        db: Session,
+        symbol: str,
+        from_date: date,
+        to_date: date
+    ) -> Optional[Dict[str, np.ndarray]]:
+        """
+        Fetch daily closes of a benchmark asset as NumPy columns
+
+        Args:
+            db: Database session
+            symbol: Benchmark asset symbol
+            from_date: Start date
+            to_date: End date
+
+        Returns:
+            Dict with "dates" and "close" arrays, or None if the asset is unknown
+        """
+        asset_id = db.execute(
+            select(Asset.id).where(Asset.symbol == symbol.upper())
+        ).scalar_one_or_none()
+        if asset_id is None:
+            return None
+
+        quote_day = func.date(Quote.timestamp, type_=Date)
+        rows = db.execute(
+            select(quote_day, Quote.close)
+            .where(
+                and_(
+                    Quote.asset_id == asset_id,
+                    quote_day >= from_date,
+                    quote_day <= to_date
+                )
+            )
+            .order_by(Quote.timestamp)
+        ).all()
+
+        if not rows:
+            return {"dates": np.array([], dtype="datetime64[D]"), "close": np.array([])}
+
+        dates, closes = zip(*rows)
+        dates = np.array(dates, dtype="datetime64[D]")
+        closes = np.array(closes, dtype=np.float64)
+        # Keep the last close of each day
+        last_of_day = np.append(dates[1:] != dates[:-1], True)
+        return {"dates": dates[last_of_day], "close": closes[last_of_day]}
+
+    @staticmethod
+    def daily_returns(series: SnapshotSeries) -> np.ndarray:
+        """
+        Time-weighted daily returns, neutralizing external cash flows
+
+        The flow of each day is the change in invested capital; it is removed
+        from the end value so deposits and withdrawals are not counted as
+        performance: r_t = (V_t - F_t) / V_{t-1} - 1.
+
+        Args:
+            series: Snapshot series
+
+        Returns:
+            Array of len(series) - 1 returns (0 where the previous value is 0)
+        """
+        if len(series) < 2:
+            return np.array([], dtype=np.float64)
+
+        previous = series.total_value[:-1]
+        flows = np.diff(series.total_invested)
+        gain = series.total_value[1:] - flows
+        with np.errstate(divide="ignore", invalid="ignore"):
+            returns = np.where(previous > 0, gain / previous - 1.0, 0.0)
+        return returns
+
+    @staticmethod
+    def periods_per_year(dates: np.ndarray) -> float:
+        """Observations per year inferred from the series spacing"""
+        if len(dates) < 2:
+            return float(TRADING_DAYS_PER_YEAR)
+        span_days = float((dates[-1] - dates[0]).astype(np.int64))
+        if span_days <= 0:
+            return float(TRADING_DAYS_PER_YEAR)
+        return (len(dates) - 1) / (span_days / DAYS_PER_YEAR)
+
+    @staticmethod
+    def money_weighted_return(series: SnapshotSeries) -> Optional[float]:
+        """
+        Annualized money-weighted return (XIRR) of the period
+
+        Cash flows: the opening value is invested on the first day, every
+        change in invested capital on its day, and the closing value is
+        withdrawn on the last day. Solved with Newton's method on the
+        vectorized NPV, falling back to bisection.
+
+        Args:
+            series: Snapshot series
+
+        Returns:
+            Annualized rate, or None if it cannot be determined
+        """
+        if len(series) < 2:
+            return None
+
+        flows = np.concatenate(([-series.total_value[0]], -np.diff(series.total_invested)))
+        flows[-1] += series.total_value[-1]
+        years = (series.dates - series.dates[0]).astype(np.int64) / DAYS_PER_YEAR
+
+        if years[-1] <= 0 or not (np.any(flows > 0) and np.any(flows < 0)):
+            return None
+
+        def npv(rate: float) -> float:
+            return float(np.sum(flows / (1.0 + rate) ** years))
+
+        def d_npv(rate: float) -> float:
+            return float(np.sum(-years * flows / (1.0 + rate) ** (years + 1.0)))
+
+        rate = 0.1
+        for _ in range(50):
+            derivative = d_npv(rate)
+            if derivative == 0 or not np.isfinite(derivative):
+                break
+            step = npv(rate) / derivative
+            rate -= step
+            if rate <= -0.999999:
+                break
+            if abs(step) < 1e-10:
+                return rate
+
+        # Bisection over a wide bracket
+        low, high = -0.9999, 100.0
+        npv_low, npv_high = npv(low), npv(high)
+        if not (np.isfinite(npv_low) and np.isfinite(npv_high)) or npv_low * npv_high > 0:
+            return None
+        for _ in range(200):
+            mid = (low + high) / 2
+            npv_mid = npv(mid)
+            if abs(npv_mid) < 1e-9 or high - low < 1e-12:
+                return mid
+            if npv_low * npv_mid < 0:
+                high = mid
+            else:
+                low, npv_low = mid, npv_mid
+        return (low + high) / 2
+
+    @staticmethod
+    def rolling_std(returns: np.ndarray, window: int) -> np.ndarray:
+        """
+        Rolling sample standard deviation using cumulative sums
+
+        Args:
+            returns: Daily returns
+            window: Window length in observations
+
+        Returns:
+            Array of len(returns) - window + 1 values (empty if too short)
+        """
+        if window < 2 or len(returns) < window:
+            return np.array([], dtype=np.float64)
+
+        cumsum = np.concatenate(([0.0], np.cumsum(returns)))
+        cumsum_sq = np.concatenate(([0.0], np.cumsum(returns ** 2)))
+        window_sum = cumsum[window:] - cumsum[:-window]
+        window_sum_sq = cumsum_sq[window:] - cumsum_sq[:-window]
+        variance = (window_sum_sq - window_sum ** 2 / window) / (window - 1)
+        return np.sqrt(np.maximum(variance, 0.0))
+
+    @staticmethod
+    def max_drawdown(dates: np.ndarray, wealth: np.ndarray) -> Dict:
+        """
+        Maximum drawdown of a wealth index with its peak/trough/recovery dates
+
+        Args:
+            dates: Dates of the wealth index
+            wealth: Wealth index (cumulative growth of 1)
+
+        Returns:
+            Dict with max_drawdown (percent, <= 0) and the associated dates
+        """
+        result = {"max_drawdown": 0.0, "peak_date": None, "trough_date": None, "recovery_date": None}
+        if len(wealth) < 2:
+            return result
+
+        running_peak = np.maximum.accumulate(wealth)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            drawdowns = np.where(running_peak > 0, wealth / running_peak - 1.0, 0.0)
+
+        trough = int(np.argmin(drawdowns))
+        if drawdowns[trough] >= 0:
+            return result
+
+        peak = int(np.argmax(wealth[:trough + 1]))
+        recovered = np.nonzero(wealth[trough:] >= wealth[peak])[0]
+
+        result.update({
+            "max_drawdown": round(float(drawdowns[trough] * 100), 4),
+            "peak_date": str(dates[peak]),
+            "trough_date": str(dates[trough]),
+            "recovery_date": str(dates[trough + recovered[0]]) if len(recovered) else None
+        })
+        return result
+
+    @staticmethod
+    def beta(
+        dates: np.ndarray,
+        wealth: np.ndarray,
+        benchmark: Dict[str, np.ndarray]
+    ) -> Optional[Dict]:
+        """
+        Beta and correlation against a benchmark on the common dates
+
+        Both series are sampled on the dates they share, and returns are
+        taken between consecutive common dates so gaps (weekends, holidays)
+        do not misalign them.
+
+        Args:
+            dates: Portfolio dates
+            wealth: Portfolio wealth index (flow-neutral)
+            benchmark: Dict with "dates" and "close" arrays
+
+        Returns:
+            Dict with beta, correlation and observations (None if < 3 points)
+        """
+        common, portfolio_idx, benchmark_idx = np.intersect1d(
+            dates, benchmark["dates"], assume_unique=True, return_indices=True
+        )
+        if len(common) < 3:
+            return None
+
+        portfolio_values = wealth[portfolio_idx]
+        benchmark_values = benchmark["close"][benchmark_idx]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            portfolio_returns = portfolio_values[1:] / portfolio_values[:-1] - 1.0
+            benchmark_returns = benchmark_values[1:] / benchmark_values[:-1] - 1.0
+
+        valid = np.isfinite(portfolio_returns) & np.isfinite(benchmark_returns)
+        portfolio_returns = portfolio_returns[valid]
+        benchmark_returns = benchmark_returns[valid]
+        if len(portfolio_returns) < 2:
+            return None
+
+        benchmark_var = np.var(benchmark_returns, ddof=1)
+        if benchmark_var == 0:
+            return None
+        covariance = np.cov(portfolio_returns, benchmark_returns, ddof=1)[0, 1]
+        portfolio_std = np.std(portfolio_returns, ddof=1)
+        correlation = covariance / (portfolio_std * np.sqrt(benchmark_var)) if portfolio_std > 0 else 0.0
+
+        return {
+            "beta": round(float(covariance / benchmark_var), 4),
+            "correlation": round(float(correlation), 4),
+            "observations": int(len(portfolio_returns))
+        }
+
+    @staticmethod
+    def compute_metrics(
+        series: SnapshotSeries,
+        risk_free_rate: float = 0.0,
+        rolling_window: int = 30,
+        benchmark: Optional[Dict[str, np.ndarray]] = None
+    ) -> Dict:
+        """
+        Compute the full metric set for a snapshot series
+
+        Args:
+            series: Snapshot series (at least one snapshot)
+            risk_free_rate: Annual risk-free rate (e.g. 0.03 for 3%)
+            rolling_window: Window for rolling volatility, in observations
+            benchmark: Benchmark closes from load_benchmark (optional)
+
+        Returns:
+            Dictionary of metrics (percentages expressed as 0-100)
+        """
+        returns = PerformanceAnalytics.daily_returns(series)
+        wealth = np.concatenate(([1.0], np.cumprod(1.0 + returns)))
+        periods = PerformanceAnalytics.periods_per_year(series.dates)
+        annualization = np.sqrt(periods)
+
+        years = float((series.dates[-1] - series.dates[0]).astype(np.int64)) / DAYS_PER_YEAR
+        twr = float(wealth[-1] - 1.0)
+        twr_annualized = float(wealth[-1] ** (1.0 / years) - 1.0) if years >= 1 and wealth[-1] > 0 else None
+
+        first_value = series.total_value[0]
+        period_return = (series.total_value[-1] - first_value) / first_value * 100 if first_value > 0 else 0.0
+
+        metrics = {
+            "period_return": round(float(period_return), 2),
+            "time_weighted_return": round(twr * 100, 4),
+            "time_weighted_return_annualized": (
+                round(twr_annualized * 100, 4) if twr_annualized is not None else None
+            ),
+            "money_weighted_return": None,
+            "volatility": 0.0,
+            "annualized_volatility": 0.0,
+            "rolling_volatility": None,
+            "sharpe_ratio": None,
+            "sortino_ratio": None,
+            "best_day": None,
+            "worst_day": None,
+            "drawdown": PerformanceAnalytics.max_drawdown(series.dates, wealth),
+            "benchmark": None,
+            "number_of_days": len(series),
+        }
+
+        mwr = PerformanceAnalytics.money_weighted_return(series)
+        if mwr is not None:
+            metrics["money_weighted_return"] = round(mwr * 100, 4)
+
+        if len(returns) == 0:
+            return metrics
+
+        best, worst = int(np.argmax(returns)), int(np.argmin(returns))
+        metrics["best_day"] = {"date": str(series.dates[best + 1]), "return_percent": round(float(returns[best] * 100), 2)}
+        metrics["worst_day"] = {"date": str(series.dates[worst + 1]), "return_percent": round(float(returns[worst] * 100), 2)}
+
+        if len(returns) >= 2:
+            daily_std = float(np.std(returns, ddof=1))
+            metrics["volatility"] = round(daily_std * 100, 4)
+            metrics["annualized_volatility"] = round(float(daily_std * annualization * 100), 4)
+
+            excess = returns - risk_free_rate / periods
+            if daily_std > 0:
+                metrics["sharpe_ratio"] = round(float(np.mean(excess) / daily_std * annualization), 4)
+
+            downside = np.minimum(excess, 0.0)
+            downside_dev = float(np.sqrt(np.mean(downside ** 2)))
+            if downside_dev > 0:
+                metrics["sortino_ratio"] = round(float(np.mean(excess) / downside_dev * annualization), 4)
+
+        rolling = PerformanceAnalytics.rolling_std(returns, rolling_window) * annualization * 100
+        if len(rolling):
+            metrics["rolling_volatility"] = {
+                "window": rolling_window,
+                "current": round(float(rolling[-1]), 4),
+                "min": round(float(rolling.min()), 4),
+                "max": round(float(rolling.max()), 4),
+                "mean": round(float(rolling.mean()), 4)
+            }
+
+        if benchmark is not None:
+            metrics["benchmark"] = PerformanceAnalytics.beta(series.dates, wealth, benchmark)
+
+        return metrics
+
+
+# Global instance
+performance_analytics = PerformanceAnalytics()
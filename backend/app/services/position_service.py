@@ -1,27 +1,108 @@
 from sqlalchemy.orm import Session
-from sqlalchemy import select, and_
+from sqlalchemy import select, and_, delete, insert, update
 from uuid import UUID
-from typing import List
+from typing import Dict, Iterable, List, Optional, Tuple
+import uuid
+from datetime import datetime, timezone
 from decimal import Decimal, getcontext
 
-from app.models.position import Position
+from app.models.position import Position, PositionLedger
 from app.models.transaction import Transaction
 from app.models.asset import Asset
 
 # Configurar precisión de Decimal si es necesario, por defecto es suficiente (28 dígitos)
 # getcontext().prec = 28
 
+# Cantidades por debajo de este umbral se consideran cero (residuos de redondeo)
+QUANTITY_EPSILON = Decimal('1e-9')
+
+# Tolerancia relativa al comparar el ledger con un recálculo completo
+CONSISTENCY_TOLERANCE = Decimal('1e-9')
+
+
+def _as_utc(value: Optional[datetime]) -> Optional[datetime]:
+    """Normalizar fechas naive (se asumen UTC) para poder compararlas"""
+    if value is not None and value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value
+
+
 class PositionService:
     def __init__(self, db: Session):
         self.db = db
 
-    def recalculate_position(self, portfolio_id: UUID, asset_id: UUID) -> Position:
+    @staticmethod
+    def _apply(
+        quantity: Decimal,
+        total_cost: Decimal,
+        transaction_type,
+        tx_quantity: float,
+        tx_price: float
+    ) -> Tuple[Decimal, Decimal]:
         """
-        Recalcula una posición desde cero basándose en todas las transacciones.
-        Usa Decimal para evitar errores de punto flotante.
+        Aplicar una transacción al estado (cantidad, coste total)
+
+        Es el único paso de cálculo: lo usan tanto el recálculo completo como
+        el mantenimiento incremental, de modo que ambos dan el mismo resultado.
         """
-        # 1. Obtener todas las transacciones para este asset y portfolio
-        transactions = self.db.scalars(
+        # Convertir a string primero para preservar precisión al crear Decimal
+        tx_qty = Decimal(str(tx_quantity))
+        tx_price = Decimal(str(tx_price))
+
+        if transaction_type in ["buy", "deposit"]:
+            # Compra: Aumenta cantidad y costo total
+            quantity += tx_qty
+            total_cost += (tx_qty * tx_price)
+
+        elif transaction_type in ["sell", "withdrawal"]:
+            # Venta: Disminuye cantidad
+            if quantity > Decimal('0'):
+                # Reducir costo total proporcionalmente a la cantidad vendida
+                # cost_of_sold = (tx_qty / quantity) * total_cost
+                # total_cost -= cost_of_sold
+
+                # Simplificación matemática:
+                # Nuevo total_cost = total_cost * (1 - tx_qty/quantity)
+                #                  = total_cost * ((quantity - tx_qty) / quantity)
+                remaining_ratio = (quantity - tx_qty) / quantity
+                total_cost = total_cost * remaining_ratio
+
+                quantity -= tx_qty
+            else:
+                # Venta en corto o error de datos
+                quantity -= tx_qty
+
+        if quantity <= Decimal('0'):
+            total_cost = Decimal('0.0')
+
+        return quantity, total_cost
+
+    @staticmethod
+    def _replay(transactions) -> Tuple[Decimal, Decimal]:
+        """Recorrer transacciones ya ordenadas y devolver (cantidad, coste total)"""
+        quantity = Decimal('0.0')
+        total_cost = Decimal('0.0')
+        for tx in transactions:
+            quantity, total_cost = PositionService._apply(
+                quantity, total_cost, tx.transaction_type, tx.quantity, tx.price
+            )
+        return quantity, total_cost
+
+    @staticmethod
+    def _position_values(quantity: Decimal, total_cost: Decimal) -> Tuple[Decimal, Decimal]:
+        """(cantidad, precio medio) a guardar en Position a partir del estado acumulado"""
+        # Validar cercanía a cero (epsilon check)
+        # Si la cantidad es muy pequeña (ej. < 1e-9), asumimos 0 para limpiar residuos
+        if abs(quantity) < QUANTITY_EPSILON:
+            return Decimal('0.0'), Decimal('0.0')
+        if quantity > Decimal('0'):
+            return quantity, total_cost / quantity
+        return quantity, Decimal('0.0')
+
+    def _ordered_transactions(self, portfolio_id: UUID, asset_id: UUID) -> List[Transaction]:
+        # Orden cronológico es importante para promedio ponderado; el id
+        # desempata transacciones con la misma fecha de forma estable
+        return self.db.scalars(
             select(Transaction)
             .where(
                 and_(
@@ -29,57 +110,31 @@ class PositionService:
                     Transaction.asset_id == asset_id
                 )
             )
-            .order_by(Transaction.transaction_date.asc()) # Orden cronológico es importante para promedio ponderado
+            .order_by(Transaction.transaction_date.asc(), Transaction.id.asc())
         ).all()
 
-        # 2. Calcular cantidad y precio promedio usando Decimal
-        quantity = Decimal('0.0')
-        total_cost = Decimal('0.0')
-        average_price = Decimal('0.0')
-
-        for tx in transactions:
-            # Convertir a string primero para preservar precisión al crear Decimal
-            tx_qty = Decimal(str(tx.quantity))
-            tx_price = Decimal(str(tx.price))
-            
-            if tx.transaction_type in ["buy", "deposit"]:
-                # Compra: Aumenta cantidad y costo total
-                quantity += tx_qty
-                total_cost += (tx_qty * tx_price)
-            
-            elif tx.transaction_type in ["sell", "withdrawal"]:
-                # Venta: Disminuye cantidad
-                if quantity > Decimal('0'):
-                    # Reducir costo total proporcionalmente a la cantidad vendida
-                    # cost_of_sold = (tx_qty / quantity) * total_cost
-                    # total_cost -= cost_of_sold
-                    
-                    # Simplificación matemática:
-                    # Nuevo total_cost = total_cost * (1 - tx_qty/quantity)
-                    #                  = total_cost * ((quantity - tx_qty) / quantity)
-                    remaining_ratio = (quantity - tx_qty) / quantity
-                    total_cost = total_cost * remaining_ratio
-                    
-                    quantity -= tx_qty
-                else:
-                    # Venta en corto o error de datos
-                    quantity -= tx_qty
-            
-            # Recalcular precio promedio
-            if quantity > Decimal('0'):
-                average_price = total_cost / quantity
-            else:
-                average_price = Decimal('0.0')
-                total_cost = Decimal('0.0')
+    def _get_ledger(self, portfolio_id: UUID, asset_id: UUID, for_update: bool = False) -> Optional[PositionLedger]:
+        stmt = select(PositionLedger).where(
+            and_(
+                PositionLedger.portfolio_id == portfolio_id,
+                PositionLedger.asset_id == asset_id
+            )
+        )
+        if for_update:
+            # Serializar actualizaciones concurrentes de la misma posición
+            stmt = stmt.with_for_update()
+        return self.db.scalars(stmt).first()
 
-        # 3. Validar cercanía a cero (epsilon check)
-        # Si la cantidad es muy pequeña (ej. < 1e-9), asumimos 0 para limpiar residuos
-        if abs(quantity) < Decimal('1e-9'):
-            quantity = Decimal('0.0')
-            total_cost = Decimal('0.0')
-            average_price = Decimal('0.0')
+    def _save_position(
+        self,
+        portfolio_id: UUID,
+        asset_id: UUID,
+        quantity: Decimal,
+        total_cost: Decimal
+    ) -> Optional[Position]:
+        """Materializar el estado acumulado en la tabla positions"""
+        quantity, average_price = self._position_values(quantity, total_cost)
 
-        # 4. Actualizar o crear la posición en BD
         position = self.db.scalars(
             select(Position).where(
                 and_(
@@ -89,28 +144,274 @@ class PositionService:
             )
         ).first()
 
-        if quantity == Decimal('0') and position:
-            # Si la cantidad es 0, eliminamos la posición
-            self.db.delete(position)
+        if quantity == Decimal('0'):
+            if position:
+                # Si la cantidad es 0, eliminamos la posición
+                self.db.delete(position)
+                self.db.flush()
             return None
-        
-        if quantity != Decimal('0'):
-            if not position:
-                position = Position(
-                    portfolio_id=portfolio_id,
-                    asset_id=asset_id
-                )
-                self.db.add(position)
-            
-            # Convertir de vuelta a float para la BD
-            position.quantity = float(quantity)
-            position.average_price = float(average_price)
-            
-            # Asegurar que se guarde
-            self.db.flush()
-            
+
+        if not position:
+            position = Position(
+                portfolio_id=portfolio_id,
+                asset_id=asset_id
+            )
+            self.db.add(position)
+
+        # Convertir de vuelta a float para la BD
+        position.quantity = float(quantity)
+        position.average_price = float(average_price)
+
+        # Asegurar que se guarde
+        self.db.flush()
         return position
 
+    def recalculate_position(self, portfolio_id: UUID, asset_id: UUID) -> Position:
+        """
+        Recalcula una posición desde cero basándose en todas las transacciones.
+        Usa Decimal para evitar errores de punto flotante.
+
+        También reconstruye el ledger incremental de la posición.
+        """
+        ledger = self._get_ledger(portfolio_id, asset_id, for_update=True)
+        transactions = self._ordered_transactions(portfolio_id, asset_id)
+        quantity, total_cost = self._replay(transactions)
+
+        if not transactions:
+            if ledger:
+                self.db.delete(ledger)
+        else:
+            if not ledger:
+                ledger = PositionLedger(portfolio_id=portfolio_id, asset_id=asset_id)
+                self.db.add(ledger)
+            last = transactions[-1]
+            ledger.quantity = quantity
+            ledger.total_cost = total_cost
+            ledger.last_transaction_date = last.transaction_date
+            ledger.last_transaction_id = last.id
+            ledger.transaction_count = len(transactions)
+
+        return self._save_position(portfolio_id, asset_id, quantity, total_cost)
+
+    def rebuild_positions(
+        self,
+        portfolio_id: UUID,
+        asset_ids: Optional[Iterable[UUID]] = None
+    ) -> Dict[str, int]:
+        """
+        Recalcular todas las posiciones (y ledgers) de un portfolio en bloque
+
+        Lee todas las transacciones con una consulta ordenada, calcula las
+        posiciones en memoria en una sola pasada y aplica altas, cambios y
+        bajas en `positions` con una sentencia por fase.
+
+        Args:
+            portfolio_id: ID del portfolio
+            asset_ids: Limitar el recálculo a estos activos (opcional)
+
+        Returns:
+            Dict con assets (activos procesados), created, updated y deleted
+        """
+        # Cambios pendientes visibles para las consultas (la sesión no hace autoflush)
+        self.db.flush()
+
+        tx_stmt = select(
+            Transaction.id,
+            Transaction.asset_id,
+            Transaction.transaction_date,
+            Transaction.transaction_type,
+            Transaction.quantity,
+            Transaction.price
+        ).where(Transaction.portfolio_id == portfolio_id)
+        position_stmt = select(Position.id, Position.asset_id).where(Position.portfolio_id == portfolio_id)
+        ledger_delete = delete(PositionLedger).where(PositionLedger.portfolio_id == portfolio_id)
+
+        if asset_ids is not None:
+            asset_ids = list(set(asset_ids))
+            if not asset_ids:
+                return {"assets": 0, "created": 0, "updated": 0, "deleted": 0}
+            tx_stmt = tx_stmt.where(Transaction.asset_id.in_(asset_ids))
+            position_stmt = position_stmt.where(Position.asset_id.in_(asset_ids))
+            ledger_delete = ledger_delete.where(PositionLedger.asset_id.in_(asset_ids))
+
+        # 1. Una pasada sobre todas las transacciones (mismo orden que el recálculo individual)
+        states: Dict[UUID, list] = {}  # asset_id -> [cantidad, coste, última tx, nº tx]
+        for tx in self.db.execute(
+            tx_stmt.order_by(Transaction.transaction_date.asc(), Transaction.id.asc())
+        ):
+            state = states.get(tx.asset_id)
+            if state is None:
+                state = states[tx.asset_id] = [Decimal('0.0'), Decimal('0.0'), None, 0]
+            state[0], state[1] = self._apply(state[0], state[1], tx.transaction_type, tx.quantity, tx.price)
+            state[2] = tx
+            state[3] += 1
+
+        existing = {row.asset_id: row.id for row in self.db.execute(position_stmt)}
+
+        # 2. Ledgers: se sustituyen en bloque
+        self.db.execute(ledger_delete)
+        ledger_rows = [
+            {
+                "portfolio_id": portfolio_id,
+                "asset_id": asset_id,
+                "quantity": quantity,
+                "total_cost": total_cost,
+                "last_transaction_date": last_tx.transaction_date,
+                "last_transaction_id": last_tx.id,
+                "transaction_count": count
+            }
+            for asset_id, (quantity, total_cost, last_tx, count) in states.items()
+        ]
+        if ledger_rows:
+            self.db.execute(insert(PositionLedger), ledger_rows)
+
+        # 3. Posiciones: altas, cambios y bajas
+        to_insert, to_update = [], []
+        for asset_id, (quantity, total_cost, _, _) in states.items():
+            quantity, average_price = self._position_values(quantity, total_cost)
+            if quantity == Decimal('0'):
+                continue
+            values = {"quantity": float(quantity), "average_price": float(average_price)}
+            if asset_id in existing:
+                to_update.append({"id": existing[asset_id], **values})
+            else:
+                to_insert.append({"id": uuid.uuid4(), "portfolio_id": portfolio_id, "asset_id": asset_id, **values})
+
+        kept = {row["id"] for row in to_update}
+        to_delete = [position_id for position_id in existing.values() if position_id not in kept]
+
+        if to_update:
+            self.db.execute(update(Position), to_update)
+        if to_insert:
+            self.db.execute(insert(Position), to_insert)
+        if to_delete:
+            self.db.execute(delete(Position).where(Position.id.in_(to_delete)))
+
+        # Las sentencias en bloque no pasan por el identity map
+        self.db.expire_all()
+
+        return {
+            "assets": len(set(states) | set(existing)),
+            "created": len(to_insert),
+            "updated": len(to_update),
+            "deleted": len(to_delete)
+        }
+
+    def apply_transaction(self, transaction: Transaction) -> Optional[Position]:
+        """
+        Actualizar la posición tras añadir una transacción
+
+        Si la transacción es posterior a la última aplicada en el ledger se
+        aplica en O(1) sobre el estado acumulado; si es retroactiva (o no hay
+        ledger todavía) se recalcula la posición completa.
+
+        La transacción debe estar ya en la sesión (flush hecho).
+        """
+        portfolio_id = transaction.portfolio_id
+        asset_id = transaction.asset_id
+        ledger = self._get_ledger(portfolio_id, asset_id, for_update=True)
+
+        if ledger is None or ledger.last_transaction_date is None:
+            return self.recalculate_position(portfolio_id, asset_id)
+
+        # Mismo criterio de orden que el recálculo: (fecha, id)
+        new_key = (_as_utc(transaction.transaction_date), str(transaction.id))
+        last_key = (_as_utc(ledger.last_transaction_date), str(ledger.last_transaction_id))
+        if new_key <= last_key:
+            return self.recalculate_position(portfolio_id, asset_id)
+
+        quantity, total_cost = self._apply(
+            Decimal(ledger.quantity),
+            Decimal(ledger.total_cost),
+            transaction.transaction_type,
+            transaction.quantity,
+            transaction.price
+        )
+        ledger.quantity = quantity
+        ledger.total_cost = total_cost
+        ledger.last_transaction_date = transaction.transaction_date
+        ledger.last_transaction_id = transaction.id
+        ledger.transaction_count += 1
+
+        return self._save_position(portfolio_id, asset_id, quantity, total_cost)
+
+    def check_consistency(self, portfolio_id: UUID, asset_id: Optional[UUID] = None) -> Dict:
+        """
+        Comparar el ledger y las posiciones guardadas con un recálculo completo
+
+        No modifica nada; sirve para detectar derivas del modo incremental.
+
+        Args:
+            portfolio_id: ID del portfolio
+            asset_id: Limitar la comprobación a un activo (opcional)
+
+        Returns:
+            Dict con checked, consistent e issues (una entrada por activo con
+            discrepancias: valores esperados y guardados)
+        """
+        tx_stmt = select(Transaction).where(Transaction.portfolio_id == portfolio_id)
+        ledger_stmt = select(PositionLedger).where(PositionLedger.portfolio_id == portfolio_id)
+        position_stmt = select(Position).where(Position.portfolio_id == portfolio_id)
+        if asset_id is not None:
+            tx_stmt = tx_stmt.where(Transaction.asset_id == asset_id)
+            ledger_stmt = ledger_stmt.where(PositionLedger.asset_id == asset_id)
+            position_stmt = position_stmt.where(Position.asset_id == asset_id)
+
+        transactions_by_asset: Dict[UUID, List[Transaction]] = {}
+        for tx in self.db.scalars(
+            tx_stmt.order_by(Transaction.transaction_date.asc(), Transaction.id.asc())
+        ):
+            transactions_by_asset.setdefault(tx.asset_id, []).append(tx)
+        ledgers = {ledger.asset_id: ledger for ledger in self.db.scalars(ledger_stmt)}
+        positions = {position.asset_id: position for position in self.db.scalars(position_stmt)}
+
+        def differs(expected: Decimal, actual) -> bool:
+            actual = Decimal(str(actual))
+            scale = max(abs(expected), Decimal('1'))
+            return abs(expected - actual) > CONSISTENCY_TOLERANCE * scale
+
+        issues = []
+        asset_ids = set(transactions_by_asset) | set(ledgers) | set(positions)
+        for current_asset_id in asset_ids:
+            quantity, total_cost = self._replay(transactions_by_asset.get(current_asset_id, []))
+            expected_quantity, expected_price = self._position_values(quantity, total_cost)
+            ledger = ledgers.get(current_asset_id)
+            position = positions.get(current_asset_id)
+            problems = []
+
+            if transactions_by_asset.get(current_asset_id):
+                if ledger is None:
+                    problems.append("missing_ledger")
+                elif differs(quantity, ledger.quantity) or differs(total_cost, ledger.total_cost):
+                    problems.append("ledger_mismatch")
+            elif ledger is not None:
+                problems.append("orphan_ledger")
+
+            if expected_quantity == Decimal('0'):
+                if position is not None:
+                    problems.append("unexpected_position")
+            elif position is None:
+                problems.append("missing_position")
+            elif differs(expected_quantity, position.quantity) or differs(expected_price, position.average_price):
+                problems.append("position_mismatch")
+
+            if problems:
+                issues.append({
+                    "asset_id": current_asset_id,
+                    "problems": problems,
+                    "expected_quantity": float(expected_quantity),
+                    "expected_average_price": float(expected_price),
+                    "ledger_quantity": float(ledger.quantity) if ledger else None,
+                    "position_quantity": position.quantity if position else None,
+                    "position_average_price": position.average_price if position else None
+                })
+
+        return {
+            "checked": len(asset_ids),
+            "consistent": not issues,
+            "issues": issues
+        }
+
     def update_position_from_transaction(self, transaction: Transaction):
         """Wrapper conveniente para actualizar posición tras una transacción"""
-        return self.recalculate_position(transaction.portfolio_id, transaction.asset_id)
+        return self.apply_transaction(transaction)
@@ -0,0 +1,145 @@
+"""
+Resolución masiva de precios "as-of" a partir de la tabla de cotizaciones
+
+Para cada par (activo, fecha) devuelve la última cotización con fecha
+menor o igual a la fecha objetivo, resolviendo todos los pares en una
+única consulta (LATERAL JOIN sobre idx_quote_asset_timestamp).
+"""
+from datetime import date, timedelta
+from decimal import Decimal
+from typing import Dict, Iterable, Optional
+from uuid import UUID
+
+from sqlalchemy import Date, column, select, true, values
+from sqlalchemy.dialects.postgresql import UUID as PG_UUID
+from sqlalchemy.engine import Row
+from sqlalchemy.orm import Session
+
+from app.models.quote import Quote
+
+
+class PriceResolver:
+    """Resolución de precios históricos en bloque"""
+
+    @staticmethod
+    def get_quotes_as_of_dates(
+        db: Session,
+        asset_ids: Iterable[UUID],
+        target_dates: Iterable[date]
+    ) -> Dict[date, Dict[UUID, Row]]:
+        """
+        Obtener la última cotización de cada activo para cada fecha objetivo
+
+        Args:
+            db: Sesión de base de datos
+            asset_ids: IDs de los activos
+            target_dates: Fechas objetivo
+
+        Returns:
+            {fecha: {asset_id: fila(asset_id, timestamp, open, close)}}.
+            Los activos sin cotización previa a la fecha no aparecen.
+        """
+        asset_ids = set(asset_ids)
+        target_dates = set(target_dates)
+        if not asset_ids or not target_dates:
+            return {}
+
+        target_assets = values(
+            column("asset_id", PG_UUID(as_uuid=True)), name="target_assets"
+        ).data([(asset_id,) for asset_id in asset_ids])
+        target_days = values(
+            column("day", Date), name="target_days"
+        ).data([(target_date,) for target_date in target_dates])
+
+        # Para cada (activo, día): última cotización antes del día siguiente.
+        # Comparar el timestamp directamente (sin func.date) permite usar
+        # idx_quote_asset_timestamp con un scan inverso + LIMIT 1.
+        latest_quote = (
+            select(Quote.timestamp, Quote.open, Quote.close)
+            .where(
+                Quote.asset_id == target_assets.c.asset_id,
+                Quote.timestamp < target_days.c.day + 1
+            )
+            .order_by(Quote.timestamp.desc())
+            .limit(1)
+            .lateral("latest_quote")
+        )
+
+        rows = db.execute(
+            select(
+                target_days.c.day,
+                target_assets.c.asset_id,
+                latest_quote.c.timestamp,
+                latest_quote.c.open,
+                latest_quote.c.close
+            )
+            .select_from(target_days)
+            .join(target_assets, true())
+            .join(latest_quote, true())
+        ).all()
+
+        quotes: Dict[date, Dict[UUID, Row]] = {}
+        for row in rows:
+            quotes.setdefault(row.day, {})[row.asset_id] = row
+        return quotes
+
+    @staticmethod
+    def get_quotes_as_of(
+        db: Session,
+        asset_ids: Iterable[UUID],
+        target_date: Optional[date] = None
+    ) -> Dict[UUID, Row]:
+        """
+        Obtener la última cotización de cada activo hasta una fecha
+
+        Args:
+            db: Sesión de base de datos
+            asset_ids: IDs de los activos
+            target_date: Fecha objetivo (None = última disponible)
+
+        Returns:
+            {asset_id: fila(asset_id, timestamp, open, close)}
+        """
+        if target_date is None:
+            # Sin límite superior: cualquier fecha futura razonable sirve
+            target_date = date.max - timedelta(days=1)
+        return PriceResolver.get_quotes_as_of_dates(db, asset_ids, [target_date]).get(target_date, {})
+
+    @staticmethod
+    def get_prices_as_of_dates(
+        db: Session,
+        asset_ids: Iterable[UUID],
+        target_dates: Iterable[date]
+    ) -> Dict[date, Dict[UUID, Decimal]]:
+        """
+        Obtener el precio de cierre de cada activo para cada fecha objetivo
+
+        Returns:
+            {fecha: {asset_id: close}}
+        """
+        quotes = PriceResolver.get_quotes_as_of_dates(db, asset_ids, target_dates)
+        return {
+            day: {asset_id: Decimal(str(row.close)) for asset_id, row in day_quotes.items()}
+            for day, day_quotes in quotes.items()
+        }
+
+    @staticmethod
+    def get_prices_as_of(
+        db: Session,
+        asset_ids: Iterable[UUID],
+        target_date: Optional[date] = None
+    ) -> Dict[UUID, Decimal]:
+        """
+        Obtener el precio de cierre de cada activo hasta una fecha
+
+        Returns:
+            {asset_id: close}
+        """
+        return {
+            asset_id: Decimal(str(row.close))
+            for asset_id, row in PriceResolver.get_quotes_as_of(db, asset_ids, target_date).items()
+        }
+
+
+# Instancia global
+price_resolver = PriceResolver()
@@ -0,0 +1,195 @@
+"""
+Actualización concurrente de cotizaciones en tiempo real
+
+Descarga la última cotización de todos los activos desde Finnhub al ritmo
+máximo permitido por FINNHUB_RATE_LIMIT (token bucket de FinnhubService,
+compartido entre procesos en Redis) con concurrencia
+acotada. Las peticiones HTTP son asíncronas sobre el cliente httpx compartido de
+FinnhubService y el acceso a la base de datos se ejecuta en hilos, de modo que una
+actualización completa nunca bloquea el event loop de la API.
+"""
+import asyncio
+import logging
+import time
+from datetime import datetime
+from typing import Dict, Optional, Tuple
+
+from app.core.config import settings
+from app.core.database import SessionLocal
+from app.models.asset import Asset
+from app.services.finnhub_service import FinnhubService, finnhub_service
+from app.services.quote_service import QuoteService
+
+logger = logging.getLogger(__name__)
+
+
+class QuoteRefresher:
+    """
+    Motor de actualización masiva de cotizaciones en tiempo real
+
+    Una sola ejecución activa a la vez: las llamadas concurrentes (scheduler y
+    endpoint manual) esperan el resultado de la ejecución en curso en lugar de
+    duplicar el consumo de cuota.
+    """
+
+    # Timeout por petición (más holgado que el de las consultas interactivas)
+    REQUEST_TIMEOUT_SECONDS = 5.0
+
+    def __init__(self):
+        self.concurrency = settings.QUOTE_REFRESH_CONCURRENCY
+        self.batch_size = settings.QUOTE_REFRESH_BATCH_SIZE
+        self._current_run: Optional[asyncio.Task] = None
+
+    @staticmethod
+    def _load_assets() -> Dict[str, str]:
+        """{símbolo: asset_type} de todos los activos (se ejecuta en un hilo)"""
+        db = SessionLocal()
+        try:
+            return dict(db.query(Asset.symbol, Asset.asset_type).all())
+        finally:
+            db.close()
+
+    @staticmethod
+    def _persist(quotes: Dict[str, Dict]) -> Dict[str, Dict]:
+        """Guardar un lote de cotizaciones (se ejecuta en un hilo)"""
+        db = SessionLocal()
+        try:
+            return QuoteService(db).save_realtime_quotes(quotes)
+        finally:
+            db.close()
+
+    async def _fetch_quote(self, api_symbol: str, service: FinnhubService) -> Dict:
+        """
+        Obtener la cotización de un símbolo de Finnhub respetando el rate limit
+
+        Reintenta las respuestas 429 con backoff exponencial
+        (FINNHUB_RETRY_ATTEMPTS / FINNHUB_BACKOFF_FACTOR).
+        """
+        attempts = max(1, settings.FINNHUB_RETRY_ATTEMPTS)
+
+        for attempt in range(attempts):
+            await service.rate_limiter.acquire()
+            response = await service.get_client().get(
+                "/quote",
+                params={"symbol": api_symbol, "token": settings.FINNHUB_API_KEY},
+                timeout=self.REQUEST_TIMEOUT_SECONDS
+            )
+            if response.status_code == 429 and attempt + 1 < attempts:
+                await asyncio.sleep(settings.FINNHUB_BACKOFF_FACTOR ** attempt)
+                continue
+            response.raise_for_status()
+            return response.json()
+
+    async def _flush(self, quotes: Dict[str, Dict], stats: Dict):
+        """Persistir un lote y acumular el resultado en stats"""
+        try:
+            results = await asyncio.to_thread(self._persist, quotes)
+        except Exception as e:
+            logger.error(f"Error guardando lote de {len(quotes)} cotizaciones: {e}")
+            results = {
+                symbol: {"success": False, "error": str(e), "ticker": symbol}
+                for symbol in quotes
+            }
+
+        for symbol, result in results.items():
+            if result.get("success"):
+                stats["updated"] += 1
+                logger.debug(f"Actualizado {symbol}: ${result.get('price')}")
+            else:
+                stats["failed"] += 1
+                stats["errors"].append({"symbol": symbol, "error": result.get("error", "Unknown error")})
+
+    async def _refresh_all(self) -> Dict:
+        assets = await asyncio.to_thread(self._load_assets)
+        return await self.refresh_assets(assets)
+
+    async def refresh_assets(
+        self,
+        assets: Dict[str, str],
+        service: Optional[FinnhubService] = None
+    ) -> Dict:
+        """
+        Actualizar la cotización en tiempo real de una lista de activos
+
+        Los símbolos se traducen al formato de Finnhub según su tipo (crypto
+        como BINANCE:XUSDT); cash y los tipos sin cotización en Finnhub se
+        omiten. Cada precio obtenido se guarda también en la cache de precios
+        y se invalida en el resto de procesos.
+
+        Args:
+            assets: {símbolo: asset_type}
+            service: FinnhubService a usar (cliente HTTP, cuota y cache); por
+                defecto la instancia global del proceso
+
+        Returns:
+            Dict con total_assets, updated, failed, skipped, errors
+            ({symbol, error}), duration_seconds y timestamp
+        """
+        started = time.monotonic()
+        service = service or finnhub_service
+        stats = {"total_assets": len(assets), "updated": 0, "failed": 0, "skipped": 0, "errors": []}
+
+        lookups: Dict[str, Tuple[str, str]] = {}  # símbolo -> (clave de cache, símbolo Finnhub)
+        for symbol, asset_type in assets.items():
+            lookup = FinnhubService._lookup_for(symbol, asset_type)
+            if lookup is None:
+                stats["skipped"] += 1
+            else:
+                lookups[symbol] = lookup
+
+        if lookups:
+            semaphore = asyncio.Semaphore(self.concurrency)
+
+            async def fetch(symbol: str, api_symbol: str):
+                async with semaphore:
+                    try:
+                        return symbol, await self._fetch_quote(api_symbol, service), None
+                    except Exception as e:
+                        return symbol, None, str(e) or type(e).__name__
+
+            # Persistir por lotes a medida que llegan las respuestas
+            pending: Dict[str, Dict] = {}
+            fetches = [fetch(symbol, api_symbol) for symbol, (_, api_symbol) in lookups.items()]
+            for next_result in asyncio.as_completed(fetches):
+                symbol, quote_data, error = await next_result
+                if not error and not (quote_data or {}).get("c"):
+                    # Finnhub responde c=0 a los símbolos que no conoce
+                    error = "No quote available"
+                if error:
+                    stats["failed"] += 1
+                    stats["errors"].append({"symbol": symbol, "error": error})
+                    continue
+
+                pending[symbol] = quote_data
+                try:
+                    await service.cache_quote(symbol, lookups[symbol][0], quote_data)
+                except Exception as e:
+                    logger.warning(f"No se pudo cachear el precio de {symbol}: {e}")
+
+                if len(pending) >= self.batch_size:
+                    await self._flush(pending, stats)
+                    pending = {}
+
+            if pending:
+                await self._flush(pending, stats)
+
+        stats["duration_seconds"] = round(time.monotonic() - started, 2)
+        stats["timestamp"] = datetime.utcnow().isoformat()
+        return stats
+
+    async def refresh_all(self) -> Dict:
+        """
+        Actualizar la cotización en tiempo real de todos los activos
+
+        Returns:
+            Dict con total_assets, updated, failed, errors
+            ({symbol, error}), duration_seconds y timestamp
+        """
+        if self._current_run is None or self._current_run.done():
+            self._current_run = asyncio.create_task(self._refresh_all())
+        # shield: cancelar la petición que espera no aborta la actualización
+        return await asyncio.shield(self._current_run)
+
+
+# Instancia global
+quote_refresher = QuoteRefresher()
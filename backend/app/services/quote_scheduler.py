@@ -1,16 +1,13 @@
 """
 Scheduler automático para actualización de cotizaciones
 """
-import asyncio
 import logging
 from datetime import datetime, timedelta
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.interval import IntervalTrigger
 
 from app.core.config import settings
-from app.core.database import SessionLocal
-from app.models.asset import Asset
-from app.services.quote_service import QuoteService
+from app.services.quote_refresher import quote_refresher
 
 logger = logging.getLogger(__name__)
 
@@ -29,59 +26,28 @@ class QuoteScheduler:
         
     async def update_all_quotes_job(self):
         """Job para actualizar todas las cotizaciones"""
-        db = SessionLocal()
         try:
             logger.info("Iniciando actualización automática de cotizaciones")
             
-            # Obtener todos los activos
-            assets = db.query(Asset).all()
+            stats = await quote_refresher.refresh_all()
             
-            if not assets:
+            if not stats["total_assets"]:
                 logger.info("No hay activos para actualizar")
                 return
             
-            quote_service = QuoteService(db)
-            
-            updated = 0
-            failed = 0
-            errors = []
-            
-            for asset in assets:
-                try:
-                    result = quote_service.update_latest_quote_realtime(asset.symbol)
-                    
-                    if result and result.get("success"):
-                        updated += 1
-                        logger.debug(f"Actualizado {asset.symbol}: ${result.get('price')}")
-                    else:
-                        failed += 1
-                        error_msg = result.get("error", "Unknown error") if result else "No response"
-                        errors.append(f"{asset.symbol}: {error_msg}")
-                        logger.warning(f"Fallo al actualizar {asset.symbol}: {error_msg}")
-                    
-                    # Delay para respetar rate limits (60 llamadas/minuto = 1 por segundo)
-                    await asyncio.sleep(1.1)
-                    
-                except Exception as e:
-                    failed += 1
-                    error_msg = str(e)
-                    errors.append(f"{asset.symbol}: {error_msg}")
-                    logger.error(f"Error actualizando {asset.symbol}: {error_msg}")
-            
             logger.info(
-                f"Actualización completada: {updated} exitosas, {failed} fallidas "
-                f"de {len(assets)} activos totales"
+                f"Actualización completada: {stats['updated']} exitosas, {stats['failed']} fallidas "
+                f"de {stats['total_assets']} activos totales en {stats['duration_seconds']}s"
             )
             
+            errors = stats["errors"]
             if errors:
                 logger.warning(f"Errores encontrados: {len(errors)}")
                 for error in errors[:5]:  # Log solo los primeros 5
-                    logger.warning(f"  - {error}")
+                    logger.warning(f"  - {error['symbol']}: {error['error']}")
             
         except Exception as e:
             logger.error(f"Error en job de actualización: {str(e)}")
-        finally:
-            db.close()
     
     def start(self):
         """Iniciar el scheduler"""
@@ -5,10 +5,12 @@ Incluye importación desde Alpha Vantage y Finnhub
 from typing import Optional, Dict, List
 from datetime import date, datetime, timedelta
 from sqlalchemy.orm import Session
-from sqlalchemy import and_
+from sqlalchemy import and_, func, insert, literal_column, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 import finnhub
 import pandas as pd
 import logging
+import uuid
 from alpha_vantage.timeseries import TimeSeries
 from decimal import Decimal
 
@@ -21,6 +23,9 @@ from app.schemas.quote import QuoteCreate, QuoteBulkCreate, QuoteBulkResponse
 class QuoteService:
     """Servicio para gestión de cotizaciones"""
     
+    # Filas por sentencia INSERT ... ON CONFLICT en importaciones masivas
+    BULK_CHUNK_SIZE = 2000
+    
     def __init__(self, db: Session):
         self.db = db
         self.logger = logging.getLogger(__name__)
@@ -129,9 +134,22 @@ class QuoteService:
         
         return quote
     
+    def _get_asset_ids_by_symbols(self, symbols: List[str]) -> Dict[str, uuid.UUID]:
+        """Helper para resolver varios símbolos a asset_id en una sola consulta"""
+        symbols = {symbol.upper() for symbol in symbols if symbol}
+        if not symbols:
+            return {}
+        rows = self.db.query(Asset.symbol, Asset.id).filter(Asset.symbol.in_(symbols)).all()
+        return {symbol: asset_id for symbol, asset_id in rows}
+
     def bulk_import_quotes(self, bulk_data: QuoteBulkCreate) -> QuoteBulkResponse:
         """
         Importar cotizaciones en masa con manejo de duplicados
+        
+        Resuelve todos los símbolos en una consulta y escribe por bloques con
+        INSERT ... ON CONFLICT (asset_id, timestamp), con un commit por bloque.
+        Con skip_duplicates=True los existentes se actualizan; con False se
+        omiten y se reportan como error.
         """
         total = len(bulk_data.quotes)
         created = 0
@@ -139,40 +157,96 @@ class QuoteService:
         skipped = 0
         errors = []
         
+        asset_ids = self._get_asset_ids_by_symbols(
+            [q.symbol for q in bulk_data.quotes if not q.asset_id]
+        )
+        
+        # Construir filas (una por asset_id + timestamp; con skip_duplicates
+        # la última gana, sin él se conserva la primera)
+        now = datetime.utcnow()
+        rows: Dict[tuple, Dict] = {}
+        labels: Dict[tuple, str] = {}
         for quote_data in bulk_data.quotes:
-            try:
-                # Verificar si ya existe (usando la fecha del timestamp)
-                existing = self.get_quote_by_symbol_date(
-                    quote_data.symbol,
-                    quote_data.timestamp.date()
+            asset_id = quote_data.asset_id or asset_ids.get((quote_data.symbol or "").upper())
+            if not asset_id:
+                errors.append(
+                    f"Error en {quote_data.symbol} {quote_data.timestamp}: "
+                    f"No se encontró asset para el símbolo {quote_data.symbol}"
                 )
-                
-                if existing:
-                    if bulk_data.skip_duplicates:
-                        # Actualizar existente
-                        self.update_quote(str(existing.id), {
-                            'open': quote_data.open,
-                            'high': quote_data.high,
-                            'low': quote_data.low,
-                            'close': quote_data.close,
-                            'volume': quote_data.volume,
-                            'source': quote_data.source,
-                        })
-                        updated += 1
-                    else:
-                        # Reportar como error
-                        errors.append(
-                            f"Duplicado: {quote_data.symbol} en {quote_data.timestamp}"
-                        )
-                        skipped += 1
+                skipped += 1
+                continue
+            
+            key = (asset_id, quote_data.timestamp)
+            if key in rows:
+                # Duplicado dentro de la misma solicitud
+                if bulk_data.skip_duplicates:
+                    updated += 1
                 else:
-                    # Crear nuevo
-                    self.create_quote(quote_data)
-                    created += 1
-                    
+                    errors.append(f"Duplicado: {quote_data.symbol} en {quote_data.timestamp}")
+                    skipped += 1
+                    continue
+            
+            labels[key] = quote_data.symbol or str(asset_id)
+            rows[key] = {
+                "id": uuid.uuid4(),
+                "asset_id": asset_id,
+                "timestamp": quote_data.timestamp,
+                "open": quote_data.open,
+                "high": quote_data.high,
+                "low": quote_data.low,
+                "close": quote_data.close,
+                "volume": quote_data.volume,
+                "source": quote_data.source or "manual",
+                "created_at": now,
+                "updated_at": now,
+            }
+        
+        row_list = list(rows.values())
+        for start in range(0, len(row_list), self.BULK_CHUNK_SIZE):
+            chunk = row_list[start:start + self.BULK_CHUNK_SIZE]
+            stmt = pg_insert(Quote).values(chunk)
+            if bulk_data.skip_duplicates:
+                stmt = stmt.on_conflict_do_update(
+                    constraint="uq_quote_asset_timestamp",
+                    set_={
+                        "open": stmt.excluded.open,
+                        "high": stmt.excluded.high,
+                        "low": stmt.excluded.low,
+                        "close": stmt.excluded.close,
+                        "volume": func.coalesce(stmt.excluded.volume, Quote.volume),
+                        "source": func.coalesce(stmt.excluded.source, Quote.source),
+                        "updated_at": stmt.excluded.updated_at,
+                    }
+                )
+            else:
+                stmt = stmt.on_conflict_do_nothing(constraint="uq_quote_asset_timestamp")
+            # xmax = 0 solo en filas recién insertadas (no en las actualizadas)
+            stmt = stmt.returning(
+                Quote.id,
+                literal_column("(xmax = 0)").label("inserted")
+            )
+            
+            try:
+                returned = self.db.execute(stmt).all()
+                self.db.commit()
             except Exception as e:
-                errors.append(f"Error en {quote_data.symbol} {quote_data.timestamp}: {str(e)}")
-                skipped += 1
+                self.db.rollback()
+                errors.append(f"Error en bloque {start // self.BULK_CHUNK_SIZE + 1}: {str(e)}")
+                skipped += len(chunk)
+                continue
+            
+            chunk_created = sum(1 for row in returned if row.inserted)
+            created += chunk_created
+            updated += len(returned) - chunk_created
+            
+            if not bulk_data.skip_duplicates and len(returned) < len(chunk):
+                # Filas no insertadas por conflicto: reportar como duplicados
+                written = {row.id for row in returned}
+                for row in chunk:
+                    if row["id"] not in written:
+                        key = (row["asset_id"], row["timestamp"])
+                        errors.append(f"Duplicado: {labels[key]} en {row['timestamp']}")
+                        skipped += 1
         
         return QuoteBulkResponse(
             total=total,
@@ -370,69 +444,137 @@ class QuoteService:
             message=f"Importados {total_created} nuevos registros en {len(missing_ranges)} rangos"
         )
     
-    def update_latest_quote_realtime(self, symbol: str) -> Optional[Dict]:
+    def save_realtime_quotes(self, quotes: Dict[str, Dict]) -> Dict[str, Dict]:
         """
-        Actualizar con la última cotización en tiempo real desde Finnhub
+        Guardar en bloque cotizaciones en tiempo real de Finnhub
+
+        Actualiza la cotización del día si ya existe y crea el resto, y deja el
+        precio en Asset.last_price, con una consulta para resolver los activos,
+        otra para las cotizaciones de hoy, un UPDATE en bloque por tabla y un
+        único commit.
+
+        Args:
+            quotes: {símbolo: respuesta de /quote de Finnhub (c, o, h, l, ...)}
+
+        Returns:
+            {símbolo: resultado} con el formato de update_latest_quote_realtime
         """
-        try:
-            # Verificar asset
-            asset_id = self._get_asset_id_by_symbol(symbol)
+        timestamp = datetime.utcnow()
+        today = timestamp.date()
+        asset_ids = self._get_asset_ids_by_symbols(list(quotes))
+
+        results: Dict[str, Dict] = {}
+        values_by_asset: Dict[uuid.UUID, Dict] = {}
+        symbols_by_asset: Dict[uuid.UUID, List[str]] = {}
+
+        for symbol, quote_data in quotes.items():
+            asset_id = asset_ids.get(symbol.upper())
             if not asset_id:
-                 return {
+                results[symbol] = {
                     "success": False,
                     "error": f"Asset {symbol} no existe",
                     "ticker": symbol
                 }
+                continue
 
-            # Obtener quote en tiempo real
-            quote_data = self.finnhub_client.quote(symbol.upper())
-            
-            if not quote_data or quote_data.get('c') is None:
-                return {
+            # c=0 es la respuesta de Finnhub para símbolos sin cotización
+            if not quote_data or not quote_data.get('c'):
+                results[symbol] = {
                     "success": False,
                     "error": "No quote available",
                     "ticker": symbol
                 }
-            
-            today = datetime.utcnow().date()
-            timestamp = datetime.utcnow()
-            
-            quote_create = QuoteCreate(
-                symbol=symbol.upper(),
-                timestamp=timestamp,
-                open=Decimal(str(quote_data.get('o', quote_data['c']))),
-                high=Decimal(str(quote_data.get('h', quote_data['c']))),
-                low=Decimal(str(quote_data.get('l', quote_data['c']))),
-                close=Decimal(str(quote_data['c'])),
-                volume=None,
-                source="finnhub"
-            )
-            
-            # Verificar si ya existe para hoy
-            existing = self.get_quote_by_symbol_date(symbol.upper(), today)
-            
-            if existing:
-                # Actualizar
-                self.update_quote(str(existing.id), {
-                    'open': quote_create.open,
-                    'high': quote_create.high,
-                    'low': quote_create.low,
-                    'close': quote_create.close,
-                    'source': 'finnhub'
-                })
-                action = "updated"
-            else:
-                # Crear
-                self.create_quote(quote_create)
-                action = "created"
-            
-            return {
+                continue
+
+            values_by_asset[asset_id] = {
+                'open': Decimal(str(quote_data.get('o', quote_data['c']))),
+                'high': Decimal(str(quote_data.get('h', quote_data['c']))),
+                'low': Decimal(str(quote_data.get('l', quote_data['c']))),
+                'close': Decimal(str(quote_data['c'])),
+                'source': 'finnhub',
+                'updated_at': timestamp
+            }
+            symbols_by_asset.setdefault(asset_id, []).append(symbol)
+            results[symbol] = {
                 "success": True,
                 "ticker": symbol,
                 "price": quote_data['c'],
-                "action": action,
                 "timestamp": timestamp.isoformat()
             }
+
+        if not values_by_asset:
+            return results
+
+        # Cotizaciones ya existentes para hoy (se actualizan en lugar de duplicarse)
+        existing = dict(
+            self.db.query(Quote.asset_id, Quote.id).filter(
+                and_(
+                    Quote.asset_id.in_(values_by_asset.keys()),
+                    Quote.timestamp >= datetime.combine(today, datetime.min.time()),
+                    Quote.timestamp <= datetime.combine(today, datetime.max.time())
+                )
+            ).all()
+        )
+
+        updates = []
+        inserts = []
+        for asset_id, values in values_by_asset.items():
+            if asset_id in existing:
+                updates.append({'id': existing[asset_id], **values})
+                action = "updated"
+            else:
+                inserts.append({
+                    'id': uuid.uuid4(),
+                    'asset_id': asset_id,
+                    'timestamp': timestamp,
+                    'volume': None,
+                    'created_at': timestamp,
+                    **values
+                })
+                action = "created"
+            for symbol in symbols_by_asset[asset_id]:
+                results[symbol]["action"] = action
+
+        asset_prices = [
+            {
+                'id': asset_id,
+                'last_price': float(values['close']),
+                'last_price_updated_at': timestamp
+            }
+            for asset_id, values in values_by_asset.items()
+        ]
+
+        try:
+            if updates:
+                self.db.execute(update(Quote), updates)
+            if inserts:
+                self.db.execute(insert(Quote), inserts)
+            self.db.execute(update(Asset), asset_prices)
+            self.db.commit()
+        except Exception:
+            self.db.rollback()
+            raise
+
+        return results
+
+    def update_latest_quote_realtime(self, symbol: str) -> Optional[Dict]:
+        """
+        Actualizar con la última cotización en tiempo real desde Finnhub
+        """
+        try:
+            # Verificar asset
+            asset_id = self._get_asset_id_by_symbol(symbol)
+            if not asset_id:
+                 return {
+                    "success": False,
+                    "error": f"Asset {symbol} no existe",
+                    "ticker": symbol
+                }
+
+            # Obtener quote en tiempo real
+            quote_data = self.finnhub_client.quote(symbol.upper())
+
+            return self.save_realtime_quotes({symbol: quote_data})[symbol]
             
         except Exception as e:
             return {
@@ -7,8 +7,8 @@ from uuid import UUID
 from app.models.result import Result
 from app.models.portfolio import Portfolio
 from app.models.position import Position
-from app.models.quote import Quote
 from app.models.transaction import Transaction
+from app.services.price_resolver import price_resolver
 
 class ResultService:
     def __init__(self, db: Session):
@@ -33,22 +33,15 @@ class ResultService:
         total_invested = 0.0
         total_current_value = 0.0
 
+        # Precios hasta la fecha de cálculo para todas las posiciones en una sola consulta
+        prices = price_resolver.get_prices_as_of(
+            self.db, [pos.asset_id for pos in positions], calculation_date
+        )
+
         # 2. Calcular valor actual de cada posición
         for pos in positions:
-            # Obtener última cotización disponible hasta la fecha de cálculo
-            quote = self.db.scalars(
-                select(Quote)
-                .where(
-                    and_(
-                        Quote.symbol == pos.asset.symbol,
-                        Quote.date <= calculation_date
-                    )
-                )
-                .order_by(Quote.date.desc())
-                .limit(1)
-            ).first()
-
-            current_price = quote.close if quote else 0.0
+            # Última cotización disponible hasta la fecha de cálculo
+            current_price = float(prices[pos.asset_id]) if pos.asset_id in prices else 0.0
             
             # Costo base (promedio ponderado)
             invested = pos.quantity * pos.average_price
@@ -0,0 +1,288 @@
+"""
+Cola de recálculo de snapshots por portfolio
+
+Cada modificación de transacciones marca el portfolio como "sucio" desde la
+fecha editada. Las marcas se guardan en Redis y se fusionan: por portfolio se
+conserva solo la fecha más antigua, y el recálculo se ejecuta en un worker de
+Celery una vez transcurrido el periodo de debounce (cada nueva marca lo
+reinicia, hasta un máximo de SNAPSHOT_RECALC_MAX_DELAY_SECONDS desde la primera).
+Así, editar 20 transacciones seguidas produce un único recálculo desde la
+fecha más antigua hasta hoy, fuera de los procesos de la API.
+
+Si un recálculo falla, la marca se devuelve a la cola y se reintenta con
+backoff exponencial hasta SNAPSHOT_RECALC_MAX_ATTEMPTS veces seguidas; después
+la fecha queda pendiente (sin reintentos automáticos) hasta la siguiente
+modificación del portfolio.
+"""
+import logging
+import time
+import uuid
+from datetime import date
+from typing import Dict, Optional
+from uuid import UUID
+
+import redis
+
+from app.core.config import settings
+from app.core.database import SessionLocal
+
+logger = logging.getLogger(__name__)
+
+
+# Marca atómica: fecha más antigua, vencimiento con debounce acotado y
+# reserva del job programado. Devuelve 1 si hay que programar un job nuevo.
+_MARK_SCRIPT = """
+local current = redis.call('HGET', KEYS[1], ARGV[1])
+if (not current) or ARGV[2] < current then
+    redis.call('HSET', KEYS[1], ARGV[1], ARGV[2])
+end
+local now = tonumber(ARGV[3])
+local first = tonumber(redis.call('HGET', KEYS[3], ARGV[1]))
+if not first then
+    first = now
+    redis.call('HSET', KEYS[3], ARGV[1], ARGV[3])
+end
+local due = math.min(now + tonumber(ARGV[4]), first + tonumber(ARGV[5]))
+redis.call('HSET', KEYS[2], ARGV[1], tostring(due))
+if redis.call('SET', KEYS[4], '1', 'NX', 'EX', ARGV[6]) then
+    return 1
+end
+return 0
+"""
+
+# Retirar atómicamente la marca de un portfolio (devuelve la fecha o nil)
+_CLAIM_SCRIPT = """
+local current = redis.call('HGET', KEYS[1], ARGV[1])
+redis.call('HDEL', KEYS[1], ARGV[1])
+redis.call('HDEL', KEYS[2], ARGV[1])
+redis.call('HDEL', KEYS[3], ARGV[1])
+redis.call('DEL', KEYS[4])
+return current
+"""
+
+# Devolver la marca tras un recálculo fallido y contar el intento. Devuelve
+# el retraso del reintento, 0 si ya hay un job programado que la recogerá o
+# -1 si se agotaron los intentos (la fecha queda pendiente sin vencimiento).
+_RETRY_SCRIPT = """
+local current = redis.call('HGET', KEYS[1], ARGV[1])
+if (not current) or ARGV[2] < current then
+    redis.call('HSET', KEYS[1], ARGV[1], ARGV[2])
+end
+local attempts = redis.call('HINCRBY', KEYS[4], ARGV[1], 1)
+if attempts > tonumber(ARGV[5]) then
+    redis.call('HDEL', KEYS[2], ARGV[1])
+    return '-1'
+end
+local delay = tonumber(ARGV[4]) * 2 ^ (attempts - 1)
+redis.call('HSET', KEYS[2], ARGV[1], tostring(tonumber(ARGV[3]) + delay))
+if redis.call('SET', KEYS[3], '1', 'NX', 'EX', tonumber(ARGV[6]) + delay) then
+    return tostring(delay)
+end
+return '0'
+"""
+
+# Liberar el lock solo si sigue siendo nuestro
+_RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+class SnapshotRecalcQueue:
+    """Cola de recálculo de snapshots con fusión por portfolio y debounce"""
+
+    DIRTY_KEY = "snapshot_recalc:dirty"          # portfolio_id -> fecha más antigua (ISO)
+    DUE_KEY = "snapshot_recalc:due"              # portfolio_id -> epoch de ejecución
+    FIRST_KEY = "snapshot_recalc:first"          # portfolio_id -> epoch de la primera marca
+    ATTEMPTS_KEY = "snapshot_recalc:attempts"    # portfolio_id -> recálculos fallidos seguidos
+    SCHEDULED_PREFIX = "snapshot_recalc:scheduled:"
+    LOCK_PREFIX = "snapshot_recalc:lock:"
+
+    # Un recálculo no dura más que el time limit de Celery
+    LOCK_TTL_SECONDS = 30 * 60
+
+    def __init__(self):
+        self.debounce_seconds = settings.SNAPSHOT_RECALC_DEBOUNCE_SECONDS
+        self.max_delay_seconds = settings.SNAPSHOT_RECALC_MAX_DELAY_SECONDS
+        self.retry_base_seconds = settings.SNAPSHOT_RECALC_RETRY_BASE_SECONDS
+        self.max_attempts = settings.SNAPSHOT_RECALC_MAX_ATTEMPTS
+        self._redis: Optional[redis.Redis] = None
+
+    @property
+    def redis(self) -> redis.Redis:
+        if self._redis is None:
+            self._redis = redis.Redis.from_url(
+                settings.REDIS_URL,
+                decode_responses=True,
+                socket_connect_timeout=2,
+                socket_timeout=2
+            )
+        return self._redis
+
+    def _scheduled_key(self, portfolio_id: str) -> str:
+        return f"{self.SCHEDULED_PREFIX}{portfolio_id}"
+
+    def _lock_key(self, portfolio_id: str) -> str:
+        return f"{self.LOCK_PREFIX}{portfolio_id}"
+
+    def _schedule(self, portfolio_id: str, countdown: float):
+        """Programar el job de Celery del portfolio"""
+        from app.services.celery_tasks import recalculate_portfolio_snapshots
+        recalculate_portfolio_snapshots.apply_async((portfolio_id,), countdown=max(0.0, countdown))
+
+    def _mark(self, portfolio_id: str, from_date: date) -> bool:
+        """Registrar la marca; devuelve True si el llamante debe programar el job"""
+        # La reserva del job caduca si el worker muere sin ejecutarlo; el
+        # barrido periódico (sweep) vuelve a programarlo
+        scheduled_ttl = int(self.max_delay_seconds + self.LOCK_TTL_SECONDS)
+        return bool(self.redis.eval(
+            _MARK_SCRIPT, 4,
+            self.DIRTY_KEY, self.DUE_KEY, self.FIRST_KEY, self._scheduled_key(portfolio_id),
+            portfolio_id, from_date.isoformat(), time.time(),
+            self.debounce_seconds, self.max_delay_seconds, scheduled_ttl
+        ))
+
+    def enqueue(self, portfolio_id: UUID, from_date: date) -> bool:
+        """
+        Solicitar el recálculo de snapshots de un portfolio desde una fecha
+
+        Args:
+            portfolio_id: ID del portfolio
+            from_date: Fecha más antigua afectada por la modificación
+
+        Returns:
+            True si la solicitud quedó encolada; False si Redis o el broker no
+            están disponibles (el llamante debe recalcular por otra vía)
+        """
+        portfolio_id = str(portfolio_id)
+        try:
+            # Una modificación nueva vuelve a dar todos los intentos
+            self.redis.hdel(self.ATTEMPTS_KEY, portfolio_id)
+            if self._mark(portfolio_id, from_date):
+                try:
+                    self._schedule(portfolio_id, self.debounce_seconds)
+                except Exception:
+                    self.redis.delete(self._scheduled_key(portfolio_id))
+                    raise
+            return True
+        except Exception as e:
+            logger.error(f"No se pudo encolar el recálculo de snapshots de {portfolio_id}: {e}")
+            return False
+
+    def seconds_until_due(self, portfolio_id: str) -> float:
+        """Segundos que faltan para que venza el debounce (0 si ya venció)"""
+        due = self.redis.hget(self.DUE_KEY, portfolio_id)
+        if due is None:
+            return 0.0
+        return max(0.0, float(due) - time.time())
+
+    def claim(self, portfolio_id: str) -> Optional[date]:
+        """Retirar la marca del portfolio y devolver la fecha desde la que recalcular"""
+        from_date = self.redis.eval(
+            _CLAIM_SCRIPT, 4,
+            self.DIRTY_KEY, self.DUE_KEY, self.FIRST_KEY, self._scheduled_key(portfolio_id),
+            portfolio_id
+        )
+        return date.fromisoformat(from_date) if from_date else None
+
+    def retry_later(self, portfolio_id: str, from_date: date) -> Optional[float]:
+        """
+        Devolver la marca de un recálculo fallido y reprogramarlo con backoff
+
+        Args:
+            portfolio_id: ID del portfolio
+            from_date: Fecha retirada con claim
+
+        Returns:
+            Segundos hasta el reintento (0 si un job ya programado recogerá
+            la marca) o None si se agotaron los intentos
+        """
+        delay = float(self.redis.eval(
+            _RETRY_SCRIPT, 4,
+            self.DIRTY_KEY, self.DUE_KEY, self._scheduled_key(portfolio_id), self.ATTEMPTS_KEY,
+            portfolio_id, from_date.isoformat(), time.time(),
+            self.retry_base_seconds, self.max_attempts, self.LOCK_TTL_SECONDS
+        ))
+        if delay < 0:
+            return None
+        if delay > 0:
+            try:
+                self._schedule(portfolio_id, delay)
+            except Exception:
+                # Sin job, el barrido lo reprograma cuando venza
+                self.redis.delete(self._scheduled_key(portfolio_id))
+                raise
+        return delay
+
+    def reset_attempts(self, portfolio_id: str):
+        """Olvidar los fallos previos tras un recálculo correcto"""
+        self.redis.hdel(self.ATTEMPTS_KEY, portfolio_id)
+
+    def acquire_lock(self, portfolio_id: str) -> Optional[str]:
+        """Lock por portfolio para no ejecutar dos recálculos a la vez"""
+        token = uuid.uuid4().hex
+        if self.redis.set(self._lock_key(portfolio_id), token, nx=True, ex=self.LOCK_TTL_SECONDS):
+            return token
+        return None
+
+    def release_lock(self, portfolio_id: str, token: str):
+        self.redis.eval(_RELEASE_SCRIPT, 1, self._lock_key(portfolio_id), token)
+
+    def sweep(self) -> int:
+        """
+        Reprogramar marcas vencidas sin job pendiente
+
+        Cubre los jobs perdidos (worker caído, broker reiniciado): la marca
+        persiste en Redis hasta que un recálculo la consume.
+
+        Returns:
+            Número de portfolios reprogramados
+        """
+        now = time.time()
+        rescheduled = 0
+        for portfolio_id, due in self.redis.hgetall(self.DUE_KEY).items():
+            if float(due) > now:
+                continue
+            if self.redis.exists(self._scheduled_key(portfolio_id)):
+                continue
+            if self._mark(portfolio_id, self.peek(portfolio_id) or date.today()):
+                self._schedule(portfolio_id, 0)
+                rescheduled += 1
+        return rescheduled
+
+    def peek(self, portfolio_id: str) -> Optional[date]:
+        """Fecha pendiente del portfolio sin retirarla"""
+        from_date = self.redis.hget(self.DIRTY_KEY, portfolio_id)
+        return date.fromisoformat(from_date) if from_date else None
+
+    def pending(self) -> Dict[str, str]:
+        """Marcas pendientes (portfolio_id -> fecha más antigua)"""
+        return self.redis.hgetall(self.DIRTY_KEY)
+
+    @staticmethod
+    def recalculate_now(portfolio_id: UUID, from_date: date) -> Dict:
+        """
+        Recalcular los snapshots de un portfolio desde una fecha hasta hoy
+
+        Args:
+            portfolio_id: ID del portfolio
+            from_date: Fecha de inicio
+
+        Returns:
+            Resumen devuelto por create_daily_snapshots_for_portfolio
+        """
+        from app.services.snapshot_service import snapshot_service
+
+        db = SessionLocal()
+        try:
+            return snapshot_service.create_daily_snapshots_for_portfolio(
+                db, UUID(str(portfolio_id)), from_date, date.today(), overwrite=True
+            )
+        finally:
+            db.close()
+
+
+# Instancia global
+snapshot_recalc_queue = SnapshotRecalcQueue()
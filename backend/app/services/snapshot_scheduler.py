@@ -3,9 +3,14 @@ Automatic daily snapshot scheduler
 """
 import asyncio
 import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import date, datetime, time, timedelta
+from time import monotonic
+from typing import Callable, Dict, List, Optional, Tuple
+from uuid import UUID
 
-from sqlalchemy import select
+from sqlalchemy import event, select
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker, Session
 
@@ -16,13 +21,44 @@ from app.services.snapshot_service import snapshot_service
 logger = logging.getLogger(__name__)
 
 
+class PortfolioTimeoutError(Exception):
+    """A portfolio exceeded its time budget"""
+
+
+# Deadline (monotonic) of the portfolio processed by the current worker thread
+_portfolio_deadline = threading.local()
+
+
+def _bound_statement(conn, cursor, statement, parameters, context, executemany):
+    """
+    Limit each statement to what is left of the portfolio budget
+    
+    Fails before running once the deadline has passed; on PostgreSQL the
+    statement also gets the remaining budget as statement_timeout (SET
+    LOCAL, so it ends with the transaction).
+    """
+    deadline = getattr(_portfolio_deadline, "value", None)
+    if deadline is None:
+        return
+    remaining = deadline - monotonic()
+    if remaining <= 0:
+        raise PortfolioTimeoutError("portfolio time budget exhausted")
+    if conn.dialect.name == "postgresql":
+        cursor.execute(f"SET LOCAL statement_timeout = {int(remaining * 1000) + 1}")
+
+
 class SnapshotScheduler:
     """
     Scheduler for automatic daily portfolio snapshots
     
-    Runs at end of each trading day to capture portfolio state
+    Runs at end of each trading day to capture portfolio state. Portfolios
+    are processed in parallel on a thread pool (one database session per
+    portfolio), so the event loop hosting the scheduler is never blocked.
     """
     
+    # Errors kept in the run summary (the rest are only logged)
+    MAX_REPORTED_ERRORS = 100
+    
     def __init__(self, run_time: time = time(hour=20, minute=0)):
         """
         Initialize scheduler
@@ -34,14 +70,27 @@ class SnapshotScheduler:
         self.is_running = False
         self.engine = None
         self.SessionLocal = None
+        self.executor = None
+        self.concurrency = settings.SNAPSHOT_JOB_CONCURRENCY
+        self.portfolio_timeout = settings.SNAPSHOT_JOB_PORTFOLIO_TIMEOUT_SECONDS
+        self.backfill_timeout = settings.SNAPSHOT_BACKFILL_PORTFOLIO_TIMEOUT_SECONDS
+        # Progress of the run in flight and summary of the last finished run
+        self.current_run: Optional[Dict] = None
+        self.last_run: Optional[Dict] = None
         
     def initialize(self):
-        """Initialize database connection"""
+        """Initialize database connection and worker pool"""
+        if self.SessionLocal:
+            return
+        
         self.engine = create_engine(
             settings.DATABASE_URL,
             echo=False,
-            pool_pre_ping=True
+            pool_pre_ping=True,
+            pool_size=self.concurrency,
+            max_overflow=0
         )
+        event.listen(self.engine, "before_cursor_execute", _bound_statement)
         
         self.SessionLocal = sessionmaker(
             self.engine,
@@ -49,80 +98,191 @@ class SnapshotScheduler:
             expire_on_commit=False
         )
         
-        logger.info("Snapshot scheduler initialized")
+        self.executor = ThreadPoolExecutor(
+            max_workers=self.concurrency,
+            thread_name_prefix="snapshots"
+        )
+        
+        logger.info(f"Snapshot scheduler initialized (concurrency={self.concurrency})")
+    
+    def _load_portfolios(self) -> List[Tuple[UUID, str]]:
+        """Id and name of every portfolio (runs on the worker pool)"""
+        with self.SessionLocal() as session:
+            return [tuple(row) for row in session.execute(select(Portfolio.id, Portfolio.name))]
+    
+    def _snapshot_portfolio(self, portfolio_id: UUID, target_date: date) -> str:
+        """Create one portfolio snapshot in its own session (worker thread)"""
+        with self.SessionLocal() as session:
+            try:
+                snapshot_service.create_snapshot(session, portfolio_id, target_date)
+                return "created"
+            except ValueError:
+                # Snapshot already exists
+                session.rollback()
+                return "skipped"
+    
+    def _backfill_portfolio(self, portfolio_id: UUID, from_date: date, to_date: date) -> Dict:
+        """Backfill one portfolio in its own session (worker thread)"""
+        with self.SessionLocal() as session:
+            return snapshot_service.create_daily_snapshots_for_portfolio(
+                session,
+                portfolio_id,
+                from_date,
+                to_date
+            )
+    
+    @staticmethod
+    def _run_with_deadline(timeout: float, worker: Callable, portfolio_id: UUID, *args):
+        """
+        Run worker(portfolio_id, *args) within a time budget (worker thread)
+        
+        The budget starts when the worker starts and is enforced statement
+        by statement (_bound_statement), so the thread really stops and
+        frees its slot once it runs out.
+        
+        Raises:
+            PortfolioTimeoutError: The budget ran out
+        """
+        deadline = monotonic() + timeout
+        _portfolio_deadline.value = deadline
+        try:
+            return worker(portfolio_id, *args)
+        except PortfolioTimeoutError:
+            raise
+        except Exception as e:
+            # statement_timeout cancels the query with a database error
+            if monotonic() >= deadline:
+                raise PortfolioTimeoutError(str(e)) from e
+            raise
+        finally:
+            _portfolio_deadline.value = None
+    
+    async def _run_for_portfolios(
+        self,
+        job: str,
+        portfolios: List[Tuple[UUID, str]],
+        timeout: float,
+        worker: Callable,
+        *args
+    ) -> Dict:
+        """
+        Run worker(portfolio_id, *args) for every portfolio on the pool
+        
+        At most `concurrency` portfolios run at once and each one is bounded
+        by `timeout` seconds. Progress is published in current_run while
+        the job runs and the summary is kept in last_run.
+        
+        Args:
+            job: Job name for the summary
+            portfolios: (id, name) pairs to process
+            timeout: Time budget per portfolio in seconds
+            worker: Blocking function executed per portfolio
+            
+        Returns:
+            Run summary
+        """
+        loop = asyncio.get_running_loop()
+        semaphore = asyncio.Semaphore(self.concurrency)
+        started = loop.time()
+        summary = {
+            "job": job,
+            "started_at": datetime.utcnow().isoformat(),
+            "finished_at": None,
+            "total": len(portfolios),
+            "completed": 0,
+            "created": 0,
+            "skipped": 0,
+            "failed": 0,
+            "timed_out": 0,
+            "errors": []
+        }
+        self.current_run = summary
+        
+        def record_error(portfolio_id: UUID, name: str, error: str):
+            summary["failed"] += 1
+            logger.error(f"Snapshot job failed for portfolio {name}: {error}")
+            if len(summary["errors"]) < self.MAX_REPORTED_ERRORS:
+                summary["errors"].append({
+                    "portfolio_id": str(portfolio_id),
+                    "portfolio_name": name,
+                    "error": error
+                })
+        
+        async def process(portfolio_id: UUID, name: str):
+            async with semaphore:
+                try:
+                    result = await loop.run_in_executor(
+                        self.executor, self._run_with_deadline, timeout, worker, portfolio_id, *args
+                    )
+                    if isinstance(result, dict):
+                        summary["created"] += result.get("created", 0)
+                        summary["skipped"] += result.get("skipped", 0)
+                        for error in result.get("errors", []):
+                            record_error(portfolio_id, name, str(error))
+                    else:
+                        summary[result] += 1
+                except PortfolioTimeoutError:
+                    summary["timed_out"] += 1
+                    record_error(portfolio_id, name, f"timed out after {timeout}s")
+                except Exception as e:
+                    record_error(portfolio_id, name, str(e))
+                finally:
+                    summary["completed"] += 1
+        
+        try:
+            await asyncio.gather(*(process(portfolio_id, name) for portfolio_id, name in portfolios))
+        finally:
+            summary["finished_at"] = datetime.utcnow().isoformat()
+            summary["duration_seconds"] = round(loop.time() - started, 2)
+            self.current_run = None
+            self.last_run = summary
+        
+        logger.info(
+            f"Snapshot job '{job}' completed in {summary['duration_seconds']}s: "
+            f"{summary['created']} created, {summary['skipped']} skipped, "
+            f"{summary['failed']} errors ({summary['timed_out']} timed out)"
+        )
+        return summary
     
-    async def create_snapshots_job(self, target_date: date = None):
+    async def create_snapshots_job(self, target_date: date = None) -> Optional[Dict]:
         """
         Job to create snapshots for all portfolios
         
         Args:
             target_date: Date to create snapshots for (default: yesterday)
+            
+        Returns:
+            Run summary (None if the job could not start)
         """
         if not self.SessionLocal:
             logger.error("Scheduler not initialized")
-            return
+            return None
         
         if not target_date:
             # Use yesterday (market close)
             target_date = (datetime.now() - timedelta(days=1)).date()
 
-        with self.SessionLocal() as session:
-            try:
-                # Get all active portfolios
-                result = session.execute(select(Portfolio))
-                portfolios = result.scalars().all()
-                
-                if not portfolios:
-                    logger.info("No portfolios found for snapshot creation")
-                    return
-
-                logger.info(
-                    f"Starting snapshot creation for {len(portfolios)} portfolios "
-                    f"for date {target_date}"
-                )
-                
-                created = 0
-                skipped = 0
-                errors = []
-
-                for portfolio in portfolios:
-                    try:
-                        snapshot_service.create_snapshot(
-                            session,
-                            portfolio.id,
-                            target_date
-                        )
-                        created += 1
-                        logger.info(f"Created snapshot for portfolio {portfolio.name}")
-                        
-                    except ValueError:
-                        # Snapshot already exists
-                        skipped += 1
-                        logger.debug(f"Snapshot already exists for portfolio {portfolio.name}")
-                        
-                    except Exception as e:
-                        errors.append({
-                            "portfolio_id": str(portfolio.id),
-                            "portfolio_name": portfolio.name,
-                            "error": str(e)
-                        })
-                        logger.error(
-                            f"Failed to create snapshot for portfolio {portfolio.name}: {str(e)}"
-                        )
+        try:
+            loop = asyncio.get_running_loop()
+            portfolios = await loop.run_in_executor(self.executor, self._load_portfolios)
+        except Exception as e:
+            logger.error(f"Error in snapshot creation job: {str(e)}")
+            return None
+            
+        if not portfolios:
+            logger.info("No portfolios found for snapshot creation")
+            return None
 
-                logger.info(
-                    f"Snapshot creation completed: "
-                    f"{created} created, {skipped} skipped, {len(errors)} errors"
-                )
-                
-                if errors:
-                    for error in errors:
-                        logger.error(
-                            f"Portfolio {error['portfolio_name']}: {error['error']}"
-                        )
-
-            except Exception as e:
-                logger.error(f"Error in snapshot creation job: {str(e)}")
+        logger.info(
+            f"Starting snapshot creation for {len(portfolios)} portfolios "
+            f"for date {target_date}"
+        )
+        
+        summary = await self._run_for_portfolios(
+            "daily", portfolios, self.portfolio_timeout, self._snapshot_portfolio, target_date
+        )
+        summary["target_date"] = target_date.isoformat()
+        return summary
     
     async def wait_until_next_run(self):
         """Calculate and wait until next scheduled run"""
@@ -170,10 +330,16 @@ class SnapshotScheduler:
         logger.info("Stopping snapshot scheduler")
         self.is_running = False
         
+        if self.executor:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+        
         if self.engine:
             self.engine.dispose()
+            self.engine = None
+            self.SessionLocal = None
     
-    async def run_now(self, target_date: date = None):
+    async def run_now(self, target_date: date = None) -> Optional[Dict]:
         """
         Manually trigger snapshot creation
         
@@ -181,14 +347,15 @@ class SnapshotScheduler:
             target_date: Date to create snapshots for
         """
         logger.info(f"Manual snapshot creation triggered for {target_date or 'yesterday'}")
-        await self.create_snapshots_job(target_date)
+        self.initialize()
+        return await self.create_snapshots_job(target_date)
     
     async def backfill_snapshots(
         self,
         portfolio_id: str = None,
         from_date: date = None,
         to_date: date = None
-    ):
+    ) -> Dict:
         """
         Backfill historical snapshots
         
@@ -196,9 +363,11 @@ class SnapshotScheduler:
             portfolio_id: Specific portfolio ID (None = all)
             from_date: Start date (None = 30 days ago)
             to_date: End date (None = yesterday)
+            
+        Returns:
+            Run summary
         """
-        if not self.SessionLocal:
-            self.initialize()
+        self.initialize()
 
         if not from_date:
             from_date = (datetime.now() - timedelta(days=30)).date()
@@ -206,57 +375,20 @@ class SnapshotScheduler:
         if not to_date:
             to_date = (datetime.now() - timedelta(days=1)).date()
 
-        with self.SessionLocal() as session:
-            if portfolio_id:
-                # Backfill specific portfolio
-                logger.info(
-                    f"Backfilling snapshots for portfolio {portfolio_id} "
-                    f"from {from_date} to {to_date}"
-                )
-                
-                result = snapshot_service.create_daily_snapshots_for_portfolio(
-                    session,
-                    portfolio_id,
-                    from_date,
-                    to_date
-                )
-                
-                logger.info(
-                    f"Backfill completed: {result['created']} created, "
-                    f"{result['skipped']} skipped"
-                )
-                
-            else:
-                # Backfill all portfolios
-                result = session.execute(select(Portfolio))
-                portfolios = result.scalars().all()
-                
-                logger.info(
-                    f"Backfilling snapshots for {len(portfolios)} portfolios "
-                    f"from {from_date} to {to_date}"
-                )
-                
-                total_created = 0
-                total_skipped = 0
-                
-                for portfolio in portfolios:
-                    result = snapshot_service.create_daily_snapshots_for_portfolio(
-                        session,
-                        portfolio.id,
-                        from_date,
-                        to_date
-                    )
-                    total_created += result['created']
-                    total_skipped += result['skipped']
-                    
-                    logger.info(
-                        f"Portfolio {portfolio.name}: "
-                        f"{result['created']} created, {result['skipped']} skipped"
-                    )
-                
-                logger.info(
-                    f"Total backfill: {total_created} created, {total_skipped} skipped"
-                )
+        if portfolio_id:
+            portfolios = [(portfolio_id, str(portfolio_id))]
+        else:
+            loop = asyncio.get_running_loop()
+            portfolios = await loop.run_in_executor(self.executor, self._load_portfolios)
+            
+        logger.info(
+            f"Backfilling snapshots for {len(portfolios)} portfolios "
+            f"from {from_date} to {to_date}"
+        )
+        
+        return await self._run_for_portfolios(
+            "backfill", portfolios, self.backfill_timeout, self._backfill_portfolio, from_date, to_date
+        )
 
 
 # Global scheduler instance
@@ -1,12 +1,14 @@
 """
 Portfolio Snapshot Service - Daily portfolio state capture
 """
+import uuid
 from datetime import date, datetime, timedelta
 from decimal import Decimal
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Set, Tuple
 from uuid import UUID
 
-from sqlalchemy import select, and_, desc, func
+from sqlalchemy import Date, select, and_, desc, func, delete, insert, literal_column
+from sqlalchemy.dialects.postgresql import aggregate_order_by, array_agg
 from sqlalchemy.orm import Session
 
 # Correct imports matching the rest of the application
@@ -15,128 +17,147 @@ from app.models.transaction import Transaction, TransactionType
 from app.models.asset import Asset
 from app.models.quote import Quote
 from app.db.models_snapshots import PortfolioSnapshot, PositionSnapshot, SnapshotMetrics
+from app.services.price_resolver import price_resolver
+from app.services.metrics_materializer import metrics_materializer
+
+
+# History resolutions -> date_trunc unit
+HISTORY_RESOLUTION_UNITS = {
+    "weekly": "week",
+    "monthly": "month",
+    "quarterly": "quarter",
+    "yearly": "year",
+}
+
+# Approximate bucket length, finest first, used by resolution="auto"
+HISTORY_BUCKET_DAYS = {
+    "daily": 1,
+    "weekly": 7,
+    "monthly": 30.44,
+    "quarterly": 91.31,
+    "yearly": 365.25,
+}
+
+
+# Position fields returned by the history endpoints -> (model, attribute)
+POSITION_FIELDS = {
+    "symbol": ("position", "ticker"),
+    "name": ("asset", "name"),
+    "asset_type": ("asset", "asset_type"),
+    "quantity": ("position", "quantity"),
+    "average_price": ("position", "average_buy_price"),
+    "current_price": ("position", "current_price"),
+    "current_value": ("position", "current_value"),
+    "cost_basis": ("position", "total_cost"),
+    "profit_loss": ("position", "position_pnl"),
+    "profit_loss_percent": ("position", "position_pnl_percent"),
+    "daily_change_percent": ("position", "daily_change_percent"),
+    "portfolio_weight": ("position", "portfolio_weight"),
+}
+
+# Default cap on position rows returned by a history request
+POSITION_ROW_LIMIT = 50000
 
 
 class SnapshotService:
     """Service for creating and managing portfolio snapshots"""
 
     @staticmethod
-    def calculate_portfolio_state(
-        db: Session,
+    def _apply_transaction(
+        positions: Dict[UUID, Dict],
+        transaction: Transaction,
+        asset: Asset
+    ) -> Decimal:
+        """
+        Apply a single transaction to the running positions
+
+        Args:
+            positions: Running positions keyed by asset_id (mutated in place)
+            transaction: Transaction to apply
+            asset: Asset of the transaction
+
+        Returns:
+            Change in total invested capital caused by the transaction
+        """
+        pos = positions.get(transaction.asset_id)
+        if pos is None:
+            pos = positions[transaction.asset_id] = {
+                "asset": asset,
+                "quantity": Decimal("0"),
+                "total_cost": Decimal("0"),
+            }
+
+        # Convert float to Decimal for calculation
+        qty = Decimal(str(transaction.quantity))
+        price = Decimal(str(transaction.price))
+        fees = Decimal(str(transaction.fees or 0))
+
+        invested_delta = Decimal("0")
+        if transaction.transaction_type == TransactionType.BUY:
+            pos["quantity"] += qty
+            cost = (qty * price) + fees
+            pos["total_cost"] += cost
+            invested_delta = cost
+        elif transaction.transaction_type == TransactionType.SELL:
+            # Calculate proportion being sold
+            if pos["quantity"] > 0:
+                sell_proportion = qty / pos["quantity"]
+                cost_reduction = pos["total_cost"] * sell_proportion
+                pos["total_cost"] -= cost_reduction
+                invested_delta = -cost_reduction
+
+            pos["quantity"] -= qty
+        # Handle other types if necessary (DEPOSIT/WITHDRAWAL usually affect cash, not positions directly unless it's crypto/asset transfer)
+
+        return invested_delta
+
+    @staticmethod
+    def _build_state(
         portfolio_id: UUID,
-        target_date: date
+        target_date: date,
+        positions: Dict[UUID, Dict],
+        total_invested: Decimal,
+        prices: Dict[UUID, Decimal]
     ) -> Dict:
         """
-        Calculate portfolio state for a specific date
-        
+        Build the portfolio state dictionary from running positions
+
         Args:
-            db: Database session
             portfolio_id: Portfolio ID
-            target_date: Date to calculate state for
-            
+            target_date: Date the state refers to
+            positions: Running positions keyed by asset_id
+            total_invested: Running invested capital
+            prices: Close price per asset_id as of target_date
+
         Returns:
             Dictionary with portfolio state
         """
-        # Get all transactions up to target date
-        result = db.execute(
-            select(Transaction, Asset)
-            .join(Asset, Transaction.asset_id == Asset.id)
-            .where(
-                and_(
-                    Transaction.portfolio_id == portfolio_id,
-                    func.date(Transaction.transaction_date) <= target_date
-                )
-            )
-            .order_by(Transaction.transaction_date)
-        )
-        transactions = result.all()
-
-        # Calculate positions
-        positions = {}
-        total_invested = Decimal("0")
-        
-        for transaction, asset in transactions:
-            asset_id = str(transaction.asset_id)
-            
-            if asset_id not in positions:
-                positions[asset_id] = {
-                    "asset": asset,
-                    "quantity": Decimal("0"),
-                    "total_cost": Decimal("0"),
-                    "operations": []
-                }
-            
-            pos = positions[asset_id]
-            
-            # Convert float to Decimal for calculation
-            qty = Decimal(str(transaction.quantity))
-            price = Decimal(str(transaction.price))
-            fees = Decimal(str(transaction.fees or 0))
-            
-            if transaction.transaction_type == TransactionType.BUY:
-                pos["quantity"] += qty
-                cost = (qty * price) + fees
-                pos["total_cost"] += cost
-                total_invested += cost
-            elif transaction.transaction_type == TransactionType.SELL:
-                # Calculate proportion being sold
-                if pos["quantity"] > 0:
-                    sell_proportion = qty / pos["quantity"]
-                    cost_reduction = pos["total_cost"] * sell_proportion
-                    pos["total_cost"] -= cost_reduction
-                    total_invested -= cost_reduction
-                
-                pos["quantity"] -= qty
-            # Handle other types if necessary (DEPOSIT/WITHDRAWAL usually affect cash, not positions directly unless it's crypto/asset transfer)
-            
-            pos["operations"].append(transaction)
-
-        # Filter active positions
-        active_positions = {
-            k: v for k, v in positions.items()
-            if v["quantity"] > Decimal("0")
-        }
-
-        # Get quotes for target date (or closest previous)
         position_details = []
         total_value = Decimal("0")
-        
-        for asset_id, pos_data in active_positions.items():
-            asset = pos_data["asset"]
+
+        for asset_id, pos_data in positions.items():
             quantity = pos_data["quantity"]
+            if quantity <= Decimal("0"):
+                continue
+
+            asset = pos_data["asset"]
             total_cost = pos_data["total_cost"]
-            
-            # Get quote for target date or most recent before
-            # Using correct columns: asset_id and timestamp
-            quote_result = db.execute(
-                select(Quote)
-                .where(
-                    and_(
-                        Quote.asset_id == asset.id,
-                        func.date(Quote.timestamp) <= target_date
-                    )
-                )
-                .order_by(desc(Quote.timestamp))
-                .limit(1)
-            )
-            quote = quote_result.scalar_one_or_none()
-            
-            if not quote:
+
+            current_price = prices.get(asset_id)
+            if current_price is None:
                 # No quote available, use average cost as fallback or 0?
                 # Using average cost implies no PnL, which is safer than 0 value
-                current_price = total_cost / quantity if quantity > 0 else Decimal("0")
-            else:
-                current_price = Decimal(str(quote.close))
-            
-            avg_buy_price = total_cost / quantity if quantity > 0 else Decimal("0")
+                current_price = total_cost / quantity
+
+            avg_buy_price = total_cost / quantity
             current_value = quantity * current_price
             position_pnl = current_value - total_cost
             position_pnl_percent = (position_pnl / total_cost * 100) if total_cost > 0 else Decimal("0")
-            
+
             total_value += current_value
-            
+
             position_details.append({
-                "asset_id": UUID(asset_id),
+                "asset_id": asset_id,
                 "ticker": asset.symbol,
                 "asset_name": asset.name,
                 "quantity": quantity,
@@ -160,10 +181,184 @@ class SnapshotService:
             "total_pnl": total_pnl,
             "total_pnl_percent": total_pnl_percent,
             "number_of_positions": len(position_details),
-            "number_of_assets": len(active_positions),
+            "number_of_assets": len(position_details),
             "positions": position_details
         }
 
+    @staticmethod
+    def _build_snapshot_rows(
+        state: Dict,
+        prev_total_value: Optional[Decimal],
+        prev_position_values: Dict[UUID, Decimal]
+    ) -> Tuple[Dict, List[Dict]]:
+        """
+        Build PortfolioSnapshot/PositionSnapshot column values for a state
+
+        Args:
+            state: Portfolio state from _build_state
+            prev_total_value: Total value of the previous snapshot (None if first)
+            prev_position_values: Last known current_value per asset_id
+
+        Returns:
+            Tuple of (portfolio snapshot row, list of position snapshot rows)
+        """
+        if prev_total_value is not None:
+            daily_pnl = state["total_value"] - prev_total_value
+            daily_pnl_percent = (daily_pnl / prev_total_value * 100) if prev_total_value > 0 else Decimal("0")
+        else:
+            daily_pnl = Decimal("0")
+            daily_pnl_percent = Decimal("0")
+
+        snapshot_id = uuid.uuid4()
+        snapshot_row = {
+            "id": snapshot_id,
+            "portfolio_id": state["portfolio_id"],
+            "snapshot_date": state["snapshot_date"],
+            "total_invested": state["total_invested"],
+            "total_value": state["total_value"],
+            "cash_balance": Decimal("0"),  # TODO: Implement cash tracking
+            "daily_pnl": daily_pnl,
+            "daily_pnl_percent": daily_pnl_percent,
+            "total_pnl": state["total_pnl"],
+            "total_pnl_percent": state["total_pnl_percent"],
+            "number_of_positions": state["number_of_positions"],
+            "number_of_assets": state["number_of_assets"],
+        }
+
+        position_rows = []
+        for position in state["positions"]:
+            prev_value = prev_position_values.get(position["asset_id"])
+            if prev_value is not None:
+                daily_change = position["current_value"] - prev_value
+                daily_change_percent = (
+                    daily_change / prev_value * 100
+                ) if prev_value > 0 else Decimal("0")
+            else:
+                daily_change = Decimal("0")
+                daily_change_percent = Decimal("0")
+
+            # Calculate portfolio weight
+            portfolio_weight = (
+                position["current_value"] / state["total_value"] * 100
+            ) if state["total_value"] > 0 else Decimal("0")
+
+            position_rows.append({
+                "id": uuid.uuid4(),
+                "portfolio_snapshot_id": snapshot_id,
+                "asset_id": position["asset_id"],
+                "snapshot_date": state["snapshot_date"],
+                "ticker": position["ticker"],
+                "quantity": position["quantity"],
+                "average_buy_price": position["average_buy_price"],
+                "current_price": position["current_price"],
+                "total_cost": position["total_cost"],
+                "current_value": position["current_value"],
+                "position_pnl": position["position_pnl"],
+                "position_pnl_percent": position["position_pnl_percent"],
+                "daily_change": daily_change,
+                "daily_change_percent": daily_change_percent,
+                "portfolio_weight": portfolio_weight,
+            })
+
+        return snapshot_row, position_rows
+
+    @staticmethod
+    def _previous_position_values(
+        db: Session,
+        portfolio_id: UUID,
+        before_date: date,
+        prev_snapshot_id: Optional[UUID],
+        asset_ids: Set[UUID]
+    ) -> Dict[UUID, Decimal]:
+        """
+        Last known current_value per asset before a date
+
+        Reads the previous snapshot's positions; only assets missing there
+        (e.g. re-bought after being sold) are looked up further back.
+
+        Args:
+            db: Database session
+            portfolio_id: Portfolio ID
+            before_date: Only snapshots strictly before this date are used
+            prev_snapshot_id: Latest PortfolioSnapshot before before_date
+            asset_ids: Assets that need a previous value
+
+        Returns:
+            current_value keyed by asset_id
+        """
+        values: Dict[UUID, Decimal] = {}
+        if prev_snapshot_id is not None:
+            values = dict(db.execute(
+                select(PositionSnapshot.asset_id, PositionSnapshot.current_value)
+                .where(PositionSnapshot.portfolio_snapshot_id == prev_snapshot_id)
+            ).all())
+
+        missing = set(asset_ids) - values.keys()
+        if missing:
+            values.update(db.execute(
+                select(PositionSnapshot.asset_id, PositionSnapshot.current_value)
+                .join(PortfolioSnapshot)
+                .where(
+                    and_(
+                        PortfolioSnapshot.portfolio_id == portfolio_id,
+                        PositionSnapshot.asset_id.in_(missing),
+                        PositionSnapshot.snapshot_date < before_date
+                    )
+                )
+                .order_by(PositionSnapshot.asset_id, desc(PositionSnapshot.snapshot_date))
+                .distinct(PositionSnapshot.asset_id)
+            ).all())
+
+        return {asset_id: value for asset_id, value in values.items() if asset_id in asset_ids}
+
+    @staticmethod
+    def calculate_portfolio_state(
+        db: Session,
+        portfolio_id: UUID,
+        target_date: date
+    ) -> Dict:
+        """
+        Calculate portfolio state for a specific date
+
+        Args:
+            db: Database session
+            portfolio_id: Portfolio ID
+            target_date: Date to calculate state for
+
+        Returns:
+            Dictionary with portfolio state
+        """
+        # Get all transactions up to target date
+        result = db.execute(
+            select(Transaction, Asset)
+            .join(Asset, Transaction.asset_id == Asset.id)
+            .where(
+                and_(
+                    Transaction.portfolio_id == portfolio_id,
+                    func.date(Transaction.transaction_date) <= target_date
+                )
+            )
+            .order_by(Transaction.transaction_date)
+        )
+
+        # Calculate positions
+        positions: Dict[UUID, Dict] = {}
+        total_invested = Decimal("0")
+
+        for transaction, asset in result.all():
+            total_invested += SnapshotService._apply_transaction(positions, transaction, asset)
+
+        # Get quotes for target date (or closest previous) for all open positions at once
+        prices = price_resolver.get_prices_as_of(
+            db,
+            [asset_id for asset_id, pos_data in positions.items() if pos_data["quantity"] > Decimal("0")],
+            target_date
+        )
+
+        return SnapshotService._build_state(
+            portfolio_id, target_date, positions, total_invested, prices
+        )
+
     @staticmethod
     def create_snapshot(
         db: Session,
@@ -173,13 +368,13 @@ class SnapshotService:
     ) -> PortfolioSnapshot:
         """
         Create a snapshot for a specific date
-        
+
         Args:
             db: Database session
             portfolio_id: Portfolio ID
             target_date: Date for snapshot
             overwrite: Whether to overwrite if exists
-            
+
         Returns:
             Created PortfolioSnapshot
         """
@@ -193,7 +388,7 @@ class SnapshotService:
             )
         )
         existing_snapshot = existing.scalar_one_or_none()
-        
+
         if existing_snapshot:
             if not overwrite:
                 raise ValueError(f"Snapshot already exists for {target_date}")
@@ -221,83 +416,33 @@ class SnapshotService:
         )
         prev = prev_snapshot.scalar_one_or_none()
 
-        if prev:
-            daily_pnl = state["total_value"] - prev.total_value
-            daily_pnl_percent = (daily_pnl / prev.total_value * 100) if prev.total_value > 0 else Decimal("0")
-        else:
-            daily_pnl = Decimal("0")
-            daily_pnl_percent = Decimal("0")
+        # Last known value per asset for daily change
+        prev_position_values = SnapshotService._previous_position_values(
+            db, portfolio_id, target_date,
+            prev.id if prev else None,
+            {position["asset_id"] for position in state["positions"]}
+        )
 
-        # Create portfolio snapshot
-        portfolio_snapshot = PortfolioSnapshot(
-            portfolio_id=portfolio_id,
-            snapshot_date=target_date,
-            total_invested=state["total_invested"],
-            total_value=state["total_value"],
-            cash_balance=Decimal("0"),  # TODO: Implement cash tracking
-            daily_pnl=daily_pnl,
-            daily_pnl_percent=daily_pnl_percent,
-            total_pnl=state["total_pnl"],
-            total_pnl_percent=state["total_pnl_percent"],
-            number_of_positions=state["number_of_positions"],
-            number_of_assets=state["number_of_assets"]
+        snapshot_row, position_rows = SnapshotService._build_snapshot_rows(
+            state,
+            prev.total_value if prev else None,
+            prev_position_values
         )
-        
+
+        # Create portfolio snapshot
+        portfolio_snapshot = PortfolioSnapshot(**snapshot_row)
         db.add(portfolio_snapshot)
         db.flush()
 
-        # Create position snapshots
-        for position in state["positions"]:
-            # Get previous position for daily change
-            prev_position_result = db.execute(
-                select(PositionSnapshot)
-                .join(PortfolioSnapshot)
-                .where(
-                    and_(
-                        PortfolioSnapshot.portfolio_id == portfolio_id,
-                        PositionSnapshot.asset_id == position["asset_id"],
-                        PositionSnapshot.snapshot_date < target_date
-                    )
-                )
-                .order_by(desc(PositionSnapshot.snapshot_date))
-                .limit(1)
-            )
-            prev_position = prev_position_result.scalar_one_or_none()
-
-            if prev_position:
-                daily_change = position["current_value"] - prev_position.current_value
-                daily_change_percent = (
-                    daily_change / prev_position.current_value * 100
-                ) if prev_position.current_value > 0 else Decimal("0")
-            else:
-                daily_change = Decimal("0")
-                daily_change_percent = Decimal("0")
+        # Create position snapshots with a single bulk insert
+        if position_rows:
+            db.execute(insert(PositionSnapshot), position_rows)
 
-            # Calculate portfolio weight
-            portfolio_weight = (
-                position["current_value"] / state["total_value"] * 100
-            ) if state["total_value"] > 0 else Decimal("0")
+        db.commit()
 
-            position_snapshot = PositionSnapshot(
-                portfolio_snapshot_id=portfolio_snapshot.id,
-                asset_id=position["asset_id"],
-                snapshot_date=target_date,
-                ticker=position["ticker"],
-                quantity=position["quantity"],
-                average_buy_price=position["average_buy_price"],
-                current_price=position["current_price"],
-                total_cost=position["total_cost"],
-                current_value=position["current_value"],
-                position_pnl=position["position_pnl"],
-                position_pnl_percent=position["position_pnl_percent"],
-                daily_change=daily_change,
-                daily_change_percent=daily_change_percent,
-                portfolio_weight=portfolio_weight
-            )
-            
-            db.add(position_snapshot)
+        # Derive this day's SnapshotMetrics row from the previous one
+        metrics_materializer.materialize_safely(db, portfolio_id, target_date)
 
-        db.commit()
         db.refresh(portfolio_snapshot)
 
         return portfolio_snapshot
@@ -312,62 +457,435 @@ class SnapshotService:
     ) -> Dict:
         """
         Create snapshots for a date range
-        
+
+        Loads transactions and quotes for the whole range once and replays
+        them in a single chronological pass, emitting one snapshot per day
+        from the running state.
+
         Args:
             db: Database session
             portfolio_id: Portfolio ID
             from_date: Start date
             to_date: End date
             overwrite: Whether to overwrite existing snapshots
-            
+
         Returns:
             Summary of created snapshots
         """
         created = 0
         skipped = 0
         errors = []
+        total_days = (to_date - from_date).days + 1
+
+        if total_days <= 0:
+            return {"created": 0, "skipped": 0, "errors": [], "total_days": 0}
+
+        range_snapshot_ids = (
+            select(PortfolioSnapshot.id)
+            .where(
+                and_(
+                    PortfolioSnapshot.portfolio_id == portfolio_id,
+                    PortfolioSnapshot.snapshot_date >= from_date,
+                    PortfolioSnapshot.snapshot_date <= to_date
+                )
+            )
+        )
+
+        # Existing snapshots in range: delete them or keep them as skipped days
+        existing_values: Dict[date, Decimal] = {}
+        existing_position_values: Dict[date, Dict[UUID, Decimal]] = {}
+        if overwrite:
+            db.execute(
+                delete(PositionSnapshot)
+                .where(PositionSnapshot.portfolio_snapshot_id.in_(range_snapshot_ids))
+            )
+            db.execute(
+                delete(PortfolioSnapshot)
+                .where(PortfolioSnapshot.id.in_(range_snapshot_ids))
+            )
+        else:
+            existing_values = dict(db.execute(
+                select(PortfolioSnapshot.snapshot_date, PortfolioSnapshot.total_value)
+                .where(PortfolioSnapshot.id.in_(range_snapshot_ids))
+            ).all())
+            if existing_values:
+                for snap_date, asset_id, value in db.execute(
+                    select(
+                        PositionSnapshot.snapshot_date,
+                        PositionSnapshot.asset_id,
+                        PositionSnapshot.current_value
+                    )
+                    .where(PositionSnapshot.portfolio_snapshot_id.in_(range_snapshot_ids))
+                ):
+                    existing_position_values.setdefault(snap_date, {})[asset_id] = value
+
+        # Previous snapshot (portfolio and per asset) before the range
+        prev = db.execute(
+            select(PortfolioSnapshot.id, PortfolioSnapshot.total_value)
+            .where(
+                and_(
+                    PortfolioSnapshot.portfolio_id == portfolio_id,
+                    PortfolioSnapshot.snapshot_date < from_date
+                )
+            )
+            .order_by(desc(PortfolioSnapshot.snapshot_date))
+            .limit(1)
+        ).first()
+        prev_total_value = prev.total_value if prev else None
+
+        # All transactions up to the end of the range, in one query
+        transactions = db.execute(
+            select(
+                Transaction,
+                Asset,
+                func.date(Transaction.transaction_date, type_=Date).label("tx_day")
+            )
+            .join(Asset, Transaction.asset_id == Asset.id)
+            .where(
+                and_(
+                    Transaction.portfolio_id == portfolio_id,
+                    func.date(Transaction.transaction_date) <= to_date
+                )
+            )
+            .order_by(Transaction.transaction_date)
+        ).all()
+
+        asset_ids = {transaction.asset_id for transaction, _, _ in transactions}
+
+        prev_position_values = SnapshotService._previous_position_values(
+            db, portfolio_id, from_date, prev.id if prev else None, asset_ids
+        )
+
+        # Prices: last close before the range plus every close inside it
+        prices: Dict[UUID, Decimal] = {}
+        quotes = []
+        if asset_ids:
+            prices = price_resolver.get_prices_as_of(
+                db, asset_ids, from_date - timedelta(days=1)
+            )
+
+            quotes = db.execute(
+                select(
+                    Quote.asset_id,
+                    Quote.close,
+                    func.date(Quote.timestamp, type_=Date).label("quote_day")
+                )
+                .where(
+                    and_(
+                        Quote.asset_id.in_(asset_ids),
+                        func.date(Quote.timestamp) >= from_date,
+                        func.date(Quote.timestamp) <= to_date
+                    )
+                )
+                .order_by(Quote.timestamp)
+            ).all()
+
+        # Single chronological pass over the range
+        positions: Dict[UUID, Dict] = {}
+        total_invested = Decimal("0")
+        tx_index = 0
+        quote_index = 0
+        snapshot_rows: List[Dict] = []
+        position_rows: List[Dict] = []
 
         current_date = from_date
         while current_date <= to_date:
-            try:
-                SnapshotService.create_snapshot(db, portfolio_id, current_date, overwrite)
-                created += 1
-            except ValueError as e:
+            while tx_index < len(transactions) and transactions[tx_index].tx_day <= current_date:
+                transaction, asset, _ = transactions[tx_index]
+                total_invested += SnapshotService._apply_transaction(positions, transaction, asset)
+                tx_index += 1
+
+            while quote_index < len(quotes) and quotes[quote_index].quote_day <= current_date:
+                quote = quotes[quote_index]
+                prices[quote.asset_id] = Decimal(str(quote.close))
+                quote_index += 1
+
+            if current_date in existing_values:
                 # Snapshot already exists
                 skipped += 1
-            except Exception as e:
-                errors.append({
-                    "date": current_date.isoformat(),
-                    "error": str(e)
-                })
-            
+                prev_total_value = existing_values[current_date]
+                prev_position_values.update(existing_position_values.get(current_date, {}))
+            else:
+                try:
+                    state = SnapshotService._build_state(
+                        portfolio_id, current_date, positions, total_invested, prices
+                    )
+                    snapshot_row, day_position_rows = SnapshotService._build_snapshot_rows(
+                        state, prev_total_value, prev_position_values
+                    )
+                    snapshot_rows.append(snapshot_row)
+                    position_rows.extend(day_position_rows)
+
+                    prev_total_value = state["total_value"]
+                    for position in state["positions"]:
+                        prev_position_values[position["asset_id"]] = position["current_value"]
+                    created += 1
+                except Exception as e:
+                    errors.append({
+                        "date": current_date.isoformat(),
+                        "error": str(e)
+                    })
+
             current_date += timedelta(days=1)
 
+        try:
+            if snapshot_rows:
+                db.execute(insert(PortfolioSnapshot), snapshot_rows)
+            if position_rows:
+                db.execute(insert(PositionSnapshot), position_rows)
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            errors.append({
+                "date": from_date.isoformat(),
+                "error": str(e)
+            })
+            created = 0
+
+        if created:
+            # Metrics from the first rewritten day onwards depend on these rows
+            metrics_materializer.materialize_safely(db, portfolio_id, from_date)
+
         return {
             "created": created,
             "skipped": skipped,
             "errors": errors,
-            "total_days": (to_date - from_date).days + 1
+            "total_days": total_days
         }
 
+    @staticmethod
+    def _load_positions(
+        db: Session,
+        condition,
+        fields: Optional[List[str]] = None,
+        limit: Optional[int] = None
+    ) -> Tuple[Dict[UUID, List[Dict]], Optional[date]]:
+        """
+        Load position snapshots for many portfolio snapshots in one query
+
+        Rows come ordered by date and value and are grouped by parent
+        snapshot in a single pass. Only the requested fields are selected,
+        and Asset is joined only when name/asset_type are requested.
+
+        Args:
+            db: Database session
+            condition: WHERE clause over PositionSnapshot/PortfolioSnapshot
+            fields: Output fields (None = all of POSITION_FIELDS)
+            limit: Maximum number of position rows
+
+        Returns:
+            Tuple of (positions keyed by portfolio_snapshot_id, date of the
+            first snapshot whose positions were cut by the limit or None)
+        """
+        fields = [field for field in (fields or POSITION_FIELDS) if field in POSITION_FIELDS]
+        if not fields:
+            fields = list(POSITION_FIELDS)
+        needs_asset = any(POSITION_FIELDS[field][0] == "asset" for field in fields)
+
+        columns = [PositionSnapshot.portfolio_snapshot_id, PositionSnapshot.snapshot_date]
+        if needs_asset:
+            # The asset name falls back to the ticker
+            columns.append(PositionSnapshot.ticker)
+        for field in fields:
+            source, attribute = POSITION_FIELDS[field]
+            columns.append(getattr(Asset if source == "asset" else PositionSnapshot, attribute))
+
+        query = (
+            select(*columns)
+            .join(PortfolioSnapshot, PositionSnapshot.portfolio_snapshot_id == PortfolioSnapshot.id)
+            .where(condition)
+            .order_by(
+                PositionSnapshot.snapshot_date,
+                PositionSnapshot.portfolio_snapshot_id,
+                desc(PositionSnapshot.current_value)
+            )
+        )
+        if needs_asset:
+            query = query.join(Asset, PositionSnapshot.asset_id == Asset.id)
+        if limit is not None:
+            # One extra row tells whether the limit cut the result
+            query = query.limit(limit + 1)
+
+        offset = 3 if needs_asset else 2
+        positions: Dict[UUID, List[Dict]] = {}
+        truncated_from: Optional[date] = None
+        for index, row in enumerate(db.execute(query)):
+            if limit is not None and index == limit:
+                truncated_from = row[1]
+                break
+            ticker = row[2] if needs_asset else None
+            position = {}
+            for field, value in zip(fields, row[offset:]):
+                if field == "name":
+                    value = value or ticker
+                elif field == "asset_type":
+                    value = value.value if hasattr(value, "value") else "STOCK"
+                elif isinstance(value, Decimal):
+                    value = float(value)
+                position[field] = value
+            positions.setdefault(row[0], []).append(position)
+
+        return positions, truncated_from
+
+    @staticmethod
+    def resolve_resolution(
+        resolution: str,
+        from_date: date,
+        to_date: date,
+        max_points: int
+    ) -> str:
+        """
+        Resolve "auto" to the finest bucket that fits the point budget
+
+        Args:
+            resolution: daily, weekly, monthly, quarterly, yearly or auto
+            from_date: Start date
+            to_date: End date
+            max_points: Maximum number of points for "auto"
+
+        Returns:
+            Concrete resolution
+        """
+        if resolution != "auto":
+            return resolution
+
+        days = (to_date - from_date).days + 1
+        for candidate, bucket_days in HISTORY_BUCKET_DAYS.items():
+            if days / bucket_days <= max_points:
+                return candidate
+        return "yearly"
+
+    @staticmethod
+    def get_downsampled_history(
+        db: Session,
+        portfolio_id: UUID,
+        from_date: date,
+        to_date: date,
+        resolution: str,
+        include_positions: bool = False,
+        position_fields: Optional[List[str]] = None
+    ) -> List[Dict]:
+        """
+        Get snapshot history aggregated into weekly/monthly/... buckets
+
+        Aggregation runs in SQL (date_trunc): one row per bucket with the
+        open/high/low/close of total_value, the closing invested capital and
+        P&L and the P&L accumulated in the bucket. Positions, if requested,
+        are those of the last snapshot of each bucket, loaded in one query.
+
+        Args:
+            db: Database session
+            portfolio_id: Portfolio ID
+            from_date: Start date
+            to_date: End date
+            resolution: weekly, monthly, quarterly or yearly
+            include_positions: Include position details
+            position_fields: Position fields to return (None = all)
+
+        Returns:
+            List of buckets ordered by date
+        """
+        # Inline unit (fixed whitelist) so GROUP BY matches the selected expression
+        unit = literal_column(f"'{HISTORY_RESOLUTION_UNITS[resolution]}'")
+        bucket = func.date_trunc(unit, PortfolioSnapshot.snapshot_date).label("bucket")
+
+        def last(column):
+            return array_agg(aggregate_order_by(column, desc(PortfolioSnapshot.snapshot_date)))[1]
+
+        def first(column):
+            return array_agg(aggregate_order_by(column, PortfolioSnapshot.snapshot_date))[1]
+
+        rows = db.execute(
+            select(
+                bucket,
+                func.max(PortfolioSnapshot.snapshot_date).label("last_date"),
+                func.count().label("count"),
+                last(PortfolioSnapshot.id).label("last_id"),
+                first(PortfolioSnapshot.total_value).label("open"),
+                func.max(PortfolioSnapshot.total_value).label("high"),
+                func.min(PortfolioSnapshot.total_value).label("low"),
+                last(PortfolioSnapshot.total_value).label("close"),
+                last(PortfolioSnapshot.total_invested).label("total_invested"),
+                last(PortfolioSnapshot.total_pnl).label("total_pnl"),
+                last(PortfolioSnapshot.total_pnl_percent).label("total_pnl_percent"),
+                func.sum(PortfolioSnapshot.daily_pnl).label("period_pnl"),
+                last(PortfolioSnapshot.number_of_positions).label("number_of_positions"),
+                last(PortfolioSnapshot.number_of_assets).label("number_of_assets"),
+            )
+            .where(
+                and_(
+                    PortfolioSnapshot.portfolio_id == portfolio_id,
+                    PortfolioSnapshot.snapshot_date >= from_date,
+                    PortfolioSnapshot.snapshot_date <= to_date
+                )
+            )
+            .group_by(bucket)
+            .order_by(bucket)
+        ).all()
+
+        positions_by_snapshot: Dict[UUID, List[Dict]] = {}
+        if include_positions and rows:
+            positions_by_snapshot, _ = SnapshotService._load_positions(
+                db,
+                PositionSnapshot.portfolio_snapshot_id.in_([row.last_id for row in rows]),
+                position_fields
+            )
+
+        history = []
+        for row in rows:
+            close = float(row.close)
+            period_pnl = float(row.period_pnl)
+            start_value = close - period_pnl
+            bucket_dict = {
+                "id": str(row.last_id),
+                "date": row.last_date.isoformat(),
+                "period_start": row.bucket.date().isoformat(),
+                "count": int(row.count),
+                "open": float(row.open),
+                "high": float(row.high),
+                "low": float(row.low),
+                "close": close,
+                "total_invested": float(row.total_invested),
+                "total_value": close,
+                "daily_pnl": period_pnl,
+                "daily_pnl_percent": (period_pnl / start_value * 100) if start_value > 0 else 0.0,
+                "total_pnl": float(row.total_pnl),
+                "total_pnl_percent": float(row.total_pnl_percent),
+                "number_of_positions": int(row.number_of_positions),
+                "number_of_assets": int(row.number_of_assets),
+            }
+            if include_positions:
+                bucket_dict["positions"] = positions_by_snapshot.get(row.last_id, [])
+            history.append(bucket_dict)
+
+        return history
+
     @staticmethod
     def get_snapshot_history(
         db: Session,
         portfolio_id: UUID,
         from_date: date,
         to_date: date,
-        include_positions: bool = False
+        include_positions: bool = False,
+        position_fields: Optional[List[str]] = None,
+        max_position_rows: Optional[int] = POSITION_ROW_LIMIT
     ) -> List[Dict]:
         """
         Get snapshot history for a portfolio
-        
+
+        Positions for the whole range are fetched in one query. If they
+        exceed max_position_rows, the snapshots whose positions were cut
+        carry "positions_truncated": True.
+
         Args:
             db: Database session
             portfolio_id: Portfolio ID
             from_date: Start date
             to_date: End date
             include_positions: Include position details
-            
+            position_fields: Position fields to return (None = all)
+            max_position_rows: Maximum position rows (None = no limit)
+
         Returns:
             List of snapshots
         """
@@ -385,6 +903,20 @@ class SnapshotService:
         )
         snapshots = result.scalars().all()
 
+        positions_by_snapshot: Dict[UUID, List[Dict]] = {}
+        truncated_from: Optional[date] = None
+        if include_positions and snapshots:
+            positions_by_snapshot, truncated_from = SnapshotService._load_positions(
+                db,
+                and_(
+                    PortfolioSnapshot.portfolio_id == portfolio_id,
+                    PositionSnapshot.snapshot_date >= from_date,
+                    PositionSnapshot.snapshot_date <= to_date
+                ),
+                position_fields,
+                max_position_rows
+            )
+
         history = []
         for snapshot in snapshots:
             snapshot_dict = {
@@ -401,32 +933,9 @@ class SnapshotService:
             }
 
             if include_positions:
-                # Get positions for this snapshot
-                positions_result = db.execute(
-                    select(PositionSnapshot, Asset)
-                    .join(Asset, PositionSnapshot.asset_id == Asset.id)
-                    .where(PositionSnapshot.portfolio_snapshot_id == snapshot.id)
-                    .order_by(desc(PositionSnapshot.current_value))
-                )
-                positions_with_assets = positions_result.all()
-
-                snapshot_dict["positions"] = [
-                    {
-                        "symbol": pos.ticker,
-                        "name": asset.name or pos.ticker,
-                        "asset_type": asset.asset_type.value if hasattr(asset.asset_type, 'value') else "STOCK",
-                        "quantity": float(pos.quantity),
-                        "average_price": float(pos.average_buy_price),
-                        "current_price": float(pos.current_price),
-                        "current_value": float(pos.current_value),
-                        "cost_basis": float(pos.total_cost),
-                        "profit_loss": float(pos.position_pnl),
-                        "profit_loss_percent": float(pos.position_pnl_percent),
-                        "daily_change_percent": float(pos.daily_change_percent),
-                        "portfolio_weight": float(pos.portfolio_weight),
-                    }
-                    for pos, asset in positions_with_assets
-                ]
+                snapshot_dict["positions"] = positions_by_snapshot.get(snapshot.id, [])
+                if truncated_from is not None and snapshot.snapshot_date >= truncated_from:
+                    snapshot_dict["positions_truncated"] = True
 
             history.append(snapshot_dict)
 
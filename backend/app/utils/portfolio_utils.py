@@ -1,8 +1,13 @@
-from fastapi import HTTPException, status
+import asyncio
+from datetime import date
+from fastapi import BackgroundTasks, HTTPException, status
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from uuid import UUID
 
 from app.models.portfolio import Portfolio
+from app.services.snapshot_queue import snapshot_recalc_queue
 
 
 def get_user_portfolio_or_404(db: Session, portfolio_id: UUID, user_id: UUID) -> Portfolio:
@@ -16,3 +21,32 @@ def get_user_portfolio_or_404(db: Session, portfolio_id: UUID, user_id: UUID) ->
             status_code=status.HTTP_404_NOT_FOUND, detail="Cartera no encontrada"
         )
     return portfolio
+
+
+async def get_user_portfolio_or_404_async(db: AsyncSession, portfolio_id: UUID, user_id: UUID) -> Portfolio:
+    """Versión para rutas con sesión asíncrona"""
+    result = await db.execute(
+        select(Portfolio).where(Portfolio.id == portfolio_id, Portfolio.user_id == user_id)
+    )
+    portfolio = result.scalar_one_or_none()
+    if not portfolio:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="Cartera no encontrada"
+        )
+    return portfolio
+
+
+async def schedule_snapshot_recalculation(
+    background_tasks: BackgroundTasks, portfolio_id: UUID, from_date: date
+):
+    """
+    Encolar el recálculo de snapshots en la cola de Celery (fusionado y con
+    debounce por portfolio). Si Redis no está disponible, se recalcula en
+    una BackgroundTask como último recurso.
+
+    enqueue usa el cliente síncrono de Redis y publica en el broker, así
+    que se ejecuta en un hilo para no bloquear el event loop (sobre todo
+    mientras Redis no responde y se agotan los timeouts).
+    """
+    if not await asyncio.to_thread(snapshot_recalc_queue.enqueue, portfolio_id, from_date):
+        background_tasks.add_task(snapshot_recalc_queue.recalculate_now, portfolio_id, from_date)
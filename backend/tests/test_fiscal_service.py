@@ -0,0 +1,146 @@
+"""
+Tests de los cierres fiscales anuales (reanudación e invalidación por huella)
+"""
+from datetime import date, datetime, timezone
+from decimal import Decimal
+from types import SimpleNamespace
+
+from app.models.transaction import TransactionType
+from app.services.fiscal_service import FiscalService
+
+
+def make_tx(year, month, transaction_type, quantity, price, asset_id="asset-1", symbol="NVDA"):
+    return SimpleNamespace(
+        asset_id=asset_id,
+        symbol=symbol,
+        transaction_type=transaction_type,
+        quantity=quantity,
+        price=price,
+        transaction_date=datetime(year, month, 1, 10, 0, tzinfo=timezone.utc)
+    )
+
+
+class FakeDB:
+    def __init__(self, closes):
+        self.closes = closes
+
+    def scalars(self, stmt):
+        return list(self.closes.values())
+
+
+class FakeFiscalService(FiscalService):
+    """FiscalService en memoria: transacciones en una lista y cierres en un dict"""
+
+    def __init__(self, transactions):
+        self.closes = {}
+        super().__init__(FakeDB(self.closes))
+        self.transactions = transactions
+        self.changed_at = {}
+        self.loaded_from = []
+
+    def _year_fingerprints(self, portfolio_id):
+        fingerprints = {}
+        for tx in self.transactions:
+            year = tx.transaction_date.year
+            count, _ = fingerprints.get(year, (0, None))
+            fingerprints[year] = (count + 1, self.changed_at.get(year))
+        return fingerprints
+
+    def _load_transactions(self, portfolio_id, from_year, to_year):
+        self.loaded_from.append(from_year)
+        return sorted(
+            (tx for tx in self.transactions if from_year <= tx.transaction_date.year <= to_year),
+            key=lambda tx: tx.transaction_date
+        )
+
+    def _save_closes(self, portfolio_id, from_year, rows):
+        for year in [year for year in self.closes if year >= from_year]:
+            del self.closes[year]
+        for row in rows:
+            self.closes[row["fiscal_year"]] = SimpleNamespace(**row)
+
+
+def results(response):
+    return [(item.date_sell.year, item.quantity, item.result) for item in response.items]
+
+
+def make_service():
+    return FakeFiscalService([
+        make_tx(2020, 1, TransactionType.BUY, 100, 120),
+        make_tx(2020, 6, TransactionType.SELL, 50, 150),
+        make_tx(2021, 3, TransactionType.BUY, 10, 200),
+        make_tx(2022, 2, TransactionType.SELL, 60, 100),
+    ])
+
+
+def test_first_calculation_saves_closed_years():
+    service = make_service()
+
+    response = service.calculate_fiscal_result("portfolio")
+
+    assert service.loaded_from == [2020]
+    assert results(response) == [
+        (2020, Decimal("50"), Decimal("1500")),
+        (2022, Decimal("50"), Decimal("-1000")),
+        (2022, Decimal("10"), Decimal("-1000")),
+    ]
+    assert response.total_result == Decimal("-500")
+    assert min(service.closes) == 2020
+    assert service.closes[2021].open_lots["asset-1"]["lots"] == [
+        ["2020-01-01", "50", "120"],
+        ["2021-03-01", "10", "200"],
+    ]
+
+
+def test_unchanged_years_resume_from_last_close():
+    service = make_service()
+    first = service.calculate_fiscal_result("portfolio")
+    current_year = datetime.now(timezone.utc).year
+
+    second = service.calculate_fiscal_result("portfolio")
+
+    assert service.loaded_from == [2020, current_year]
+    assert results(second) == results(first)
+    assert second.total_result == first.total_result
+
+
+def test_back_dated_transaction_invalidates_its_year_and_later():
+    service = make_service()
+    service.calculate_fiscal_result("portfolio")
+
+    service.transactions.append(make_tx(2021, 9, TransactionType.SELL, 20, 130))
+    response = service.calculate_fiscal_result("portfolio")
+
+    assert service.loaded_from[-1] == 2021
+    assert results(response) == [
+        (2020, Decimal("50"), Decimal("1500")),
+        (2021, Decimal("20"), Decimal("200")),
+        (2022, Decimal("30"), Decimal("-600")),
+        (2022, Decimal("10"), Decimal("-1000")),
+    ]
+    assert service.closes[2021].transaction_count == 2
+
+
+def test_edited_transaction_invalidates_its_year():
+    service = make_service()
+    service.calculate_fiscal_result("portfolio")
+
+    # Misma cantidad de transacciones pero precio editado en 2020
+    service.transactions[1].price = 170
+    service.changed_at[2020] = datetime(2024, 5, 1, tzinfo=timezone.utc)
+    response = service.calculate_fiscal_result("portfolio")
+
+    assert service.loaded_from[-1] == 2020
+    assert results(response)[0] == (2020, Decimal("50"), Decimal("2500"))
+
+
+def test_date_filters_apply_to_resumed_years():
+    service = make_service()
+    service.calculate_fiscal_result("portfolio")
+
+    response = service.calculate_fiscal_result(
+        "portfolio", start_date=date(2022, 1, 1), end_date=date(2022, 12, 31)
+    )
+
+    assert [item.date_sell.year for item in response.items] == [2022, 2022]
+    assert response.total_result == Decimal("-2000")
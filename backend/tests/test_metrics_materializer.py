@@ -0,0 +1,185 @@
+"""
+Tests for the incremental SnapshotMetrics materialization
+"""
+from datetime import date, timedelta
+
+import numpy as np
+import pytest
+from sqlalchemy import create_engine, select
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.orm import sessionmaker
+
+from app.core.database import Base
+from app.models import (
+    Asset,
+    AssetType,
+    Portfolio,
+    PortfolioSnapshot,
+    PositionSnapshot,
+    SnapshotMetrics,
+    Usuario,
+)
+from app.services.metrics_materializer import VOLATILITY_WINDOW, MetricsMaterializer
+from app.services.performance_analytics import PerformanceAnalytics
+
+
+@compiles(JSONB, "sqlite")
+def _compile_jsonb_sqlite(type_, compiler, **kw):
+    return "JSON"
+
+
+START = date(2023, 11, 1)
+DAYS = 450
+
+NUMERIC_COLUMNS = (
+    "weekly_return",
+    "monthly_return",
+    "yearly_return",
+    "ytd_return",
+    "daily_volatility",
+    "weekly_volatility",
+    "sharpe_ratio",
+    "max_drawdown",
+    "best_day_return",
+    "worst_day_return",
+)
+OTHER_COLUMNS = (
+    "max_drawdown_date",
+    "best_day_date",
+    "worst_day_date",
+    "asset_allocation",
+    "sector_allocation",
+)
+
+
+@pytest.fixture
+def db():
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine, autoflush=False)()
+    try:
+        yield session
+    finally:
+        session.close()
+        engine.dispose()
+
+
+@pytest.fixture
+def portfolio(db):
+    """Portfolio with a daily snapshot over DAYS days and a deposit on day 200"""
+    user = Usuario(username="metrics", email="metrics@example.com", hashed_password="x")
+    db.add(user)
+    db.flush()
+    portfolio = Portfolio(name="Metrics", user_id=user.id)
+    stock = Asset(symbol="AAA", name="AAA Inc", asset_type=AssetType.STOCK)
+    etf = Asset(symbol="BBB", name="BBB ETF", asset_type=AssetType.ETF)
+    db.add_all([portfolio, stock, etf])
+    db.flush()
+
+    rng = np.random.default_rng(7)
+    value = invested = 1000.0
+    for day in range(DAYS):
+        if day:
+            value *= 1.0 + rng.normal(0.0005, 0.02)
+        if day == 200:
+            value += 500.0
+            invested += 500.0
+        snapshot_date = START + timedelta(days=day)
+        snapshot = PortfolioSnapshot(
+            portfolio_id=portfolio.id,
+            snapshot_date=snapshot_date,
+            total_invested=invested,
+            total_value=value,
+            number_of_positions=2,
+            number_of_assets=2
+        )
+        db.add(snapshot)
+        db.flush()
+        stock_weight = 60.0 + (day % 10)
+        for asset, weight in ((stock, stock_weight), (etf, 100.0 - stock_weight)):
+            db.add(PositionSnapshot(
+                portfolio_snapshot_id=snapshot.id,
+                asset_id=asset.id,
+                snapshot_date=snapshot_date,
+                ticker=asset.symbol,
+                quantity=1,
+                average_buy_price=1,
+                current_price=1,
+                total_cost=invested * weight / 100,
+                current_value=value * weight / 100,
+                position_pnl=0,
+                position_pnl_percent=0,
+                portfolio_weight=weight
+            ))
+    db.commit()
+    return portfolio
+
+
+def load_rows(db, portfolio_id):
+    return {
+        row.metric_date: row
+        for row in db.scalars(select(SnapshotMetrics).where(SnapshotMetrics.portfolio_id == portfolio_id))
+    }
+
+
+def assert_same_rows(actual, expected):
+    assert sorted(actual) == sorted(expected)
+    for metric_date, expected_row in expected.items():
+        actual_row = actual[metric_date]
+        for column in NUMERIC_COLUMNS:
+            expected_value = getattr(expected_row, column)
+            actual_value = getattr(actual_row, column)
+            if expected_value is None:
+                assert actual_value is None, (metric_date, column)
+            else:
+                assert float(actual_value) == pytest.approx(float(expected_value), abs=1e-6), (metric_date, column)
+        for column in OTHER_COLUMNS:
+            assert getattr(actual_row, column) == getattr(expected_row, column), (metric_date, column)
+
+
+def rebuild(db, portfolio_id):
+    db.query(SnapshotMetrics).delete()
+    db.commit()
+    assert MetricsMaterializer.materialize(db, portfolio_id, START) == DAYS
+    return load_rows(db, portfolio_id)
+
+
+def test_daily_increments_match_full_rebuild(db, portfolio):
+    assert MetricsMaterializer.materialize(db, portfolio.id, START, START + timedelta(days=299)) == 300
+    for day in range(300, DAYS):
+        current = START + timedelta(days=day)
+        assert MetricsMaterializer.materialize(db, portfolio.id, current, current) == 1
+    incremental = load_rows(db, portfolio.id)
+
+    assert_same_rows(incremental, rebuild(db, portfolio.id))
+
+
+def test_back_dated_change_matches_full_rebuild(db, portfolio):
+    MetricsMaterializer.materialize(db, portfolio.id, START)
+
+    changed_date = START + timedelta(days=380)
+    snapshot = db.scalars(
+        select(PortfolioSnapshot).where(PortfolioSnapshot.snapshot_date == changed_date)
+    ).one()
+    snapshot.total_value = float(snapshot.total_value) * 0.7
+    db.commit()
+
+    assert MetricsMaterializer.materialize(db, portfolio.id, changed_date) == DAYS - 380
+    incremental = load_rows(db, portfolio.id)
+
+    assert_same_rows(incremental, rebuild(db, portfolio.id))
+    assert incremental[changed_date].worst_day_date == changed_date
+
+
+def test_rolling_volatility_matches_snapshot_returns(db, portfolio):
+    MetricsMaterializer.materialize(db, portfolio.id, START)
+    last_date = START + timedelta(days=DAYS - 1)
+    last = load_rows(db, portfolio.id)[last_date]
+
+    series = PerformanceAnalytics.load_series(db, portfolio.id, None, last_date)
+    returns = PerformanceAnalytics.daily_returns(series)
+
+    assert float(last.daily_volatility) == pytest.approx(
+        np.std(returns[-VOLATILITY_WINDOW:], ddof=1) * 100, abs=1e-5
+    )
@@ -0,0 +1,142 @@
+"""
+Tests for the vectorized performance metrics
+"""
+import numpy as np
+import pytest
+
+from app.services.performance_analytics import (
+    DAYS_PER_YEAR,
+    METRIC_KEYS,
+    PerformanceAnalytics,
+    SnapshotSeries,
+)
+
+
+def make_series(days, values, invested):
+    dates = np.datetime64("2024-01-01") + np.array(days, dtype="timedelta64[D]")
+    return SnapshotSeries(
+        dates=dates,
+        total_value=np.array(values, dtype=np.float64),
+        total_invested=np.array(invested, dtype=np.float64)
+    )
+
+
+class TestTimeWeightedReturn:
+    def test_deposit_is_not_counted_as_performance(self):
+        series = make_series([0, 1], [100.0, 200.0], [100.0, 200.0])
+
+        np.testing.assert_allclose(PerformanceAnalytics.daily_returns(series), [0.0])
+
+    def test_returns_chain_across_cash_flows(self):
+        # +10% on day 1, deposit of 100 on day 2 plus another +9.0909%
+        series = make_series([0, 1, 2], [100.0, 110.0, 220.0], [100.0, 100.0, 200.0])
+
+        returns = PerformanceAnalytics.daily_returns(series)
+        np.testing.assert_allclose(returns, [0.1, 120.0 / 110.0 - 1.0])
+
+        metrics = PerformanceAnalytics.compute_metrics(series)
+        assert metrics["time_weighted_return"] == pytest.approx(20.0)
+        # The simple period return does count the deposit
+        assert metrics["period_return"] == pytest.approx(120.0)
+
+    def test_withdrawal_is_not_counted_as_loss(self):
+        series = make_series([0, 1], [100.0, 60.0], [100.0, 50.0])
+
+        np.testing.assert_allclose(PerformanceAnalytics.daily_returns(series), [0.1])
+
+    def test_zero_previous_value_yields_zero_return(self):
+        series = make_series([0, 1], [0.0, 100.0], [0.0, 100.0])
+
+        np.testing.assert_allclose(PerformanceAnalytics.daily_returns(series), [0.0])
+
+
+class TestMoneyWeightedReturn:
+    def test_single_investment_matches_compound_rate(self):
+        # Four years of exactly DAYS_PER_YEAR days each at 10% a year
+        series = make_series([0, 1461], [100.0, 100.0 * 1.1 ** 4], [100.0, 100.0])
+
+        assert PerformanceAnalytics.money_weighted_return(series) == pytest.approx(0.1, abs=1e-8)
+
+    def test_rate_zeroes_npv_with_intermediate_flows(self):
+        days = [0, 200, 400, 730]
+        series = make_series(days, [1000.0, 1600.0, 1300.0, 1500.0], [1000.0, 1500.0, 1200.0, 1200.0])
+
+        rate = PerformanceAnalytics.money_weighted_return(series)
+
+        flows = np.array([-1000.0, -500.0, 300.0, 1500.0])
+        years = np.array(days) / DAYS_PER_YEAR
+        assert rate is not None
+        assert np.sum(flows / (1.0 + rate) ** years) == pytest.approx(0.0, abs=1e-6)
+
+    def test_total_loss_is_undetermined(self):
+        series = make_series([0, 365], [100.0, 0.0], [100.0, 100.0])
+
+        assert PerformanceAnalytics.money_weighted_return(series) is None
+
+    def test_single_snapshot_is_undetermined(self):
+        series = make_series([0], [100.0], [100.0])
+
+        assert PerformanceAnalytics.money_weighted_return(series) is None
+
+
+class TestMaxDrawdown:
+    def test_peak_trough_and_recovery_dates(self):
+        dates = np.datetime64("2024-01-01") + np.arange(5)
+        wealth = np.array([1.0, 1.2, 0.9, 1.0, 1.3])
+
+        result = PerformanceAnalytics.max_drawdown(dates, wealth)
+
+        assert result == {
+            "max_drawdown": -25.0,
+            "peak_date": "2024-01-02",
+            "trough_date": "2024-01-03",
+            "recovery_date": "2024-01-05"
+        }
+
+    def test_unrecovered_drawdown(self):
+        dates = np.datetime64("2024-01-01") + np.arange(4)
+        wealth = np.array([1.0, 0.8, 1.1, 0.55])
+
+        result = PerformanceAnalytics.max_drawdown(dates, wealth)
+
+        assert result["max_drawdown"] == -50.0
+        assert result["peak_date"] == "2024-01-03"
+        assert result["trough_date"] == "2024-01-04"
+        assert result["recovery_date"] is None
+
+    def test_monotonic_growth_has_no_drawdown(self):
+        dates = np.datetime64("2024-01-01") + np.arange(3)
+
+        result = PerformanceAnalytics.max_drawdown(dates, np.array([1.0, 1.1, 1.2]))
+
+        assert result["max_drawdown"] == 0.0
+        assert result["peak_date"] is None
+
+
+class TestRollingStd:
+    @pytest.mark.parametrize("window", [2, 5, 30])
+    def test_matches_numpy_std_per_window(self, window):
+        returns = np.random.default_rng(42).normal(0.0005, 0.02, size=120)
+
+        expected = [np.std(returns[i:i + window], ddof=1) for i in range(len(returns) - window + 1)]
+
+        np.testing.assert_allclose(PerformanceAnalytics.rolling_std(returns, window), expected, atol=1e-12)
+
+    def test_constant_returns_have_zero_volatility(self):
+        result = PerformanceAnalytics.rolling_std(np.full(10, 0.01), 5)
+
+        assert np.all(result >= 0)
+        np.testing.assert_allclose(result, 0.0, atol=1e-9)
+
+    def test_series_shorter_than_window(self):
+        assert len(PerformanceAnalytics.rolling_std(np.array([0.1, 0.2]), 30)) == 0
+
+
+def test_compute_metrics_returns_every_metric_key():
+    series = make_series(range(40), np.linspace(100.0, 140.0, 40), np.full(40, 100.0))
+
+    metrics = PerformanceAnalytics.compute_metrics(series)
+
+    assert set(metrics) == set(METRIC_KEYS)
+    assert metrics["number_of_days"] == 40
+    assert metrics["rolling_volatility"]["window"] == 30
@@ -0,0 +1,188 @@
+"""
+Tests del cálculo de posiciones (ledger incremental y recálculo completo)
+"""
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+from types import SimpleNamespace
+from uuid import uuid4
+
+import pytest
+
+from app.services.position_service import PositionService
+
+
+BASE_DATE = datetime(2025, 1, 1, 10, 0, tzinfo=timezone.utc)
+
+
+def make_tx(transaction_type, quantity, price, days=0, tx_id=None):
+    return SimpleNamespace(
+        id=tx_id or uuid4(),
+        portfolio_id="portfolio",
+        asset_id="asset",
+        transaction_type=transaction_type,
+        quantity=quantity,
+        price=price,
+        transaction_date=BASE_DATE + timedelta(days=days)
+    )
+
+
+class TestApply:
+    def test_buy_accumulates_quantity_and_cost(self):
+        quantity, total_cost = PositionService._apply(Decimal('10'), Decimal('1000'), "buy", 5, 130)
+
+        assert quantity == Decimal('15')
+        assert total_cost == Decimal('1650')
+
+    def test_sell_reduces_cost_proportionally(self):
+        quantity, total_cost = PositionService._apply(Decimal('10'), Decimal('1000'), "sell", 4, 999)
+
+        assert quantity == Decimal('6')
+        # El precio de venta no afecta al coste medio restante
+        assert total_cost == Decimal('600')
+        assert total_cost / quantity == Decimal('100')
+
+    def test_sell_to_zero_clears_cost(self):
+        quantity, total_cost = PositionService._apply(Decimal('10'), Decimal('1000'), "sell", 10, 150)
+
+        assert quantity == Decimal('0')
+        assert total_cost == Decimal('0')
+        assert PositionService._position_values(quantity, total_cost) == (Decimal('0'), Decimal('0'))
+
+    def test_oversell_leaves_short_position_without_cost(self):
+        quantity, total_cost = PositionService._apply(Decimal('10'), Decimal('1000'), "sell", 15, 150)
+
+        assert quantity == Decimal('-5')
+        assert total_cost == Decimal('0')
+        assert PositionService._position_values(quantity, total_cost) == (Decimal('-5'), Decimal('0'))
+
+    def test_sell_without_position(self):
+        quantity, total_cost = PositionService._apply(Decimal('0'), Decimal('0'), "withdrawal", 3, 10)
+
+        assert quantity == Decimal('-3')
+        assert total_cost == Decimal('0')
+
+    def test_dividend_does_not_change_position(self):
+        quantity, total_cost = PositionService._apply(Decimal('10'), Decimal('1000'), "dividend", 10, 2)
+
+        assert (quantity, total_cost) == (Decimal('10'), Decimal('1000'))
+
+    def test_float_inputs_keep_decimal_precision(self):
+        quantity, total_cost = PositionService._apply(Decimal('0'), Decimal('0'), "buy", 0.1, 0.2)
+
+        assert quantity == Decimal('0.1')
+        assert total_cost == Decimal('0.02')
+
+
+class TestReplay:
+    def test_replay_matches_step_by_step_application(self):
+        transactions = [
+            make_tx("buy", 100, 120, days=0),
+            make_tx("buy", 50, 150, days=1),
+            make_tx("sell", 30, 200, days=2),
+            make_tx("deposit", 10, 90, days=3),
+        ]
+
+        quantity, total_cost = PositionService._replay(transactions)
+
+        assert quantity == Decimal('130')
+        # 150 uds a coste 19500 -> vender 30 deja 15600; luego +900
+        assert total_cost == Decimal('16500')
+
+    def test_replay_sell_to_zero_then_rebuy_starts_fresh(self):
+        transactions = [
+            make_tx("buy", 10, 100, days=0),
+            make_tx("sell", 10, 120, days=1),
+            make_tx("buy", 5, 80, days=2),
+        ]
+
+        quantity, total_cost = PositionService._replay(transactions)
+
+        assert PositionService._position_values(quantity, total_cost) == (Decimal('5'), Decimal('80'))
+
+    def test_replay_without_transactions(self):
+        assert PositionService._replay([]) == (Decimal('0'), Decimal('0'))
+
+
+class FakePositionService(PositionService):
+    """PositionService sin base de datos: registra qué camino toma apply_transaction"""
+
+    def __init__(self, ledger):
+        super().__init__(db=None)
+        self.ledger = ledger
+        self.recalculated = False
+        self.saved = None
+
+    def _get_ledger(self, portfolio_id, asset_id, for_update=False):
+        return self.ledger
+
+    def recalculate_position(self, portfolio_id, asset_id):
+        self.recalculated = True
+        return "recalculated"
+
+    def _save_position(self, portfolio_id, asset_id, quantity, total_cost):
+        self.saved = (quantity, total_cost)
+        return "saved"
+
+
+def make_ledger(last_tx):
+    return SimpleNamespace(
+        quantity=Decimal('10'),
+        total_cost=Decimal('1000'),
+        last_transaction_date=last_tx.transaction_date,
+        last_transaction_id=last_tx.id,
+        transaction_count=1
+    )
+
+
+class TestApplyTransaction:
+    def test_appended_transaction_updates_ledger_incrementally(self):
+        last = make_tx("buy", 10, 100, days=0)
+        ledger = make_ledger(last)
+        service = FakePositionService(ledger)
+        new = make_tx("buy", 10, 200, days=1)
+
+        assert service.apply_transaction(new) == "saved"
+        assert not service.recalculated
+        assert service.saved == (Decimal('20'), Decimal('3000'))
+        assert ledger.quantity == Decimal('20')
+        assert ledger.total_cost == Decimal('3000')
+        assert ledger.last_transaction_date == new.transaction_date
+        assert ledger.last_transaction_id == new.id
+        assert ledger.transaction_count == 2
+
+    def test_back_dated_transaction_triggers_full_recalculation(self):
+        last = make_tx("buy", 10, 100, days=5)
+        ledger = make_ledger(last)
+        service = FakePositionService(ledger)
+
+        assert service.apply_transaction(make_tx("sell", 5, 100, days=1)) == "recalculated"
+        assert service.saved is None
+        assert ledger.transaction_count == 1
+
+    def test_same_date_uses_id_as_tie_breaker(self):
+        last = make_tx("buy", 10, 100, tx_id="00000000-0000-0000-0000-000000000005")
+        service = FakePositionService(make_ledger(last))
+        before = make_tx("buy", 1, 100, tx_id="00000000-0000-0000-0000-000000000001")
+        after = make_tx("buy", 1, 100, tx_id="00000000-0000-0000-0000-000000000009")
+
+        assert service.apply_transaction(before) == "recalculated"
+
+        service = FakePositionService(make_ledger(last))
+        assert service.apply_transaction(after) == "saved"
+
+    def test_naive_dates_are_compared_as_utc(self):
+        last = make_tx("buy", 10, 100, days=0)
+        service = FakePositionService(make_ledger(last))
+        new = make_tx("buy", 1, 100, days=1)
+        new.transaction_date = new.transaction_date.replace(tzinfo=None)
+
+        assert service.apply_transaction(new) == "saved"
+
+    @pytest.mark.parametrize("ledger", [
+        None,
+        SimpleNamespace(last_transaction_date=None, last_transaction_id=None),
+    ])
+    def test_missing_ledger_triggers_full_recalculation(self, ledger):
+        service = FakePositionService(ledger)
+
+        assert service.apply_transaction(make_tx("buy", 1, 100)) == "recalculated"
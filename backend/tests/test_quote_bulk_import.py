@@ -0,0 +1,175 @@
+"""
+Tests de la importación masiva de cotizaciones (conteo de altas, cambios y omisiones)
+"""
+import uuid
+from datetime import datetime
+from decimal import Decimal
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy.dialects import postgresql
+
+from app.schemas.quote import QuoteBulkCreate, QuoteCreate
+from app.services.quote_service import QuoteService
+
+
+AAPL = uuid.uuid4()
+MSFT = uuid.uuid4()
+
+
+class FakeResult:
+    def __init__(self, rows):
+        self.rows = rows
+
+    def all(self):
+        return self.rows
+
+
+class FakeSession:
+    """
+    Sesión que simula INSERT ... ON CONFLICT de PostgreSQL sobre (asset_id, timestamp)
+
+    Devuelve las filas de RETURNING con `inserted` como lo haría (xmax = 0).
+    """
+
+    def __init__(self, existing=(), fail_on_call=None):
+        self.quotes = {key: {"id": uuid.uuid4(), "close": Decimal("1")} for key in existing}
+        self.fail_on_call = fail_on_call
+        self.calls = 0
+        self.commits = 0
+        self.rollbacks = 0
+
+    def execute(self, stmt):
+        self.calls += 1
+        if self.calls == self.fail_on_call:
+            raise RuntimeError("connection lost")
+
+        compiled = stmt.compile(dialect=postgresql.dialect())
+        sql = str(compiled)
+        assert "ON CONFLICT ON CONSTRAINT uq_quote_asset_timestamp" in sql
+        do_update = "DO UPDATE" in sql
+
+        params = compiled.params
+        returned = []
+        index = 0
+        while f"id_m{index}" in params:
+            key = (params[f"asset_id_m{index}"], params[f"timestamp_m{index}"])
+            if key not in self.quotes:
+                self.quotes[key] = {"id": params[f"id_m{index}"], "close": params[f"close_m{index}"]}
+                returned.append(SimpleNamespace(id=params[f"id_m{index}"], inserted=True))
+            elif do_update:
+                self.quotes[key]["close"] = params[f"close_m{index}"]
+                returned.append(SimpleNamespace(id=self.quotes[key]["id"], inserted=False))
+            index += 1
+        return FakeResult(returned)
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        self.rollbacks += 1
+
+
+def make_service(session, chunk_size=None):
+    service = QuoteService(session)
+    service._get_asset_ids_by_symbols = lambda symbols: {"AAPL": AAPL, "MSFT": MSFT}
+    if chunk_size:
+        service.BULK_CHUNK_SIZE = chunk_size
+    return service
+
+
+def quote(symbol, day, close=100):
+    return QuoteCreate(
+        symbol=symbol,
+        timestamp=datetime(2024, 1, day),
+        open=close, high=close, low=close, close=close
+    )
+
+
+def bulk(quotes, skip_duplicates=True):
+    return QuoteBulkCreate(quotes=quotes, skip_duplicates=skip_duplicates)
+
+
+def test_new_quotes_are_counted_as_created():
+    session = FakeSession()
+
+    response = make_service(session).bulk_import_quotes(
+        bulk([quote("AAPL", 1), quote("AAPL", 2), quote("msft", 1)])
+    )
+
+    assert (response.total, response.created, response.updated, response.skipped) == (3, 3, 0, 0)
+    assert response.errors == []
+    assert len(session.quotes) == 3
+
+
+def test_existing_quotes_are_updated_with_skip_duplicates():
+    session = FakeSession(existing=[(AAPL, datetime(2024, 1, 1))])
+
+    response = make_service(session).bulk_import_quotes(
+        bulk([quote("AAPL", 1, close=150), quote("AAPL", 2), quote("MSFT", 1)])
+    )
+
+    assert (response.created, response.updated, response.skipped) == (2, 1, 0)
+    assert session.quotes[(AAPL, datetime(2024, 1, 1))]["close"] == Decimal("150")
+
+
+def test_existing_quotes_are_reported_without_skip_duplicates():
+    session = FakeSession(existing=[(AAPL, datetime(2024, 1, 1))])
+
+    response = make_service(session).bulk_import_quotes(
+        bulk([quote("AAPL", 1, close=150), quote("AAPL", 2)], skip_duplicates=False)
+    )
+
+    assert (response.created, response.updated, response.skipped) == (1, 0, 1)
+    assert response.errors == ["Duplicado: AAPL en 2024-01-01 00:00:00"]
+    assert session.quotes[(AAPL, datetime(2024, 1, 1))]["close"] == Decimal("1")
+
+
+@pytest.mark.parametrize("skip_duplicates, expected_close, expected_counts", [
+    # Con skip_duplicates la última gana y cuenta como actualización
+    (True, Decimal("200"), (1, 1, 0)),
+    # Sin él se conserva la primera y la repetida se omite
+    (False, Decimal("100"), (1, 0, 1)),
+])
+def test_duplicates_within_request(skip_duplicates, expected_close, expected_counts):
+    session = FakeSession()
+
+    response = make_service(session).bulk_import_quotes(
+        bulk([quote("AAPL", 1, close=100), quote("AAPL", 1, close=200)], skip_duplicates=skip_duplicates)
+    )
+
+    assert (response.created, response.updated, response.skipped) == expected_counts
+    assert session.quotes[(AAPL, datetime(2024, 1, 1))]["close"] == expected_close
+    assert session.calls == 1
+
+
+def test_unknown_symbol_is_skipped():
+    session = FakeSession()
+
+    response = make_service(session).bulk_import_quotes(bulk([quote("AAPL", 1), quote("ZZZZ", 1)]))
+
+    assert (response.created, response.updated, response.skipped) == (1, 0, 1)
+    assert "No se encontró asset para el símbolo ZZZZ" in response.errors[0]
+
+
+def test_rows_are_written_in_chunks_with_one_commit_each():
+    session = FakeSession()
+
+    response = make_service(session, chunk_size=2).bulk_import_quotes(
+        bulk([quote("AAPL", day) for day in range(1, 6)])
+    )
+
+    assert response.created == 5
+    assert (session.calls, session.commits) == (3, 3)
+
+
+def test_failed_chunk_is_rolled_back_and_skipped():
+    session = FakeSession(fail_on_call=2)
+
+    response = make_service(session, chunk_size=2).bulk_import_quotes(
+        bulk([quote("AAPL", day) for day in range(1, 6)])
+    )
+
+    assert (response.created, response.updated, response.skipped) == (3, 0, 2)
+    assert session.rollbacks == 1
+    assert response.errors == ["Error en bloque 2: connection lost"]